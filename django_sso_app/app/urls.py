@@ -7,6 +7,7 @@ from ..core.apps.users.urls import urlpatterns as users_urls
 from ..core.apps.users.urls import extra_urlpatterns as users_extra_urls
 from ..core.apps.profiles.urls import base_urlpatterns as profiles_urls
 from ..core.apps.profiles.urls import extra_urlpatterns as profiles_extra_urls
+from ..core.api.urls import metrics_api_urlpatterns
 from ..core import app_settings
 
 from .views import AppLoginView, AppSignupView, AppLogoutView
@@ -44,4 +45,4 @@ django_sso_app_api_urlpatterns = [
 ] + [
     url(r'^api/v1/auth/', include(users_extra_urls)),
     url(r'^api/v1/auth/', include(profiles_extra_urls)),
-]
+] + metrics_api_urlpatterns
@@ -13,9 +13,10 @@ from ..core.apps.profiles.views import ProfileView, ProfileUpdateView, ProfileCo
 from ..core.apps.services.urls import urlpatterns as services_urls
 from ..core.apps.devices.urls import urlpatterns as devices_urls
 from ..core.apps.passepartout.urls import urlpatterns as passepartout_urls
+from ..core.tokens.urls import urlpatterns as tokens_urls
 
 from ..core.urls import allauth_urlpatterns, allauth_i18n_urlpatterns
-from ..core.api.urls import allauth_api_urlpatterns
+from ..core.api.urls import allauth_api_urlpatterns, metrics_api_urlpatterns
 
 django_sso_app_profile_urlpatterns = [
     url(r'^profile/$', login_required(ProfileView.as_view()), name='profile'),
@@ -34,10 +35,10 @@ django_sso_app_api_urlpatterns += [
     url(r'^api/v1/auth/devices/', include(devices_urls)),
     url(r'^api/v1/auth/services/', include(services_urls)),
     url(r'^api/v1/auth/passepartout/', include(passepartout_urls)),
+    url(r'^api/v1/auth/tokens/', include(tokens_urls)),
 
-    # url('^api/v1/jwt/refresh/?', TokenRefreshView.as_view(), name='token_refresh'),
     # url('^api/v1/jwt/verify/?', TokenVerifyView.as_view(), name='token_verify'),
 ] + [
     url(r'^api/v1/auth/', include(users_extra_urls)),
     url(r'^api/v1/auth/', include(profiles_extra_urls)),
-]
+] + metrics_api_urlpatterns
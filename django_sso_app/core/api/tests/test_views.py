@@ -1,5 +1,7 @@
+import os
 import logging
 import json
+import tempfile
 
 from allauth.account.models import (
     EmailAddress,
@@ -13,6 +15,7 @@ from rest_framework import status
 
 from allauth.account.adapter import get_adapter
 
+from ...metrics import get_counter, generate_text, MULTIPROCESS_FILE_PREFIX
 from ...tests.factories import UserTestCase
 
 User = get_user_model()
@@ -272,3 +275,38 @@ class TestSignup(UserTestCase):
 
         self.assertIsNotNone(new_user.sso_app_profile.groups.filter(name='incomplete').first(),
                              'incomplete user did not enter "incomplete" group on login')
+
+
+class TestMetrics(UserTestCase):
+    def test_staff_user_can_scrape_metrics(self):
+        new_staff_user = self._get_new_staff_user()
+        new_user = self._get_new_user()
+
+        client = self._get_client()
+        response = client.get(reverse('rest_metrics'), **self._get_new_api_token_headers(new_user))
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        response = client.get(reverse('rest_metrics'), **self._get_new_api_token_headers(new_staff_user))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn('# TYPE django_sso_app_logins_total counter', response.content.decode('utf-8'))
+
+    def test_multiprocess_metrics_are_aggregated(self):
+        counter = get_counter('django_sso_app_test_{}_total'.format(self._get_random_string()), 'Test counter',
+                              ('kind', ))
+        counter.inc('a', amount=2)
+
+        with tempfile.TemporaryDirectory() as directory:
+            with self.settings(DJANGO_SSO_APP_METRICS_MULTIPROCESS_DIR=directory):
+                # another worker snapshot
+                with open(os.path.join(directory, '{}0.json'.format(MULTIPROCESS_FILE_PREFIX)), 'w') as f:
+                    json.dump({counter.name: {'type': 'counter', 'documentation': 'Test counter',
+                                              'labelnames': ['kind'], 'buckets': None,
+                                              'series': [[['a'], 3], [['b'], 1]]}}, f)
+
+                text = generate_text()
+
+        self.assertIn('{}{{kind="a"}} 5.0'.format(counter.name), text)
+        self.assertIn('{}{{kind="b"}} 1.0'.format(counter.name), text)
@@ -2,7 +2,7 @@ from django.conf.urls import url
 from django.contrib.auth.decorators import login_required
 
 from .views import SignupView, LoginView, LogoutView, EmailView, PasswordResetView, PasswordResetFromKeyView, \
-                   PasswordChangeView, PasswordSetView
+    PasswordChangeView, PasswordSetView, MetricsApiView
 
 
 allauth_api_urlpatterns = [
@@ -25,3 +25,7 @@ allauth_api_urlpatterns = [
     url(r"^api/v1/auth/password/set/$", PasswordSetView.as_view(),
         name="rest_password_set"),
 ]
+
+metrics_api_urlpatterns = [
+    url(r"^api/v1/metrics/$", MetricsApiView.as_view(), name="rest_metrics"),
+]
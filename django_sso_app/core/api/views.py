@@ -7,6 +7,7 @@ from django.views.decorators.csrf import csrf_exempt
 from django.urls import reverse
 from django.utils.translation import ugettext_lazy as _
 from django.core.exceptions import SuspiciousOperation
+from django.http import HttpResponse
 
 from rest_framework import status, serializers
 from rest_framework.views import APIView
@@ -22,8 +23,10 @@ from ..apps.emails.models import EmailAddress
 from ..apps.users.serializers import SuccessfullLoginResponseSerializer, SuccessfullLogoutResponseSerializer
 from ..apps.passepartout.utils import get_passepartout_login_redirect_url
 from ..apps.emails.serializers import EmailSerializer
-from ..permissions import is_authenticated
-from ..utils import set_session_key, get_session_key, get_random_fingerprint
+from ..permissions import is_authenticated, StaffPermission
+from ..metrics import generate_text
+from ..context import get_request_context
+from ..utils import set_session_key, get_random_fingerprint
 from .. import views as django_sso_app_views
 from .. import app_settings
 
@@ -128,7 +131,7 @@ class LoginView(DjangoSsoAppApiViewMixin, django_sso_app_views.LoginView):
         request = self.request
         data = {
             'user': request.user,
-            'token': get_session_key(request, '__dssoa__jwt_token'),
+            'token': get_request_context(request).jwt_token,
             'redirect_url': get_passepartout_login_redirect_url(request),
         }
         serializer = SuccessfullLoginResponseSerializer(instance=data,
@@ -145,7 +148,7 @@ class LoginView(DjangoSsoAppApiViewMixin, django_sso_app_views.LoginView):
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            set_session_key(request, '__dssoa__device__fingerprint', self.get_request_fingerprint(request))
+            get_request_context(request).device_fingerprint = self.get_request_fingerprint(request)
 
             _response = super(LoginView, self).post(request, *args, **kwargs)
             _status_code = _response.status_code
@@ -168,7 +171,7 @@ class LoginView(DjangoSsoAppApiViewMixin, django_sso_app_views.LoginView):
                 logger.info('user "{}" is not logged in'.format(request.user))
 
                 # check user has unsubscribed
-                user_unsubscribed_at = get_session_key(request, '__dssoa__user_is_unsubscribed', None)
+                user_unsubscribed_at = get_request_context(request).user_is_unsubscribed
                 if user_unsubscribed_at is not None:
                     self.response_error_status = status.HTTP_400_BAD_REQUEST
                     self.response_errors = 'Unsubscribed at "{}"'.format(user_unsubscribed_at)
@@ -475,3 +478,16 @@ class PasswordSetView(DjangoSsoAppApiViewMixin, django_sso_app_views.PasswordSet
             self.update_response_jwt(request, response)
 
             return response
+
+
+# metrics
+
+class MetricsApiView(APIView):
+    """
+    Staff only metrics in prometheus text exposition format.
+    """
+
+    permission_classes = (StaffPermission, )
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(generate_text(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -17,8 +17,12 @@ class AppSettings(object):
             return self.env.tuple(key, default=dflt)
         if type == int:
             return self.env.int(key, default=dflt)
+        elif type == float:
+            return self.env.float(key, default=dflt)
         elif type == list:
             return self.env.list(key, default=dflt)
+        elif type == dict:
+            return self.env.dict(key, default=dflt)
         else:
             return self.env(key, default=dflt)
 
@@ -186,6 +190,10 @@ class AppSettings(object):
     def AUTH_HEADER_TYPES(self):
         return self._setting('AUTH_HEADER_TYPES', ('Bearer',))
 
+    @property
+    def AUTH_HEADER_TYPE_BYTES(self):
+        return set(header_type.encode('iso-8859-1') for header_type in self.AUTH_HEADER_TYPES)
+
     @property
     def JWT_COOKIE_NAME(self):
         return self._setting('JWT_COOKIE_NAME', 'jwt')
@@ -199,14 +207,137 @@ class AppSettings(object):
             'RS256',
             'RS384',
             'RS512',
+            'ES256',
+            'ES384',
+            'ES512',
         )
 
         return self._setting('JWT_ALGORITHM', _JWT_ALLOWED_ALGORITHMS[0])
 
+    @property
+    def JWT_ASYMMETRIC(self):
+        return self.JWT_ALGORITHM[:2] in ('RS', 'ES')
+
     @property
     def TOKENS_JWT_SECRET(self):
         return self._setting('TOKENS_JWT_SECRET', 'secret')
 
+    @property
+    def TOKENS_JWT_KEYS(self):
+        return self._setting('TOKENS_JWT_KEYS', [], list)
+
+    @property
+    def TOKENS_JWT_ACTIVE_KEY_ID(self):
+        return self._setting('TOKENS_JWT_ACTIVE_KEY_ID', None)
+
+    @property
+    def TOKENS_ACCESS_TOKEN_LIFETIME(self):
+        return self._setting('TOKENS_ACCESS_TOKEN_LIFETIME', 0, int)
+
+    @property
+    def TOKENS_JWT_LEEWAY(self):
+        return self._setting('TOKENS_JWT_LEEWAY', 0, int)
+
+    @property
+    def TOKENS_JWT_PRIVATE_KEY(self):
+        return self._setting('TOKENS_JWT_PRIVATE_KEY', None)
+
+    @property
+    def TOKENS_JWT_KEY_ID(self):
+        return self._setting('TOKENS_JWT_KEY_ID', None)
+
+    @property
+    def TOKENS_JWKS_URL(self):
+        return self._setting('TOKENS_JWKS_URL', self.BACKEND_URL + '/api/v1/auth/tokens/jwks/')
+
+    @property
+    def TOKENS_JWKS_CA_BUNDLE(self):
+        # CA bundle path verifying jwks url certificate, system CAs if None
+        return self._setting('TOKENS_JWKS_CA_BUNDLE', None)
+
+    @property
+    def TOKENS_JWKS_CACHE_TIMEOUT(self):
+        return self._setting('TOKENS_JWKS_CACHE_TIMEOUT', 60 * 60, int)
+
+    @property
+    def CACHE_ALIAS(self):
+        return self._setting('CACHE_ALIAS', 'default')
+
+    @property
+    def TOKENS_CACHE_ENABLED(self):
+        # requires a cache shared between processes
+        return self._setting('TOKENS_CACHE_ENABLED', False, bool)
+
+    @property
+    def TOKENS_CACHE_CLASS(self):
+        return self._setting('TOKENS_CACHE_CLASS', 'django_sso_app.core.tokens.cache.DecodedTokenCache')
+
+    @property
+    def TOKENS_CACHE_TIMEOUT(self):
+        return self._setting('TOKENS_CACHE_TIMEOUT', 5 * 60, int)
+
+    @property
+    def TOKENS_CACHE_LOCAL_TIMEOUT(self):
+        return self._setting('TOKENS_CACHE_LOCAL_TIMEOUT', 30, int)
+
+    @property
+    def TOKENS_CACHE_LOCAL_MAXSIZE(self):
+        return self._setting('TOKENS_CACHE_LOCAL_MAXSIZE', 1024, int)
+
+    @property
+    def TOKENS_ISSUER_KEYS_MAXSIZE(self):
+        return self._setting('TOKENS_ISSUER_KEYS_MAXSIZE', 4096, int)
+
+    @property
+    def TOKENS_INTROSPECTION_MAX_TOKENS(self):
+        return self._setting('TOKENS_INTROSPECTION_MAX_TOKENS', 100, int)
+
+    @property
+    def TOKENS_INTROSPECTION_MAX_AGE(self):
+        return self._setting('TOKENS_INTROSPECTION_MAX_AGE', 30, int)
+
+    @property
+    def TOKENS_REVOCATION_ENABLED(self):
+        # revocations reach other processes through a shared cache only
+        return self._setting('TOKENS_REVOCATION_ENABLED', True, bool)
+
+    @property
+    def TOKENS_REVOCATION_TIMEOUT(self):
+        return self._setting('TOKENS_REVOCATION_TIMEOUT', 60 * 60 * 24, int)
+
+    @property
+    def TOKENS_REVOCATION_SYNC_INTERVAL(self):
+        return self._setting('TOKENS_REVOCATION_SYNC_INTERVAL', 5, int)
+
+    @property
+    def TOKENS_REVOCATION_LOG_SIZE(self):
+        return self._setting('TOKENS_REVOCATION_LOG_SIZE', 10000, int)
+
+    @property
+    def DEVICE_KEYS_CACHE_ENABLED(self):
+        # requires a cache shared between processes
+        return self._setting('DEVICE_KEYS_CACHE_ENABLED', False, bool)
+
+    @property
+    def DEVICE_KEYS_CACHE_TIMEOUT(self):
+        return self._setting('DEVICE_KEYS_CACHE_TIMEOUT', 24 * 60 * 60, int)
+
+    @property
+    def DEVICE_KEYS_CACHE_LOCAL_TIMEOUT(self):
+        return self._setting('DEVICE_KEYS_CACHE_LOCAL_TIMEOUT', 30, int)
+
+    @property
+    def DEVICE_KEYS_CACHE_LOCAL_MAXSIZE(self):
+        return self._setting('DEVICE_KEYS_CACHE_LOCAL_MAXSIZE', 4096, int)
+
+    @property
+    def DEVICE_KEYS_CACHE_WARMUP_SIZE(self):
+        return self._setting('DEVICE_KEYS_CACHE_WARMUP_SIZE', 0, int)
+
+    @property
+    def TOKENS_STATELESS_USER(self):
+        return self._setting('TOKENS_STATELESS_USER', False, bool)
+
     @property
     def USER_ID_CLAIM(self):
         return self._setting('USER_ID_CLAIM', 'sso_id')
@@ -281,6 +412,14 @@ class AppSettings(object):
     def REMOTE_USER_URL(self):
         return self.REMOTE_USERS_URL + '{sso_id}/'
 
+    @property
+    def REMOTE_USERS_REVISIONS_URL(self):
+        return self.BACKEND_URL + '/api/v1/auth/get-revisions/'
+
+    @property
+    def REMOTE_USERS_BATCH_URL(self):
+        return self.BACKEND_URL + '/api/v1/auth/get-users/'
+
     @property
     def REMOTE_PROFILES_URL(self):
         return self.BACKEND_URL + '/api/v1/auth/profiles/'
@@ -349,10 +488,129 @@ class AppSettings(object):
     def DEFAULT_PROFILE_GROUPS(self):
         return self._setting('DEFAULT_PROFILE_GROUPS', [], list)
 
+    @property
+    def TIMING_ENABLED(self):
+        return self._setting('TIMING_ENABLED', True, bool)
+
+    @property
+    def SERVER_TIMING_ENABLED(self):
+        return self._setting('SERVER_TIMING_ENABLED', False, bool)
+
+    @property
+    def METRICS_MULTIPROCESS_DIR(self):
+        return self._setting('METRICS_MULTIPROCESS_DIR', None)
+
+    @property
+    def METRICS_FLUSH_INTERVAL(self):
+        return self._setting('METRICS_FLUSH_INTERVAL', 5, int)
+
+    @property
+    def LOGIN_ELIGIBILITY_CACHE_TIMEOUT(self):
+        return self._setting('LOGIN_ELIGIBILITY_CACHE_TIMEOUT', 60 * 60, int)
+
+    @property
+    def IDENTITY_CACHE_TIMEOUT(self):
+        return self._setting('IDENTITY_CACHE_TIMEOUT', 60 * 60, int)
+
+    @property
+    def BACKEND_CONNECT_TIMEOUT(self):
+        return self._setting('BACKEND_CONNECT_TIMEOUT', 3.05, float)
+
+    @property
+    def BACKEND_READ_TIMEOUT(self):
+        return self._setting('BACKEND_READ_TIMEOUT', 10., float)
+
+    @property
+    def BACKEND_TLS_VERIFY(self):
+        return self._setting('BACKEND_TLS_VERIFY', True, bool)
+
+    @property
+    def BACKEND_CA_BUNDLE(self):
+        # CA bundle path verifying backend certificate, system CAs if None
+        return self._setting('BACKEND_CA_BUNDLE', None)
+
+    @property
+    def BACKEND_MAX_RETRIES(self):
+        return self._setting('BACKEND_MAX_RETRIES', 2, int)
+
+    @property
+    def BACKEND_RETRY_BACKOFF(self):
+        return self._setting('BACKEND_RETRY_BACKOFF', .2, float)
+
+    @property
+    def BACKEND_POOL_MAXSIZE(self):
+        return self._setting('BACKEND_POOL_MAXSIZE', 10, int)
+
+    @property
+    def BACKEND_CIRCUIT_BREAKER_THRESHOLD(self):
+        return self._setting('BACKEND_CIRCUIT_BREAKER_THRESHOLD', 5, int)
+
+    @property
+    def BACKEND_CIRCUIT_BREAKER_RESET_TIMEOUT(self):
+        return self._setting('BACKEND_CIRCUIT_BREAKER_RESET_TIMEOUT', 30, int)
+
+    @property
+    def SINGLE_FLIGHT_LOCK_TIMEOUT(self):
+        return self._setting('SINGLE_FLIGHT_LOCK_TIMEOUT', 60, int)
+
+    @property
+    def SINGLE_FLIGHT_WAIT_TIMEOUT(self):
+        return self._setting('SINGLE_FLIGHT_WAIT_TIMEOUT', 30, int)
+
+    @property
+    def REPLICATION_STALE_WHILE_REVALIDATE(self):
+        # authenticate with local user copy while refreshing it from backend in background, only when jwt
+        # claims carry every DJANGO_SSO_APP_REPLICATION_SECURITY_FIELDS value (e.g. ['is_active'])
+        return self._setting('REPLICATION_STALE_WHILE_REVALIDATE', False, bool)
+
+    @property
+    def REPLICATION_SECURITY_FIELDS(self):
+        # refreshed user fields revoking previous profile tokens on change
+        return self._setting('REPLICATION_SECURITY_FIELDS', ['is_active', 'password'], list)
+
+    @property
+    def REPLICATION_REFRESH_TIMEOUT(self):
+        return self._setting('REPLICATION_REFRESH_TIMEOUT', 60 * 5, int)
+
+    @property
+    def SYNC_PAGE_SIZE(self):
+        return self._setting('SYNC_PAGE_SIZE', 500, int)
+
+    @property
+    def SYNC_CONCURRENCY(self):
+        return self._setting('SYNC_CONCURRENCY', 4, int)
+
+    @property
+    def SYNC_CHUNK_SIZE(self):
+        return self._setting('SYNC_CHUNK_SIZE', 50, int)
+
+    @property
+    def USERS_BATCH_MAX_SIZE(self):
+        # max sso_ids per batch users request
+        return self._setting('USERS_BATCH_MAX_SIZE', 500, int)
+
+    @property
+    def LOG_SAMPLE_RATES(self):
+        # {event: rate (0. - 1.)}, see core.logs
+        return self._setting('LOG_SAMPLE_RATES', {}, dict)
+
+    @property
+    def GROUPS_RECONCILIATION_CACHE_TIMEOUT(self):
+        return self._setting('GROUPS_RECONCILIATION_CACHE_TIMEOUT', 60 * 60 * 24, int)
+
     @property
     def SAME_SITE_COOKIE_NONE(self):
         return self._setting('SAME_SITE_COOKIE_NONE', False, bool)
 
+    @property
+    def SESSION_FAST_PATH_ENABLED(self):
+        # requires tokens revocation and a cache shared between processes
+        return self._setting('SESSION_FAST_PATH_ENABLED', False, bool)
+
+    @property
+    def ROUTE_POLICIES(self):
+        return self._setting('ROUTE_POLICIES', [], list)
+
     @property
     def SIGNALS_DISABLED_COMMANDS(self):
         return self._setting('SIGNALS_DISABLED_COMMANDS', ['loaddata', 'dpb_couchdb_loaddata'], list)
@@ -1,3 +1,4 @@
+import time
 import logging
 import requests
 
@@ -5,18 +6,37 @@ from django.contrib.auth import get_user_model
 from django.db import transaction
 
 from .... import app_settings
+from ....metrics import APIGATEWAY_REQUESTS, APIGATEWAY_REQUEST_DURATION
 
 logger = logging.getLogger('django_sso_app')
 User = get_user_model()
 
 
+def _call_apigw(method, url, **kwargs):
+    started_at = time.perf_counter()
+
+    try:
+        r = requests.request(method, url, **kwargs)
+
+    except requests.RequestException:
+        APIGATEWAY_REQUESTS.inc(method, 'error')
+        raise
+
+    finally:
+        APIGATEWAY_REQUEST_DURATION.observe(time.perf_counter() - started_at, method)
+
+    APIGATEWAY_REQUESTS.inc(method, str(r.status_code))
+
+    return r
+
+
 def create_apigw_consumer(custom_id):
     logger.info('creating apigw consumer with custom_id {}'.format(custom_id))
 
     url = app_settings.APIGATEWAY_HOST + "/consumers/"
     data = {'custom_id': custom_id}
 
-    r = requests.post(url, json=data)
+    r = _call_apigw('POST', url, json=data)
 
     status_code = r.status_code
     try:
@@ -38,7 +58,7 @@ def get_apigw_consumer(consumer_id, custom_id=None):
         logger.info('getting apigw consumer with custom_id {}'.format(custom_id))
         url = app_settings.APIGATEWAY_HOST + "/consumers/?custom_id={}".format(custom_id)
 
-    r = requests.get(url)
+    r = _call_apigw('GET', url)
 
     status_code = r.status_code
     try:
@@ -66,7 +86,7 @@ def delete_apigw_consumer(consumer_id):
 
     url = app_settings.APIGATEWAY_HOST + "/consumers/" + consumer_id
 
-    r = requests.delete(url)
+    r = _call_apigw('DELETE', url)
 
     status_code = r.status_code
     try:
@@ -85,7 +105,7 @@ def create_apigw_consumer_jwt(consumer_id):
     url = app_settings.APIGATEWAY_HOST + "/consumers/" + consumer_id + "/jwt/"
     data = {}
 
-    r = requests.post(url, json=data)
+    r = _call_apigw('POST', url, json=data)
 
     status_code = r.status_code
     try:
@@ -105,7 +125,7 @@ def delete_apigw_consumer_jwt(consumer_id, jwt_id):
 
     logger.info('calling kong url "{}"'.format(url))
 
-    r = requests.delete(url)
+    r = _call_apigw('DELETE', url)
 
     status_code = r.status_code
 
@@ -118,7 +138,7 @@ def get_apigw_consumer_jwts(consumer_id):
 
     url = app_settings.APIGATEWAY_HOST + "/consumers/" + consumer_id + "/jwt/"
 
-    r = requests.get(url)
+    r = _call_apigw('GET', url)
 
     status_code = r.status_code
     try:
@@ -138,7 +158,7 @@ def create_apigw_consumer_acl(consumer_id, group_name):
     url = app_settings.APIGATEWAY_HOST + "/consumers/" + consumer_id + "/acls/"
     data = {"group": group_name}
 
-    r = requests.post(url, json=data)
+    r = _call_apigw('POST', url, json=data)
 
     status_code = r.status_code
     try:
@@ -156,7 +176,7 @@ def get_apigw_consumer_acls(consumer_id):
 
     url = app_settings.APIGATEWAY_HOST + "/consumers/" + consumer_id + "/acls/"
 
-    r = requests.get(url)
+    r = _call_apigw('GET', url)
 
     status_code = r.status_code
     try:
@@ -183,7 +203,7 @@ def delete_apigw_consumer_acl(consumer_id, group_name):
     if acl_id is not None:
         url = app_settings.APIGATEWAY_HOST + "/consumers/" + consumer_id + "/acls/" + acl_id
 
-        r = requests.delete(url)
+        r = _call_apigw('DELETE', url)
 
         status_code = r.status_code
 
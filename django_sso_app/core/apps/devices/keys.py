@@ -0,0 +1,136 @@
+import logging
+
+from ...cache import LocalLRUCache, get_shared_cache, warn_if_shared_cache_is_process_local
+from ... import app_settings
+
+logger = logging.getLogger('django_sso_app')
+
+CACHE_KEY_PREFIX = 'dssoa:devices:keys'
+
+_device_key_store = None
+
+
+class DeviceKeyStore(object):
+    """
+    Device JWT signing keys store.
+
+    Serves (apigw_jwt_secret, apigw_jwt_key) by (device_id, fingerprint) from an in-process LRU
+    backed by the shared django cache, so backend shapes can verify device JWTs without querying the db.
+    Requires a cache shared between processes (DJANGO_SSO_APP_CACHE_ALIAS): deleted devices keys are evicted
+    from the shared cache, other processes LRU entries expire after DJANGO_SSO_APP_DEVICE_KEYS_CACHE_LOCAL_TIMEOUT
+    seconds.
+    """
+
+    def __init__(self):
+        self.local = LocalLRUCache(maxsize=app_settings.DEVICE_KEYS_CACHE_LOCAL_MAXSIZE,
+                                   timeout=app_settings.DEVICE_KEYS_CACHE_LOCAL_TIMEOUT)
+
+    @staticmethod
+    def _get_key(device_id, fingerprint):
+        return '{}:{}:{}'.format(CACHE_KEY_PREFIX, device_id, fingerprint)
+
+    def get(self, device_id, fingerprint):
+        key = self._get_key(device_id, fingerprint)
+        device_keys = self.local.get(key)
+
+        if device_keys is None:
+            device_keys = get_shared_cache().get(key)
+
+            if device_keys is not None:
+                self.local.set(key, device_keys)
+
+        return device_keys
+
+    def set(self, device):
+        key = self._get_key(device.id, device.fingerprint)
+        device_keys = (device.apigw_jwt_secret, device.apigw_jwt_key)
+
+        self.local.set(key, device_keys)
+        get_shared_cache().set(key, device_keys, app_settings.DEVICE_KEYS_CACHE_TIMEOUT)
+
+        return device_keys
+
+    def delete(self, device):
+        key = self._get_key(device.id, device.fingerprint)
+
+        self.local.delete(key)
+        get_shared_cache().delete(key)
+
+    def warm_up(self, size):
+        """
+        Loads latest created devices keys
+        :param size:
+        :return:
+        """
+        from .models import Device
+
+        devices = Device.objects.order_by('-created_at').only('id', 'fingerprint',
+                                                              'apigw_jwt_secret', 'apigw_jwt_key')[:size]
+        shared_devices_keys = {}
+
+        for device in devices:
+            key = self._get_key(device.id, device.fingerprint)
+            device_keys = (device.apigw_jwt_secret, device.apigw_jwt_key)
+
+            self.local.set(key, device_keys)
+            shared_devices_keys[key] = device_keys
+
+        get_shared_cache().set_many(shared_devices_keys, app_settings.DEVICE_KEYS_CACHE_TIMEOUT)
+
+        logger.info('%s device keys loaded', len(shared_devices_keys))
+
+        return len(shared_devices_keys)
+
+
+def get_device_key_store(warm_up=True):
+    """
+    Returns process device keys store (None if disabled), warming it up on first use
+    :param warm_up:
+    :return:
+    """
+    global _device_key_store
+
+    if not app_settings.DEVICE_KEYS_CACHE_ENABLED:
+        return None
+
+    warn_if_shared_cache_is_process_local('DEVICE_KEYS_CACHE_ENABLED')
+
+    if _device_key_store is None:
+        _device_key_store = DeviceKeyStore()
+
+        warmup_size = app_settings.DEVICE_KEYS_CACHE_WARMUP_SIZE
+        if warm_up and warmup_size > 0:
+            try:
+                _device_key_store.warm_up(warmup_size)
+            except Exception:
+                logger.exception('Can not warm up device keys store')
+
+    return _device_key_store
+
+
+def warm_up_device_keys(size=None):
+    """
+    Bulk loads latest devices keys, can be called at worker start (e.g. gunicorn "post_fork" hook)
+    :param size:
+    :return:
+    """
+    device_key_store = get_device_key_store(warm_up=False)
+
+    if device_key_store is None:
+        return 0
+
+    return device_key_store.warm_up(size or app_settings.DEVICE_KEYS_CACHE_WARMUP_SIZE)
+
+
+def store_device_keys(device):
+    device_key_store = get_device_key_store()
+
+    if device_key_store is not None:
+        device_key_store.set(device)
+
+
+def evict_device_keys(device):
+    device_key_store = get_device_key_store()
+
+    if device_key_store is not None:
+        device_key_store.delete(device)
@@ -1,3 +1,4 @@
+import time
 import logging
 
 from django.db import models
@@ -6,6 +7,7 @@ from django.urls import reverse
 
 from ..profiles.models import Profile
 from ...models import CreatedAtModel, DeactivableModel
+from ... import app_settings
 
 logger = logging.getLogger('django_sso_app')
 
@@ -37,15 +39,27 @@ class Device(CreatedAtModel, DeactivableModel):
         return reverse("django_sso_app_device:rest-detail", args=[self.pk])
 
     def get_jwt_payload(self):
-        return {
+        profile = self.profile
+
+        payload = {
             'id': self.id,
             'fp': self.fingerprint,
-            'sso_id': str(self.profile.sso_id),
-            'sso_rev': self.profile.sso_rev,
+            'sso_id': str(profile.sso_id),
+            'sso_rev': profile.sso_rev,
             'iss': self.apigw_jwt_key,
             # 'iat': datetime.utcnow()
+            # identity claims, stateless token users (see tokens.models.TokenUser)
+            'is_active': profile.user.is_active,
+            'groups': sorted(group.name for group in profile.groups.all()),
         }
 
+        access_token_lifetime = app_settings.TOKENS_ACCESS_TOKEN_LIFETIME
+        if access_token_lifetime > 0:
+            payload['iat'] = int(time.time())
+            payload['exp'] = payload['iat'] + access_token_lifetime
+
+        return payload
+
     @property
     def user(self):
         return self.profile.user
@@ -2,18 +2,23 @@ import logging
 
 from django.dispatch import receiver
 from django.contrib.auth.signals import user_logged_in, user_logged_out
-from django.db.models.signals import pre_save, post_save
+from django.db.models.signals import pre_save, post_save, pre_delete
 
-from ....utils import set_session_key
+from ....context import get_request_context
 from ....tokens.utils import jwt_encode
+from ....tokens.cache import invalidate_device_tokens
+from ....tokens.revocation import revoke_device_tokens, revoke_profile_tokens
 from ....functions import get_random_string
 from ....permissions import is_django_staff
+from ....timing import timed, STAGE_DEVICE
+from ....metrics import LOGINS, LOGOUTS, DEVICES
 from ...profiles.models import Profile
 
 from .... import app_settings
 
 from ..models import Device
-from ..utils import get_session_key, get_or_create_request_device, remove_all_profile_devices, remove_profile_device
+from ..keys import evict_device_keys
+from ..utils import remove_all_profile_devices, remove_profile_device
 
 logger = logging.getLogger('django_sso_app')
 
@@ -31,13 +36,16 @@ def post_profile_saved(sender, instance, created, **kwargs):
 
     if not is_django_staff(user):
         if not created:  # if instance.pk:
-            logger.debug('Profile "{}" post_save signal'.format(profile))
+            logger.debug('Profile "%s" post_save signal', profile)
 
             rev_updated = getattr(profile, '__rev_updated', False)
 
             if rev_updated:
-                logger.info('Rev updated, removing all user devices for Profile "{}"'.format(profile))
+                logger.info('Rev updated, removing all user devices for Profile "%s"', profile)
 
+                # sso_rev is an F() expression after update_rev
+                sso_rev = Profile.objects.filter(pk=profile.pk).values_list('sso_rev', flat=True).first()
+                revoke_profile_tokens(profile.sso_id, sso_rev)
                 remove_all_profile_devices(profile)
 
 
@@ -50,13 +58,45 @@ def pre_device_save(sender, instance, **kwargs):
         device = instance
 
         if not is_django_staff(user):
-            logger.debug('Skip creating api gateway JWT for Device "{}"'.format(device))
+            logger.debug('Skip creating api gateway JWT for Device "%s"', device)
 
             device.apigw_jwt_id = None
             device.apigw_jwt_key = None
             device.apigw_jwt_secret = device.apigw_jwt_secret or get_random_string(32)
 
 
+@receiver(post_save, sender=Device)
+def count_created_device(sender, instance, created, **kwargs):
+    if created:
+        DEVICES.inc('created')
+
+
+@receiver(pre_delete, sender=Device)
+def count_deleted_device(sender, instance, **kwargs):
+    DEVICES.inc('deleted')
+
+
+@receiver(pre_delete, sender=Device)
+def invalidate_deleted_device_tokens(sender, instance, **kwargs):
+    logger.debug('Invalidating cached tokens for deleted Device "%s"', instance)
+
+    invalidate_device_tokens(instance.id)
+
+
+@receiver(pre_delete, sender=Device)
+def revoke_deleted_device_tokens(sender, instance, **kwargs):
+    logger.debug('Revoking tokens for deleted Device "%s"', instance)
+
+    revoke_device_tokens(instance.id, instance.fingerprint)
+
+
+@receiver(pre_delete, sender=Device)
+def evict_deleted_device_keys(sender, instance, **kwargs):
+    logger.debug('Evicting keys for deleted Device "%s"', instance)
+
+    evict_device_keys(instance)
+
+
 # login
 
 @receiver(user_logged_in)
@@ -76,18 +116,20 @@ def create_profile_device_on_login(sender, request, user, **kwargs):
 
     """
 
-    logger.debug('devices user_logged_in signal for user "{}"'.format(user))
+    logger.debug('devices user_logged_in signal for user "%s"', user)
 
-    set_session_key(request, '__dssoa__logged_in', True)
+    context = get_request_context(request)
+    context.logged_in = True
+    LOGINS.inc()
 
     if not is_django_staff(user):
-        device = get_or_create_request_device(request)
-        token = jwt_encode(device.get_jwt_payload(), device.apigw_jwt_secret)
+        with timed(request, STAGE_DEVICE):
+            device = context.device
+            token = jwt_encode(device.get_jwt_payload(), device.apigw_jwt_secret)
 
-        set_session_key(request, '__dssoa__device', device)
-        set_session_key(request, '__dssoa__jwt_token', token)
+        context.jwt_token = token
 
-        logger.info('User Logged in, request has device "{}"'.format(device))
+        logger.info('User Logged in, request has device "%s"', device)
 
 
 # logout
@@ -114,25 +156,28 @@ Sent when the logout method is called.
         user was not authenticated.
 
     """
-    logger.debug('devices user_logged_out signal for "{}"'.format(user))
+    logger.debug('devices user_logged_out signal for "%s"', user)
 
     if user is not None:
-        set_session_key(request, '__dssoa__logged_out', True)
-
-        request_device_fingerprint = get_session_key(request, '__dssoa__device__fingerprint', None)
-
-        if app_settings.LOGOUT_DELETES_ALL_PROFILE_DEVICES:
-            deleted_devices = remove_all_profile_devices(user.get_sso_app_profile())
-        else:
-            if request_device_fingerprint is not None:
-                request_device = Device.objects.filter(profile=user.get_sso_app_profile(),
-                                                       fingerprint=request_device_fingerprint).first()
-                if request_device is not None:
-                    deleted_devices = remove_profile_device(request_device)
+        context = get_request_context(request)
+        context.logged_out = True
+        LOGOUTS.inc()
+
+        request_device_fingerprint = context.device_fingerprint
+
+        with timed(request, STAGE_DEVICE):
+            if app_settings.LOGOUT_DELETES_ALL_PROFILE_DEVICES:
+                deleted_devices = remove_all_profile_devices(user.get_sso_app_profile())
+            else:
+                if request_device_fingerprint is not None:
+                    request_device = Device.objects.filter(profile=user.get_sso_app_profile(),
+                                                           fingerprint=request_device_fingerprint).first()
+                    if request_device is not None:
+                        deleted_devices = remove_profile_device(request_device)
+                    else:
+                        logger.warning('Request device not found')
+                        deleted_devices = 0
                 else:
-                    logger.warning('Request device not found')
                     deleted_devices = 0
-            else:
-                deleted_devices = 0
 
-        logger.info('({}) devices deleted for user "{}"'.format(deleted_devices, user))
+        logger.info('(%s) devices deleted for user "%s"', deleted_devices, user)
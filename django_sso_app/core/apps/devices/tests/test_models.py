@@ -2,3 +2,43 @@
 # device deletes on user username update
 # device deletes on user password update
 # device deletion calls apigw deletion
+
+from django.test.utils import override_settings
+
+from django_sso_app.core.apps.devices.keys import get_device_key_store, warm_up_device_keys
+from django_sso_app.core.tests.factories import UserTestCase
+from django_sso_app.core.tokens.utils import jwt_decode
+
+
+@override_settings(DJANGO_SSO_APP_DEVICE_KEYS_CACHE_ENABLED=True)
+class TestDeviceKeyStore(UserTestCase):
+
+    def test_device_keys_are_stored_on_creation_and_evicted_on_deletion(self):
+        user = self._get_new_user()
+        device = self._get_user_device(user)
+        device_key_store = get_device_key_store()
+
+        self.assertEqual(device_key_store.get(device.id, device.fingerprint),
+                         (device.apigw_jwt_secret, device.apigw_jwt_key))
+
+        raw_token = self._get_jwt(device, None)
+
+        with self.assertNumQueries(0):
+            jwt_decode(raw_token)
+
+        device.delete()
+
+        self.assertIsNone(device_key_store.get(device.id, device.fingerprint))
+
+    def test_device_keys_warm_up(self):
+        user = self._get_new_user()
+        device = self._get_user_device(user)
+        device_key_store = get_device_key_store()
+        device_key_store.delete(device)
+
+        self.assertGreaterEqual(warm_up_device_keys(10), 1)
+        self.assertIsNotNone(device_key_store.get(device.id, device.fingerprint))
+
+    def test_device_keys_store_is_disabled_by_default(self):
+        with self.settings(DJANGO_SSO_APP_DEVICE_KEYS_CACHE_ENABLED=False):
+            self.assertIsNone(get_device_key_store())
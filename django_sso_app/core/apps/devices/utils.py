@@ -1,10 +1,11 @@
 import logging
 
-import jwt
-
-from ...tokens.utils import jwt_decode, jwt_encode
-from ...utils import get_session_key, set_session_key, logger, set_cookie, get_random_fingerprint
-from ...tokens.utils import get_request_jwt
+from ...context import get_request_context
+from ...tokens.utils import jwt_encode, get_request_parsed_token
+from ...utils import set_cookie, get_random_fingerprint
+from ...tokens.cache import invalidate_profile_tokens
+from ...tokens.keys import get_active_jwt_secret
+from .keys import store_device_keys
 from ...exceptions import RequestHasValidJwtWithNoDeviceAssociated
 from ... import app_settings
 
@@ -12,24 +13,26 @@ logger = logging.getLogger('django_sso_app')
 
 
 def add_profile_device(profile, fingerprint, secret=None):
-    secret = secret or app_settings.TOKENS_JWT_SECRET
+    secret = secret or get_active_jwt_secret()
 
-    logger.info(
-        'Adding User Device for profile "{}" with fingerprint "{}" and secret "{}"'.format(profile,
-                                                                                           fingerprint,
-                                                                                           secret))
+    logger.info('Adding User Device for profile "%s" with fingerprint "%s" and secret "%s"',
+                profile,
+                fingerprint,
+                secret)
 
     device = profile.devices.model.objects.create(profile=profile, fingerprint=fingerprint, apigw_jwt_secret=secret)
+    store_device_keys(device)
 
-    logger.debug('device "{}" created with key "{}" secret "{}" and fingerprint "{}"'.format(device,
-                                                                                             device.apigw_jwt_key,
-                                                                                             device.apigw_jwt_secret,
-                                                                                             device.fingerprint))
+    logger.debug('device "%s" created with key "%s" secret "%s" and fingerprint "%s"',
+                 device,
+                 device.apigw_jwt_key,
+                 device.apigw_jwt_secret,
+                 device.fingerprint)
     return device
 
 
 def remove_profile_device(device):
-    logger.info('Deleting Device "{}"'.format(device))
+    logger.info('Deleting Device "%s"', device)
 
     device.delete()
 
@@ -37,79 +40,76 @@ def remove_profile_device(device):
 
 
 def remove_all_profile_devices(profile):
-    logger.info('Removing All Profile Devices for "{}"'.format(profile))
+    logger.info('Removing All Profile Devices for "%s"', profile)
 
     removed = 0
     for device in profile.devices.all():
         removed += remove_profile_device(device)
 
-    return removed
-
+    invalidate_profile_tokens(profile.sso_id)
 
-def get_or_create_request_device(request):
-    device = get_session_key(request, '__dssoa__device', None)
+    return removed
 
-    if device is None:
-        logger.debug('no previous device')
-        fingerprint = get_session_key(request, '__dssoa__device__fingerprint')  # set by views
 
-        if fingerprint is None:
-            logger.debug('received empty fingerprint, checking JWT')
+def _get_or_create_request_device(request):
+    """
+    Gets or creates request user device by request fingerprint (see RequestContext.device)
+    :param request:
+    :return:
+    """
+    context = get_request_context(request)
+    device = None
+    fingerprint = context.device_fingerprint  # set by views
 
-            raw_token = get_request_jwt(request)
+    if fingerprint is None:
+        logger.debug('received empty fingerprint, checking JWT')
 
-            if raw_token is None:
-                fingerprint = get_random_fingerprint(request)  # 'undefined'
-            else:
-                try:
-                    device, verified_payload = jwt_decode(raw_token, verify=True)
+        try:
+            # decoded once per request
+            decoded_token = context.decoded_token
 
-                except RequestHasValidJwtWithNoDeviceAssociated:
-                    logger.warning('no device associated to request token "{}"'.format(raw_token))
-                    raise
-                else:
-                    fingerprint = verified_payload['fp']
+        except RequestHasValidJwtWithNoDeviceAssociated:
+            logger.warning('no device associated to request token "%s"', get_request_parsed_token(request))
+            raise
 
-        if device is None:
-            user = request.user
-            profile = user.sso_app_profile
+        if decoded_token is None:
+            fingerprint = get_random_fingerprint(request)  # 'undefined'
+        else:
+            device, verified_payload = decoded_token
+            fingerprint = verified_payload['fp']
 
-            logger.info(
-                'Request has no device, getting profile "{}" device with fingerprint "{}"'.format(profile,
-                                                                                                  fingerprint))
+    if device is None:
+        user = request.user
+        profile = user.sso_app_profile
 
-            device = profile.devices.filter(fingerprint=fingerprint).first()
+        logger.info('Request has no device, getting profile "%s" device with fingerprint "%s"', profile, fingerprint)
 
-            if device is None:
-                logger.debug('profile has no device with fingerprint "{}"'.format(fingerprint))
-                device = add_profile_device(user.get_sso_app_profile(), fingerprint)
-            else:
-                logger.debug('fingerprint "{}" had device'.format(fingerprint))
+        device = profile.devices.filter(fingerprint=fingerprint).first()
 
+        if device is None:
+            logger.debug('profile has no device with fingerprint "%s"', fingerprint)
+            device = add_profile_device(user.get_sso_app_profile(), fingerprint)
         else:
-            logger.debug('request has device "{}"'.format(device))
+            logger.debug('fingerprint "%s" had device', fingerprint)
 
     else:
-        logger.info(
-            'request already has device "{}"'.format(device))
+        logger.debug('request has device "%s"', device)
 
     assert device is not None
 
-    set_session_key(request, '__dssoa__device', device)
-    set_session_key(request, '__dssoa__device__fingerprint', device.fingerprint)
-
     return device
 
 
+def get_or_create_request_device(request):
+    return get_request_context(request).device
+
+
 def renew_response_jwt(received_jwt, user, request, response):
-    logger.debug('renewing response jwt for "{}"'.format(user))
+    logger.debug('renewing response jwt for "%s"', user)
 
-    unverified_payload = jwt.decode(received_jwt, None,
-                                    options={"verify_signature": False},
-                                    algorithms=[app_settings.JWT_ALGORITHM])
-    jwt_fingerprint = unverified_payload['fp']
+    jwt_fingerprint = get_request_parsed_token(request, received_jwt).unverified_claims['fp']
 
-    logger.info('Updating response JWT for User {0} with fingerprint {1}'.format(request.user, jwt_fingerprint))
+    logger.info('Updating response JWT for User %s with fingerprint %s', request.user, jwt_fingerprint)
 
     # creates new actual_device
     device = add_profile_device(user.get_sso_app_profile(), jwt_fingerprint)
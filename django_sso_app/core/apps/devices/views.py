@@ -7,7 +7,7 @@ from rest_framework import viewsets
 
 from .models import Device
 from .serializers import DeviceSerializer
-from ...permissions import is_staff, is_authenticated, OwnerOrStaffPermission
+from ...permissions import is_request_user_staff, is_authenticated, OwnerOrStaffPermission
 
 User = get_user_model()
 
@@ -29,7 +29,7 @@ class DeviceApiViewSet(mixins.ListModelMixin,
         requesting_user = self.request.user
 
         if is_authenticated(requesting_user):
-            if is_staff(requesting_user):
+            if is_request_user_staff(self.request):
                 return Device.objects.all()
             else:
                 return Device.objects.filter(profile=requesting_user.sso_app_profile)
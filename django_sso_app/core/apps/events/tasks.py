@@ -1,4 +1,5 @@
 import json
+import time
 
 from datetime import timezone
 
@@ -17,6 +18,7 @@ from allauth.account.models import EmailAddress
 from ..profiles.models import Profile
 from ..groups.models import Group
 from ..users.utils import create_local_user_from_object
+from ...metrics import EVENTS_POLL_LAG, flush_metrics
 from .models import RequestForCredentialsEventListener
 from .utils import fetch_event_type_events, sort_event_type_events
 
@@ -64,8 +66,11 @@ def _create_users_by_events(logger):
 
         logger.info('Getting "{}" events from date "{}"'.format(event_type, from_date))
         rfc_events, _count = fetch_event_type_events(event_type, from_timestamp)
+        last_event_timestamp = from_timestamp
 
         for event in sort_event_type_events(rfc_events, event_type):
+            last_event_timestamp = event['timestamp']
+
             try:
                 with transaction.atomic():
                     logger.debug('Last "{}" event: "{}"'.format(event_type, event))
@@ -128,6 +133,11 @@ def _create_users_by_events(logger):
             except Exception as e:
                 logger.exception('Error: {}. Can not create user by event: {}'.format(e, event))
 
+        try:
+            EVENTS_POLL_LAG.set(time.time() - float(last_event_timestamp), event_type)
+        except (TypeError, ValueError):
+            logger.warning('Can not compute "{}" events lag from "{}"'.format(event_type, last_event_timestamp))
+
     return users_created
 
 
@@ -151,6 +161,7 @@ def create_users_by_events(self, **kwargs):
             ret = _create_users_by_events(_logger)
         finally:
             release_lock()
+            flush_metrics()
         return ret
 
     _logger.debug("{} is already being executed by another worker".format(name))
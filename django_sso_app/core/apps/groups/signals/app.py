@@ -0,0 +1,20 @@
+import logging
+
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+
+from ....permissions import invalidate_user_identity
+from ...profiles.models import Profile
+
+logger = logging.getLogger('django_sso_app')
+
+
+@receiver(m2m_changed, sender=Profile.groups.through)
+def signal_handler_when_user_profile_is_added_or_removed_from_group(action, instance, reverse, model, pk_set, using,
+                                                                    **kwargs):
+    """
+    Invalidate cached profile identity when user enter/exit groups
+    """
+
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_user_identity(instance.sso_id)
@@ -4,7 +4,7 @@ from django.db.models.signals import m2m_changed, post_save
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
 
-from ....permissions import is_django_staff
+from ....permissions import is_django_staff, invalidate_user_identity
 from ...profiles.models import Profile
 from ..models import Group
 from ..utils import set_default_user_groups, set_default_profile_groups
@@ -46,6 +46,10 @@ def signal_handler_when_user_profile_is_added_or_removed_from_group(action, inst
             group = Group.objects.get(id=pk)
             logger.info('Profile "{}" exited from group "{}"'.format(profile, group))
 
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        # group changes do not always update rev
+        invalidate_user_identity(profile.sso_id)
+
     # updating rev
 
     if groups_updated and must_update_rev:
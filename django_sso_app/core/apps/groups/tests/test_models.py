@@ -1,9 +1,16 @@
+from io import StringIO
+from unittest import mock
+
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
 
+from django_sso_app.core.cache import get_shared_cache
+from django_sso_app.core.permissions import get_user_identity
 from django_sso_app.core.tests.factories import UserTestCase
 
 from ...emails.models import EmailAddress
 from ...groups.models import Group
+from ...groups.utils import reconcile_default_groups
 from ...profiles.models import Profile
 
 User = get_user_model()
@@ -50,3 +57,54 @@ class GroupTestCase(UserTestCase):
             print('GROP NAMES', user_groups, group_name)
 
             assert group_name in user_groups
+
+    def test_default_groups_are_reconciled_on_fingerprint_change(self):
+        user = self._get_new_user()
+        profile = user.sso_app_profile
+
+        self.assertTrue(reconcile_default_groups(user, profile))
+
+        with self.assertNumQueries(0), \
+                mock.patch.object(type(profile), 'is_incomplete', new_callable=mock.PropertyMock) as is_incomplete:
+            self.assertFalse(reconcile_default_groups(user, profile))
+
+        # required profile fields are not scanned
+        is_incomplete.assert_not_called()
+
+        group_name = self._get_random_string()
+
+        with self.settings(DJANGO_SSO_APP_DEFAULT_PROFILE_GROUPS=[group_name]):
+            self.assertTrue(reconcile_default_groups(user, profile))
+
+            assert group_name in profile.groups.values_list('name', flat=True)
+
+    def test_default_groups_are_applied_in_bulk(self):
+        users = [self._get_new_user() for _i in range(3)]
+        user_group_name = self._get_random_string()
+        profile_group_name = self._get_random_string()
+
+        for user in users:
+            self.assertIsNotNone(get_user_identity(user))
+
+        with self.settings(DJANGO_SSO_APP_DEFAULT_USER_GROUPS=[user_group_name],
+                           DJANGO_SSO_APP_DEFAULT_PROFILE_GROUPS=[profile_group_name]):
+            call_command('apply_default_groups', stdout=StringIO())
+
+            profiles_revs = dict((user.pk, user.sso_app_profile.sso_rev + 1) for user in users)
+
+            for user in users:
+                user.sso_app_profile.refresh_from_db()
+
+                assert user_group_name in user.groups.values_list('name', flat=True)
+                assert profile_group_name in user.sso_app_profile.groups.values_list('name', flat=True)
+                self.assertEqual(user.sso_app_profile.sso_rev, profiles_revs[user.pk])
+                self.assertIsNone(get_shared_cache().get('dssoa:identity:{}'.format(user.sso_id)))
+                self.assertIn(profile_group_name, get_user_identity(user)['groups'])
+
+            # already applied, rev is not updated
+            call_command('apply_default_groups', stdout=StringIO())
+
+            for user in users:
+                user.sso_app_profile.refresh_from_db()
+
+                self.assertEqual(user.sso_app_profile.sso_rev, profiles_revs[user.pk])
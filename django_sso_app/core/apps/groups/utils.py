@@ -1,10 +1,18 @@
+import json
+import hashlib
 import logging
 
 # import pyximport
 # pyximport.install()
 
-from django.db import transaction
+from django.db import models, transaction
+from django.db.models import F, Q
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
 
+from ...cache import get_shared_cache
+from ...permissions import invalidate_users_identities
+from ...metrics import CACHE_REQUESTS
 from ...functions import lists_differs
 from ... import app_settings
 
@@ -75,3 +83,139 @@ def set_default_profile_groups(profile):
                 profile.remove_from_group(group_name)
 
     setattr(profile.user, '__dssoa__updating_default_groups', False)
+
+
+def get_default_groups_fingerprint(user, profile=None):
+    """
+    Returns default groups configuration and profile rev fingerprint, None if profile rev is being updated
+    :param user:
+    :param profile: profile to check (backend shapes)
+    :return:
+    """
+    user_profile = profile or user.get_sso_app_profile()
+    sso_rev = user_profile.sso_rev if user_profile is not None else 0
+
+    if not isinstance(sso_rev, int):
+        # F() expression
+        return None
+
+    # profile fields changes (completeness included) update sso_rev, required fields are not scanned
+    state = [
+        sorted(app_settings.DEFAULT_USER_GROUPS),
+        sorted(app_settings.DEFAULT_PROFILE_GROUPS) if profile is not None else None,
+        sorted(app_settings.REQUIRED_PROFILE_FIELDS) if profile is not None else None,
+        sso_rev
+    ]
+
+    return hashlib.sha1(json.dumps(state).encode('utf-8')).hexdigest()
+
+
+def reconcile_default_groups(user, profile=None):
+    """
+    Sets default user (and profile) groups only if configuration or profile rev changed since last run
+    :param user:
+    :param profile: profile to reconcile (backend shapes)
+    :return: True if groups have been checked
+    """
+    fingerprint = get_default_groups_fingerprint(user, profile)
+    cache_key = 'dssoa:groups:reconciled:{}:{}'.format('profile' if profile is not None else 'user',
+                                                       user.sso_id or user.pk)
+
+    if fingerprint is not None and get_shared_cache().get(cache_key) == fingerprint:
+        CACHE_REQUESTS.inc('groups', 'hit')
+
+        return False
+
+    CACHE_REQUESTS.inc('groups', 'miss')
+
+    set_default_user_groups(user)
+    if profile is not None:
+        set_default_profile_groups(profile)
+
+    if fingerprint is not None:
+        get_shared_cache().set(cache_key, fingerprint, app_settings.GROUPS_RECONCILIATION_CACHE_TIMEOUT)
+
+    return True
+
+
+def _add_to_group_in_bulk(through_model, field_name, ids, group):
+    memberships = set(through_model.objects.filter(group=group, **{'{}__in'.format(field_name): ids})
+                                           .values_list(field_name, flat=True))
+    missing_ids = [_id for _id in ids if _id not in memberships]
+
+    through_model.objects.bulk_create([through_model(group=group, **{field_name: _id}) for _id in missing_ids],
+                                      ignore_conflicts=True)
+
+    return missing_ids
+
+
+@transaction.atomic
+def apply_default_groups_in_bulk():
+    """
+    Applies default user and profile groups (and "incomplete" group) to all non staff users
+    with set based queries. Groups signals are bypassed: updated profiles rev is increased with one query
+    and their cached identities are invalidated
+    :return: (added user memberships, added profile memberships, removed profile memberships) tuple
+    """
+    from ..profiles.models import Profile
+
+    User = get_user_model()
+
+    user_ids = list(User.objects.filter(is_staff=False, is_superuser=False).values_list('id', flat=True))
+    profile_ids = list(Profile.objects.filter(user_id__in=user_ids).values_list('id', flat=True))
+
+    user_through_model = User.groups.through
+    profile_through_model = Profile.groups.through
+
+    updated_user_ids = set()
+    updated_profile_ids = set()
+
+    added_user_memberships = 0
+    for group_name in app_settings.DEFAULT_USER_GROUPS:
+        group, _created = Group.objects.get_or_create(name=group_name)
+        added_user_ids = _add_to_group_in_bulk(user_through_model, 'user_id', user_ids, group)
+
+        added_user_memberships += len(added_user_ids)
+        updated_user_ids.update(added_user_ids)
+
+    added_profile_memberships = 0
+    for group_name in app_settings.DEFAULT_PROFILE_GROUPS:
+        group, _created = Group.objects.get_or_create(name=group_name)
+        added_profile_ids = _add_to_group_in_bulk(profile_through_model, 'profile_id', profile_ids, group)
+
+        added_profile_memberships += len(added_profile_ids)
+        updated_profile_ids.update(added_profile_ids)
+
+    incomplete_filter = Q(pk__in=[])
+    for field in app_settings.REQUIRED_PROFILE_FIELDS:
+        incomplete_filter |= Q(**{'{}__isnull'.format(field): True})
+
+        if isinstance(Profile._meta.get_field(field), (models.CharField, models.TextField)):
+            incomplete_filter |= Q(**{field: ''})
+
+    incomplete_group, _created = Group.objects.get_or_create(name='incomplete')
+    incomplete_profile_ids = list(Profile.objects.filter(incomplete_filter, id__in=profile_ids)
+                                                 .values_list('id', flat=True))
+
+    added_profile_ids = _add_to_group_in_bulk(profile_through_model, 'profile_id',
+                                              incomplete_profile_ids, incomplete_group)
+
+    added_profile_memberships += len(added_profile_ids)
+    updated_profile_ids.update(added_profile_ids)
+
+    completed_memberships = profile_through_model.objects.filter(group=incomplete_group, profile_id__in=profile_ids) \
+                                                         .exclude(profile_id__in=incomplete_profile_ids)
+
+    updated_profile_ids.update(completed_memberships.values_list('profile_id', flat=True))
+    removed_profile_memberships, _deleted = completed_memberships.delete()
+
+    # m2m signals are not sent, apps get updated groups by profiles rev
+    updated_profiles = Profile.objects.filter(Q(id__in=updated_profile_ids) | Q(user_id__in=updated_user_ids))
+    updated_sso_ids = list(updated_profiles.values_list('sso_id', flat=True))
+
+    updated_profiles.update(sso_rev=F('sso_rev') + 1)
+    invalidate_users_identities(updated_sso_ids)
+
+    logger.info('%s profiles rev updated by default groups', len(updated_sso_ids))
+
+    return added_user_memberships, added_profile_memberships, removed_profile_memberships
@@ -7,10 +7,9 @@ from urllib.parse import urlencode
 
 from django.urls import reverse
 
-from ...utils import get_session_key, set_session_key
+from ...context import get_request_context
 from ...permissions import is_django_staff
 from ... import app_settings
-from ..devices.utils import get_or_create_request_device
 
 from .models import Passepartout
 from .functions import get_next_bump
@@ -25,7 +24,7 @@ def get_passepartout_login_redirect_url(request):
     redirect_url = None
 
     if app_settings.PASSEPARTOUT_PROCESS_ENABLED:
-        redirect_url = get_session_key(request, '__dssoa__passepartout__redirect_url')
+        redirect_url = get_request_context(request).passepartout_redirect_url
 
         if redirect_url is None:
             logger.info(
@@ -37,7 +36,7 @@ def get_passepartout_login_redirect_url(request):
             if nextUrl is None:
                 nextUrl = app_settings.APP_URL
 
-            device = get_or_create_request_device(request)
+            device = get_request_context(request).device
 
             assert device is not None
 
@@ -46,7 +45,7 @@ def get_passepartout_login_redirect_url(request):
                 'for user {0}, with device {1}, nextUrl is {2}'.format(
                     request.user, device, nextUrl))
 
-            token = get_session_key(request, '__dssoa__jwt_token')
+            token = get_request_context(request).jwt_token
 
             passepartout = Passepartout.objects.create_passepartout(device=device, jwt=token)
             logger.info('Created passepartout object {0}'.format(passepartout))
@@ -60,7 +59,7 @@ def get_passepartout_login_redirect_url(request):
                 redirect_url = next_sso_service + reverse('django_sso_app_passepartout:login',
                                                           args=[passepartout.token]) + '?' + urlencode(args)
 
-                set_session_key(request, '__dssoa__passepartout__redirect_url', redirect_url)
+                get_request_context(request).passepartout_redirect_url = redirect_url
 
     else:
         logger.info('Only one SSO instance, no passepartout process')
@@ -10,7 +10,8 @@ from django.urls import reverse
 
 from allauth.account.adapter import get_adapter
 
-from ...utils import invalidate_cookie, set_cookie, set_session_key, get_session_key
+from ...context import get_request_context
+from ...utils import invalidate_cookie, set_cookie
 from ...permissions import is_authenticated
 from ...functions import get_url_host
 from ... import app_settings
@@ -89,7 +90,7 @@ def passepartout_login_view(request, token):
             except Service.DoesNotExist:
                 raise Http404("Service not found")
 
-        set_session_key(request, '__dssoa__device__fingerprint', passepartout.device.fingerprint)
+        get_request_context(request).device_fingerprint = passepartout.device.fingerprint
 
         if is_last_bump:
             logger.info('Is last login bump')
@@ -130,7 +131,7 @@ def passepartout_login_view(request, token):
 
         else:
             if is_authenticated(user):
-                jwt_token = get_session_key(request, '__dssoa__jwt_token', None)
+                jwt_token = get_request_context(request).jwt_token
 
                 if jwt_token is None:
                     logger.error('No jwt_token in session')
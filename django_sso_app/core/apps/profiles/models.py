@@ -11,6 +11,7 @@ from django_countries.fields import CountryField
 
 from ..groups.models import Group
 from ... import app_settings
+from ...tokens.cache import invalidate_profile_tokens
 from ...models import CreatedAtModel, UpdatableModel, DeactivableModel, PublicableModel
 
 logger = logging.getLogger('django_sso_app')
@@ -129,6 +130,8 @@ class Profile(AbstractProfileModel):
 
             setattr(self, '__rev_updated', True)
 
+            invalidate_profile_tokens(self.sso_id)
+
         if commit:
             self.save()
 
@@ -74,7 +74,7 @@ class ProfileSerializer(AbsoluteUrlSerializer):
         fields = read_only_fields + app_settings.PROFILE_FIELDS
 
     def get_groups(self, instance):
-        groups = list(instance.groups.values_list('name', flat=True))
+        groups = [group.name for group in instance.groups.all()]
 
         return groups
 
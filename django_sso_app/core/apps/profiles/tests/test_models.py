@@ -1,6 +1,8 @@
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 
 from django_sso_app.core.tests.factories import UserTestCase
+from django_sso_app.core.utils import get_login_eligibility
 
 
 class ProfileTestCase(UserTestCase):
@@ -58,3 +60,23 @@ class ProfileTestCase(UserTestCase):
 
         self.assertEqual(profile.django_user_username, user.username)
         self.assertEqual(profile.sso_rev, profile_rev + 1)
+
+    def test_login_eligibility_is_cached_by_rev(self):
+        """
+        Login eligibility snapshot is computed once per profile rev
+        """
+        user = self._get_new_user()
+        profile = get_user_model().objects.get(pk=user.pk).sso_app_profile
+
+        eligibility = get_login_eligibility(profile)
+
+        self.assertFalse(eligibility['unsubscribed'])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_login_eligibility(profile), eligibility)
+
+        profile.unsubscribed_at = timezone.now()
+        profile.save()
+        profile.refresh_from_db()
+
+        self.assertTrue(get_login_eligibility(profile)['unsubscribed'])
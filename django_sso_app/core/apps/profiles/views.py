@@ -16,7 +16,7 @@ from .forms import UserProfileForm
 from .models import Profile
 from .serializers import ProfileSerializer
 from ... import app_settings
-from ...permissions import is_staff
+from ...permissions import is_request_user_staff
 from ...mixins import WebpackBuiltTemplateViewMixin
 from ...views import DjangoSsoAppBaseViewMixin
 
@@ -141,7 +141,7 @@ class ProfileApiViewSet(viewsets.ModelViewSet,
         requesting_user = self.request.user
         queryset = Profile.objects.filter(user__is_superuser=False, is_active=True, user__is_active=True)
 
-        if is_staff(requesting_user):
+        if is_request_user_staff(self.request):
             return queryset
         else:
             return queryset.filter(user=requesting_user)
@@ -1,8 +1,7 @@
 import logging
 
-import requests
-
 from ... import app_settings
+from ...backend_client import get_backend_client
 
 logger = logging.getLogger('django_sso_app')
 
@@ -32,7 +31,7 @@ def subscribe_to_backend_service(sso_id, encoded_jwt=None):
     # Get all available services
     url = app_settings.BACKEND_SERVICES_URL
 
-    response = requests.get(url=url, headers=headers, timeout=10, verify=False)
+    response = get_backend_client().get('fetch_services', url, headers=headers)
     response.raise_for_status()
 
     sso_services = response.json()
@@ -51,7 +50,7 @@ def subscribe_to_backend_service(sso_id, encoded_jwt=None):
     # Subscribe to current service
     url = (app_settings.USER_SUBSCRIPTIONS_CREATE_URL.format(sso_id=sso_id, service_id=service_id))
 
-    response = requests.post(url=url, headers=headers, timeout=10, verify=False)
+    response = get_backend_client().post('subscribe_service', url, headers=headers)
     response.raise_for_status()
 
     logger.info("Profile with SSO ID {sso_id} was successfully subscribed to"
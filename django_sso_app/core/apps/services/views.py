@@ -11,7 +11,7 @@ from rest_framework.response import Response
 from .models import Service, Subscription
 from .serializers import SubscriptionSerializer, ServiceSerializer, ServiceSubscriptionSerializer
 from ..profiles.models import Profile
-from ...permissions import is_staff, is_authenticated
+from ...permissions import is_request_user_staff, is_authenticated
 from ...tokens.utils import get_request_jwt
 from ..devices.utils import renew_response_jwt
 
@@ -56,7 +56,7 @@ class ServiceSubscriptionApiViewSet(mixins.CreateModelMixin,
 
         profile = None
 
-        if is_staff(requesting_user):
+        if is_request_user_staff(request):
             serializer = ServiceSubscriptionSerializer(data=request.data)
 
             if serializer.is_valid():
@@ -102,7 +102,7 @@ class ServiceSubscriptionApiViewSet(mixins.CreateModelMixin,
 
         profile = None
 
-        if is_staff(requesting_user):
+        if is_request_user_staff(request):
             serializer = ServiceSubscriptionSerializer(data=request.data)
 
             if serializer.is_valid():
@@ -152,7 +152,7 @@ class SubscriptionApiViewSet(mixins.ListModelMixin,
         requesting_user = self.request.user
 
         if is_authenticated(requesting_user):
-            if is_staff(requesting_user):
+            if is_request_user_staff(self.request):
                 return Subscription.objects.all()
             else:
                 return Subscription.objects.filter(profile=requesting_user.sso_app_profile)
@@ -1,9 +1,26 @@
+from unittest import mock, skipIf
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
 from django.contrib.auth import get_user_model
 
 from django.urls import reverse
 
+try:
+    from django.test import AsyncClient
+    from asgiref.sync import sync_to_async
+except ImportError:  # django < 3.1
+    AsyncClient = None
+
 from rest_framework import status
 from django_sso_app.core import app_settings
+from django_sso_app.core.backend_client import get_backend_client
+from django_sso_app.core.tokens.revocation import is_token_revoked
+from django_sso_app.core.apps.users.tasks import refresh_remote_user
+from django_sso_app.core.apps.users.utils import is_remote_user_refresh_pending
 from django_sso_app.core.tests.factories import UserTestCase, responses
 
 
@@ -52,6 +69,95 @@ class TestApp(UserTestCase):
 
             self.assertEqual(created_profile.sso_rev, remote_user_object['sso_rev'], 'sso rev differs')
 
+    @skipIf(AsyncClient is None, 'async views not supported')
+    @responses.activate
+    async def test_can_replicate_remote_profile_with_async_middleware_without_httpx(self):
+
+        with self.settings(DJANGO_SSO_APP_SHAPE='app_persistence',
+                           DJANGO_SSO_APP_SERVICE_URL='http://example.com'), \
+                mock.patch('django_sso_app.core.backend_client.httpx', None):
+
+            remote_profile_uuid = self._get_random_uuid()
+
+            remote_user_object = self._get_remote_user_object(uuid=remote_profile_uuid,
+                                                              service_name='example.com',
+                                                              group_name=self._get_random_string())
+
+            mocked_url = app_settings.REMOTE_USER_URL.format(sso_id=remote_profile_uuid)
+            profile_url = reverse('django_sso_app_profile:rest-detail', args=(remote_profile_uuid,))
+
+            self._set_mocked_response(mocked_url, remote_user_object)
+
+            client = AsyncClient()
+            client.cookies = await sync_to_async(self._get_valid_jwt_cookie)(
+                remote_profile_uuid, sso_rev=remote_user_object['sso_rev'])
+
+            response = await client.get(profile_url, content_type='application/json')
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json().get('sso_id'), remote_profile_uuid,
+                             'sso_id differs from remote and local')
+            self.assertEqual(len(responses.calls), 1)
+
+    @skipIf(AsyncClient is None or httpx is None, 'async views or httpx not supported')
+    async def test_can_replicate_remote_profile_with_async_middleware(self):
+
+        with self.settings(DJANGO_SSO_APP_SHAPE='app_persistence',
+                           DJANGO_SSO_APP_SERVICE_URL='http://example.com'):
+
+            remote_profile_uuid = self._get_random_uuid()
+
+            remote_user_object = self._get_remote_user_object(uuid=remote_profile_uuid,
+                                                              service_name='example.com',
+                                                              group_name=self._get_random_string())
+
+            mocked_url = app_settings.REMOTE_USER_URL.format(sso_id=remote_profile_uuid)
+            profile_url = reverse('django_sso_app_profile:rest-detail', args=(remote_profile_uuid,))
+
+            backend_requests = []
+
+            def backend(request):
+                backend_requests.append(request)
+
+                return httpx.Response(200, json=remote_user_object)
+
+            backend_client = httpx.AsyncClient(transport=httpx.MockTransport(backend))
+
+            client = AsyncClient()
+            client.cookies = await sync_to_async(self._get_valid_jwt_cookie)(
+                remote_profile_uuid, sso_rev=remote_user_object['sso_rev'])
+
+            with mock.patch.object(get_backend_client(), 'get_async_client', return_value=backend_client):
+                response = await client.get(profile_url, content_type='application/json')
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json().get('sso_id'), remote_profile_uuid,
+                             'sso_id differs from remote and local')
+            self.assertEqual(len(backend_requests), 1)
+            self.assertEqual(str(backend_requests[0].url).split('?')[0], mocked_url)
+            self.assertTrue(backend_requests[0].headers['Authorization'].startswith('Bearer '))
+
+    @skipIf(httpx is None, 'httpx not installed')
+    async def test_backend_client_async_retries_unavailable_backend(self):
+        remote_profile_uuid = self._get_random_uuid()
+        remote_user_object = self._get_remote_user_object(uuid=remote_profile_uuid)
+        mocked_url = app_settings.REMOTE_USER_URL.format(sso_id=remote_profile_uuid)
+
+        responses_status = [503, 200]
+
+        def backend(request):
+            return httpx.Response(responses_status.pop(0), json=remote_user_object)
+
+        backend_client = httpx.AsyncClient(transport=httpx.MockTransport(backend))
+
+        with self.settings(DJANGO_SSO_APP_BACKEND_MAX_RETRIES=1,
+                           DJANGO_SSO_APP_BACKEND_RETRY_BACKOFF=0), \
+                mock.patch.object(get_backend_client(), 'get_async_client', return_value=backend_client):
+            response = await get_backend_client().aget('fetch_user', mocked_url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(responses_status, [])
+
     @responses.activate
     def test_can_replicate_remote_profile_with_apigateway(self):
 
@@ -284,3 +390,172 @@ class TestApp(UserTestCase):
             created_profile = Profile.objects.filter(sso_id=remote_profile_uuid).first()
 
             self.assertNotEqual(created_profile, None, 'incomplete user not created')
+
+    @responses.activate
+    def test_backend_client_retries_unavailable_backend(self):
+        remote_profile_uuid = self._get_random_uuid()
+        remote_user_object = self._get_remote_user_object(uuid=remote_profile_uuid)
+        mocked_url = app_settings.REMOTE_USER_URL.format(sso_id=remote_profile_uuid)
+
+        self._set_mocked_response(mocked_url, {}, status=503)
+        self._set_mocked_response(mocked_url, remote_user_object)
+
+        with self.settings(DJANGO_SSO_APP_BACKEND_MAX_RETRIES=1,
+                           DJANGO_SSO_APP_BACKEND_RETRY_BACKOFF=0):
+            response = get_backend_client().get('fetch_user', mocked_url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(responses.calls), 2)
+        self.assertTrue(responses.calls[0].request.req_kwargs['verify'], 'backend certificate not verified')
+
+    @responses.activate
+    def test_backend_circuit_probe_is_released_on_unexpected_error(self):
+        mocked_url = app_settings.REMOTE_USER_URL.format(sso_id=self._get_random_uuid())
+
+        self._set_mocked_response(mocked_url, {})
+
+        with self.settings(DJANGO_SSO_APP_BACKEND_CIRCUIT_BREAKER_THRESHOLD=1,
+                           DJANGO_SSO_APP_BACKEND_CIRCUIT_BREAKER_RESET_TIMEOUT=0):
+            backend_client = get_backend_client()
+            backend_client.breaker.record_failure()
+
+            try:
+                with mock.patch.object(backend_client.session, 'request', side_effect=ValueError):
+                    with self.assertRaises(ValueError):
+                        backend_client.get('fetch_user', mocked_url)
+
+                # probing again
+                response = backend_client.get('fetch_user', mocked_url)
+
+            finally:
+                backend_client.breaker.record_success()
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertFalse(backend_client.breaker.is_open)
+
+    @responses.activate
+    def test_open_backend_circuit_replicates_user_from_jwt(self):
+
+        with self.settings(DJANGO_SSO_APP_SHAPE='app_persistence',
+                           DJANGO_SSO_APP_SERVICE_URL='http://example.com',
+                           DJANGO_SSO_APP_BACKEND_CIRCUIT_BREAKER_THRESHOLD=1):
+
+            remote_profile_uuid = self._get_random_uuid()
+            profile_url = reverse('django_sso_app_profile:rest-detail', args=(remote_profile_uuid,))
+
+            breaker = get_backend_client().breaker
+            breaker.record_failure()
+
+            try:
+                client = self._get_client()
+                client.cookies = self._get_valid_jwt_cookie(remote_profile_uuid, sso_rev=3)
+
+                response = client.get(
+                    profile_url,
+                    content_type='application/json'
+                )
+
+            finally:
+                breaker.record_success()
+
+            self.assertEqual(len(responses.calls), 0, 'backend called with open circuit')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data.get('sso_id'), remote_profile_uuid)
+
+            # to be updated from backend on next authentication
+            self.assertEqual(Profile.objects.get(sso_id=remote_profile_uuid).sso_rev, 0)
+
+    @responses.activate
+    def test_stale_while_revalidate_refreshes_user_in_background(self):
+
+        with self.settings(DJANGO_SSO_APP_SHAPE='app_persistence',
+                           DJANGO_SSO_APP_SERVICE_URL='http://example.com',
+                           DJANGO_SSO_APP_REPLICATION_STALE_WHILE_REVALIDATE=True,
+                           DJANGO_SSO_APP_REPLICATION_SECURITY_FIELDS=['is_active']):
+
+            remote_profile_uuid = self._get_random_uuid()
+            remote_user_object = self._get_remote_user_object(uuid=remote_profile_uuid, service_name='example.com')
+            sso_rev = remote_user_object['sso_rev']
+
+            # deactivated after last token was issued
+            updated_remote_user_object = dict(remote_user_object, sso_rev=sso_rev + 2, is_active=False,
+                                              profile=dict(remote_user_object['profile'], sso_rev=sso_rev + 2))
+
+            mocked_url = app_settings.REMOTE_USER_URL.format(sso_id=remote_profile_uuid)
+            profile_url = reverse('django_sso_app_profile:rest-detail', args=(remote_profile_uuid,))
+
+            self._set_mocked_response(mocked_url, remote_user_object)
+            self._set_mocked_response(mocked_url, updated_remote_user_object)
+
+            client = self._get_client()
+            client.cookies = self._get_valid_jwt_cookie(remote_profile_uuid, sso_rev=sso_rev)
+
+            response = client.get(profile_url, content_type='application/json')
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+            client.cookies = self._get_valid_jwt_cookie(remote_profile_uuid, sso_rev=sso_rev + 1, is_active=True)
+
+            with mock.patch.object(refresh_remote_user, 'delay') as delay:
+                for _i in range(2):
+                    response = client.get(profile_url, content_type='application/json')
+
+                    self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+                # enqueued once, served with local copy
+                delay.assert_called_once_with(remote_profile_uuid, sso_rev + 1)
+
+            self.assertEqual(len(responses.calls), 1)
+            self.assertEqual(Profile.objects.get(sso_id=remote_profile_uuid).sso_rev, sso_rev)
+            self.assertTrue(is_remote_user_refresh_pending(remote_profile_uuid))
+
+            refresh_remote_user(remote_profile_uuid, sso_rev + 1)
+
+            refreshed_profile = Profile.objects.get(sso_id=remote_profile_uuid)
+
+            self.assertEqual(refreshed_profile.sso_rev, sso_rev + 2)
+            self.assertFalse(refreshed_profile.user.is_active)
+            self.assertFalse(is_remote_user_refresh_pending(remote_profile_uuid))
+
+            # is_active changed, tokens served with local copy revoked
+            self.assertTrue(is_token_revoked({'sso_id': remote_profile_uuid, 'sso_rev': sso_rev + 1}))
+            self.assertFalse(is_token_revoked({'sso_id': remote_profile_uuid, 'sso_rev': sso_rev + 2}))
+
+    @responses.activate
+    def test_stale_while_revalidate_updates_security_fields_in_request(self):
+
+        with self.settings(DJANGO_SSO_APP_SHAPE='app_persistence',
+                           DJANGO_SSO_APP_SERVICE_URL='http://example.com',
+                           DJANGO_SSO_APP_REPLICATION_STALE_WHILE_REVALIDATE=True):
+
+            remote_profile_uuid = self._get_random_uuid()
+            remote_user_object = self._get_remote_user_object(uuid=remote_profile_uuid, service_name='example.com')
+            sso_rev = remote_user_object['sso_rev']
+
+            updated_remote_user_object = dict(remote_user_object, sso_rev=sso_rev + 1, is_active=False,
+                                              profile=dict(remote_user_object['profile'], sso_rev=sso_rev + 1))
+
+            mocked_url = app_settings.REMOTE_USER_URL.format(sso_id=remote_profile_uuid)
+            profile_url = reverse('django_sso_app_profile:rest-detail', args=(remote_profile_uuid,))
+
+            self._set_mocked_response(mocked_url, remote_user_object)
+            self._set_mocked_response(mocked_url, updated_remote_user_object)
+
+            client = self._get_client()
+            client.cookies = self._get_valid_jwt_cookie(remote_profile_uuid, sso_rev=sso_rev)
+
+            response = client.get(profile_url, content_type='application/json')
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+            # password is not carried by jwt claims, can not be served stale
+            client.cookies = self._get_valid_jwt_cookie(remote_profile_uuid, sso_rev=sso_rev + 1, is_active=True)
+
+            with mock.patch.object(refresh_remote_user, 'delay') as delay:
+                client.get(profile_url, content_type='application/json')
+
+                delay.assert_not_called()
+
+            self.assertEqual(len(responses.calls), 2)
+            self.assertFalse(Profile.objects.get(sso_id=remote_profile_uuid).user.is_active)
+            self.assertFalse(is_remote_user_refresh_pending(remote_profile_uuid))
@@ -6,9 +6,9 @@ from django import forms
 from allauth.account.adapter import get_adapter
 from rest_framework import serializers
 
-from ...utils import set_session_key
+from ...context import get_request_context
 from ... import app_settings
-from ...permissions import is_staff
+from ...permissions import is_request_user_staff
 from ...serializers import AbsoluteUrlSerializer
 from ..emails.models import EmailAddress
 from ..profiles.models import Profile
@@ -50,6 +50,18 @@ class UserRevisionSerializer(serializers.ModelSerializer):
         return instance.sso_rev
 
 
+class UsersBatchSerializer(serializers.Serializer):
+    sso_ids = serializers.ListField(child=serializers.CharField(), allow_empty=False)
+
+    def validate_sso_ids(self, value):
+        max_size = app_settings.USERS_BATCH_MAX_SIZE
+
+        if len(value) > max_size:
+            raise serializers.ValidationError('Ensure this field has no more than {} elements.'.format(max_size))
+
+        return value
+
+
 class UserProfileSerializer(AbsoluteUrlSerializer):
     sso_id = serializers.CharField(required=False)
     sso_rev = serializers.IntegerField(required=False)
@@ -136,8 +148,9 @@ class UserSerializer(AbsoluteUrlSerializer):
     def get_email_verified(self, user):
         if app_settings.BACKEND_ENABLED:
             try:
-                verified_email_addresses = user.emailaddress_set.filter(email=user.email, verified=True)
-                return verified_email_addresses.count() > 0
+                # iterates emails, uses prefetched ones if any
+                return any(email_address.verified and email_address.email == user.email
+                           for email_address in user.emailaddress_set.all())
 
             except:
                 logger.info('user "{}" has no verified emails'.format(user))
@@ -146,7 +159,7 @@ class UserSerializer(AbsoluteUrlSerializer):
         return True
 
     def get_groups(self, instance):
-        groups = list(instance.groups.values_list('name', flat=True))
+        groups = [group.name for group in instance.groups.all()]
 
         return groups
 
@@ -158,7 +171,7 @@ class UserSerializer(AbsoluteUrlSerializer):
         if request is not None:
             # remove field if password if not asked
             requesting_user = request.user
-            requesting_user_is_staff = is_staff(requesting_user)
+            requesting_user_is_staff = is_request_user_staff(request)
             is_same_user = requesting_user.sso_id == ret['sso_id']
 
             with_password = request.query_params.get('with_password',
@@ -195,7 +208,7 @@ class UserSerializer(AbsoluteUrlSerializer):
         requesting_user = request.user
         adapter = get_adapter(request=request)
 
-        requesting_user_is_staff = is_staff(requesting_user)
+        requesting_user_is_staff = is_request_user_staff(request)
 
         skip_confirmation = request.GET.get('skip_confirmation', None)
         must_confirm_email = True
@@ -248,7 +261,7 @@ class UserSerializer(AbsoluteUrlSerializer):
                 logger.info('password is plain')
                 user.set_password(new_password)
 
-            set_session_key(request, '__dssoa__user_password_updated', True)
+            get_request_context(request).user_password_updated = True
 
             user.save()
 
@@ -290,7 +303,7 @@ class NewUserSerializer(UserSerializer):
         request = self.context.get('request')
         requesting_user = request.user
 
-        requesting_user_is_staff = is_staff(requesting_user)
+        requesting_user_is_staff = is_request_user_staff(request)
         skip_confirmation = request.GET.get('skip_confirmation', None)
         must_confirm_email = True
         password_is_hashed = request.query_params.get('password_is_hashed', None)
@@ -0,0 +1,49 @@
+from celery import shared_task
+from celery.utils.log import get_task_logger
+
+from ...cache import get_shared_cache
+from ...metrics import flush_metrics
+from .utils import refresh_local_user_from_remote_backend, sync_remote_users as _sync_remote_users
+
+MODULE_NAME = 'users'
+LOCK_EXPIRE = 60 * 60  # Lock expires in 1 hour
+
+
+@shared_task(bind=True)
+def refresh_remote_user(self, sso_id, sso_rev=None, **kwargs):
+    """
+    Refreshes local user copy from remote backend (stale while revalidate)
+    """
+    _name = 'refresh_remote_user'
+    name = '{}.{}'.format(MODULE_NAME, _name)
+    _logger = get_task_logger(name)
+
+    _logger.info('Refreshing user with sso_id "{}" to rev "{}"'.format(sso_id, sso_rev))
+
+    try:
+        user = refresh_local_user_from_remote_backend(sso_id, sso_rev)
+    finally:
+        flush_metrics()
+
+    return user.sso_rev
+
+
+@shared_task(bind=True)
+def sync_remote_users(self, create=False, **kwargs):
+    _name = 'sync_remote_users'
+    name = '{}.{}'.format(MODULE_NAME, _name)
+    _logger = get_task_logger(name)
+
+    lock_id = '{}-lock'.format(name)
+    cache = get_shared_cache()
+
+    # cache.add fails if if the key already exists
+    if cache.add(lock_id, "true", LOCK_EXPIRE):
+        try:
+            ret = _sync_remote_users(create=create)
+        finally:
+            cache.delete(lock_id)
+            flush_metrics()
+        return ret
+
+    _logger.debug("{} is already being executed by another worker".format(name))
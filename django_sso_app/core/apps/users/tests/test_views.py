@@ -1,18 +1,24 @@
 import json
 import jwt
+import threading
+
+from unittest import mock
 
 from django.contrib.auth import get_user_model
 from django.test import Client
 from django.urls import reverse
 from django.utils.translation import ugettext_lazy as _
 from django.core import mail
+from django.core.management import call_command
 
 from allauth.account.adapter import get_adapter
 from rest_framework import status
 
-from django_sso_app.core.tests.factories import UserTestCase
+from django_sso_app.core.tests.factories import UserTestCase, responses
 
 from .... import app_settings
+from ...profiles.models import Profile
+from ..utils import create_local_user_from_object, get_sync_cursor
 
 User = get_user_model()
 
@@ -453,3 +459,235 @@ class TestUserUpdate(UserTestCase):
         )
 
         self.assertEqual(response2.status_code, status.HTTP_200_OK, 'user can not login with old confirmed email')
+
+
+class TestUsersSync(UserTestCase):
+
+    @responses.activate
+    def test_sync_updates_outdated_local_users_from_revisions(self):
+        with self.settings(DJANGO_SSO_APP_SHAPE='app_persistence',
+                           DJANGO_SSO_APP_SYNC_PAGE_SIZE=1):
+            outdated_user_object = self._get_remote_user_object()
+            outdated_user_object['sso_rev'] = 1
+            updated_user_object = self._get_remote_user_object()
+
+            create_local_user_from_object(outdated_user_object)
+            create_local_user_from_object(updated_user_object)
+
+            outdated_sso_id = outdated_user_object['sso_id']
+            remote_user_object = dict(outdated_user_object, sso_rev=3,
+                                      profile=dict(outdated_user_object['profile'], sso_rev=3))
+
+            revisions_url = app_settings.REMOTE_USERS_REVISIONS_URL
+
+            self._set_mocked_response(revisions_url, {
+                'count': 3,
+                'next': revisions_url + '?limit=1&offset=1',
+                'results': [{'sso_id': outdated_sso_id, 'sso_rev': 3}]
+            })
+            self._set_mocked_response(revisions_url, {
+                'count': 3,
+                'next': None,
+                'results': [{'sso_id': updated_user_object['sso_id'], 'sso_rev': updated_user_object['sso_rev']},
+                            {'sso_id': self._get_random_uuid(), 'sso_rev': 1}]
+            })
+            self._set_mocked_response(app_settings.REMOTE_USERS_BATCH_URL, [remote_user_object], method='POST')
+
+            call_command('sync_remote_users')
+
+            # 2 revisions pages, 1 outdated user batch
+            self.assertEqual(len(responses.calls), 3)
+            self.assertEqual(json.loads(responses.calls[1].request.body), {'sso_ids': [outdated_sso_id]})
+            self.assertEqual(Profile.objects.get(sso_id=outdated_sso_id).sso_rev, 3)
+            self.assertEqual(Profile.objects.get(sso_id=updated_user_object['sso_id']).sso_rev,
+                             updated_user_object['sso_rev'])
+            self.assertEqual(Profile.objects.count(), 2)
+            self.assertIsNone(get_sync_cursor())
+
+    @responses.activate
+    def test_sync_fetches_page_chunks_in_parallel(self):
+        with self.settings(DJANGO_SSO_APP_SHAPE='app_persistence',
+                           DJANGO_SSO_APP_SYNC_CHUNK_SIZE=1,
+                           DJANGO_SSO_APP_SYNC_CONCURRENCY=2):
+            remote_user_objects = {}
+
+            for _i in range(2):
+                outdated_user_object = self._get_remote_user_object()
+                outdated_user_object['sso_rev'] = 1
+
+                create_local_user_from_object(outdated_user_object)
+
+                remote_user_objects[outdated_user_object['sso_id']] = dict(
+                    outdated_user_object, sso_rev=2, profile=dict(outdated_user_object['profile'], sso_rev=2))
+
+            self._set_mocked_response(app_settings.REMOTE_USERS_REVISIONS_URL, {
+                'count': 2,
+                'next': None,
+                'results': [{'sso_id': sso_id, 'sso_rev': 2} for sso_id in remote_user_objects.keys()]
+            })
+
+            # both chunks must be in flight together
+            barrier = threading.Barrier(2, timeout=5)
+
+            def fetch_remote_users(sso_ids):
+                barrier.wait()
+
+                return dict((sso_id, remote_user_objects[sso_id]) for sso_id in sso_ids)
+
+            with mock.patch('django_sso_app.core.apps.users.utils.fetch_remote_users', fetch_remote_users):
+                call_command('sync_remote_users')
+
+            for sso_id in remote_user_objects.keys():
+                self.assertEqual(Profile.objects.get(sso_id=sso_id).sso_rev, 2)
+
+    @responses.activate
+    def test_sync_cursor_stops_at_first_page_with_failures(self):
+        with self.settings(DJANGO_SSO_APP_SHAPE='app_persistence',
+                           DJANGO_SSO_APP_SYNC_PAGE_SIZE=1):
+            outdated_user_object = self._get_remote_user_object()
+            outdated_user_object['sso_rev'] = 1
+
+            create_local_user_from_object(outdated_user_object)
+
+            outdated_sso_id = outdated_user_object['sso_id']
+            remote_user_object = dict(outdated_user_object, sso_rev=2,
+                                      profile=dict(outdated_user_object['profile'], sso_rev=2))
+
+            revisions_url = app_settings.REMOTE_USERS_REVISIONS_URL
+
+            for _i in range(2):
+                self._set_mocked_response(revisions_url, {
+                    'count': 2,
+                    'next': revisions_url + '?limit=1&offset=1',
+                    'results': [{'sso_id': outdated_sso_id, 'sso_rev': 2}]
+                })
+                self._set_mocked_response(revisions_url, {
+                    'count': 2,
+                    'next': None,
+                    'results': [{'sso_id': self._get_random_uuid(), 'sso_rev': 1}]
+                })
+            self._set_mocked_response(app_settings.REMOTE_USERS_BATCH_URL, {}, status=400, method='POST')
+            self._set_mocked_response(app_settings.REMOTE_USERS_BATCH_URL, [remote_user_object], method='POST')
+
+            call_command('sync_remote_users')
+
+            self.assertEqual(Profile.objects.get(sso_id=outdated_sso_id).sso_rev, 1)
+            self.assertEqual(get_sync_cursor(), '{}?limit=1'.format(revisions_url))
+
+            call_command('sync_remote_users')
+
+            self.assertEqual(Profile.objects.get(sso_id=outdated_sso_id).sso_rev, 2)
+            self.assertIsNone(get_sync_cursor())
+
+    @responses.activate
+    def test_sync_fetches_users_one_by_one_without_backend_batch_entrypoint(self):
+        with self.settings(DJANGO_SSO_APP_SHAPE='app_persistence'):
+            outdated_user_object = self._get_remote_user_object()
+            outdated_user_object['sso_rev'] = 1
+
+            create_local_user_from_object(outdated_user_object)
+
+            outdated_sso_id = outdated_user_object['sso_id']
+            remote_user_object = dict(outdated_user_object, sso_rev=2,
+                                      profile=dict(outdated_user_object['profile'], sso_rev=2))
+
+            self._set_mocked_response(app_settings.REMOTE_USERS_REVISIONS_URL, {
+                'count': 1,
+                'next': None,
+                'results': [{'sso_id': outdated_sso_id, 'sso_rev': 2}]
+            })
+            self._set_mocked_response(app_settings.REMOTE_USERS_BATCH_URL, {'detail': 'Not found.'},
+                                      status=404, method='POST')
+            self._set_mocked_response(app_settings.REMOTE_USER_URL.format(sso_id=outdated_sso_id), remote_user_object)
+
+            call_command('sync_remote_users')
+
+            self.assertEqual(len(responses.calls), 3)
+            self.assertEqual(Profile.objects.get(sso_id=outdated_sso_id).sso_rev, 2)
+
+
+class TestUsersBatch(UserTestCase):
+
+    def _get_users_batch(self, sso_ids, headers, with_password=False):
+        client = self._get_client()
+
+        return client.post(
+            reverse('django_sso_app_user_extra:get_users') + ('?with_password=true' if with_password else ''),
+            data=json.dumps({'sso_ids': sso_ids}),
+            **headers
+        )
+
+    def test_staff_user_can_retrieve_users_batch(self):
+        users = [self._get_new_user() for _i in range(3)]
+        new_staff_user = self._get_new_staff_user()
+        new_staff_user_token_headers = self._get_new_api_token_headers(new_staff_user)
+
+        sso_ids = [user.sso_id for user in users[:2]] + [self._get_random_uuid()]
+
+        response = self._get_users_batch(sso_ids, new_staff_user_token_headers, with_password=True)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # unknown sso_id skipped
+        self.assertEqual(sorted(user_object['sso_id'] for user_object in response.data),
+                         sorted(sso_ids[:2]))
+
+        detail_response = self._get_client().get(
+            reverse('django_sso_app_user:rest-detail', args=[users[0].sso_id]) + '?with_password=true',
+            **new_staff_user_token_headers
+        )
+
+        user_object = [user_object for user_object in response.data if user_object['sso_id'] == users[0].sso_id][0]
+
+        # same representation as user detail
+        self.assertEqual(user_object, detail_response.data)
+        self.assertIn('password', user_object)
+
+    def test_users_batch_queries_do_not_grow_with_users(self):
+        new_staff_user = self._get_new_staff_user()
+        new_staff_user_token_headers = self._get_new_api_token_headers(new_staff_user)
+
+        def count_queries(sso_ids):
+            from django.db import connection
+            from django.test.utils import CaptureQueriesContext
+
+            with CaptureQueriesContext(connection) as context:
+                response = self._get_users_batch(sso_ids, new_staff_user_token_headers)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(len(response.data), len(sso_ids))
+
+            return len(context.captured_queries)
+
+        self.assertEqual(count_queries([self._get_new_user().sso_id for _i in range(2)]),
+                         count_queries([self._get_new_user().sso_id for _i in range(6)]))
+
+    def test_non_staff_user_can_not_retrieve_users_batch(self):
+        new_user = self._get_new_user()
+
+        response = self._get_users_batch([new_user.sso_id], self._get_new_api_token_headers(new_user))
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_users_batch_size_is_limited(self):
+        new_staff_user = self._get_new_staff_user()
+        new_staff_user_token_headers = self._get_new_api_token_headers(new_staff_user)
+
+        response = self._get_users_batch([self._get_random_uuid()
+                                          for _i in range(app_settings.USERS_BATCH_MAX_SIZE + 1)],
+                                         new_staff_user_token_headers)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_users_batch_size_limit_is_read_at_request_time(self):
+        new_staff_user = self._get_new_staff_user()
+        new_staff_user_token_headers = self._get_new_api_token_headers(new_staff_user)
+
+        with self.settings(DJANGO_SSO_APP_USERS_BATCH_MAX_SIZE=1):
+            response = self._get_users_batch([new_staff_user.sso_id, self._get_random_uuid()],
+                                             new_staff_user_token_headers)
+
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+            response = self._get_users_batch([new_staff_user.sso_id], new_staff_user_token_headers)
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
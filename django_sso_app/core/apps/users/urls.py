@@ -4,6 +4,7 @@ from rest_framework.urlpatterns import format_suffix_patterns
 from .views import (CheckUserExistenceApiView,
                     UserApiViewSet,
                     UserRevisionsApiView,
+                    UsersBatchApiView,
                     UserDetailApiView)
 
 _urlpatterns = [
@@ -18,7 +19,9 @@ _urlpatterns = [
 extra_urlpatterns = (format_suffix_patterns([
                          url(r'^user/$', UserDetailApiView.as_view(), name="user_detail"),
                          url(r'^check-user/$', CheckUserExistenceApiView.as_view(), name="check_user_existence"),
-                         url(r'^get-revisions/$', UserRevisionsApiView.as_view({'get': 'list'}), name="get_users_revisions")]),
+                         url(r'^get-revisions/$', UserRevisionsApiView.as_view({'get': 'list'}),
+                             name="get_users_revisions"),
+                         url(r'^get-users/$', UsersBatchApiView.as_view(), name="get_users")]),
                      'django_sso_app_user_extra')
 
 urlpatterns = (format_suffix_patterns(_urlpatterns), 'django_sso_app_user')
@@ -1,6 +1,8 @@
 import json
 import logging
 
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
 
 from django.db import transaction
@@ -8,6 +10,12 @@ from django.utils.encoding import smart_str
 from django.contrib.auth import get_user_model
 
 from ... import app_settings
+from ...cache import get_shared_cache
+from ...backend_client import get_backend_client
+from ...metrics import REMOTE_REPLICATIONS
+from ...singleflight import single_flight
+from ...tokens.cache import invalidate_profile_tokens
+from ...tokens.revocation import revoke_profile_tokens
 from ..emails.models import EmailAddress
 from ..profiles.utils import update_profile
 from ..api_gateway.functions import get_apigateway_profile_groups_from_header
@@ -15,15 +23,11 @@ from ..api_gateway.functions import get_apigateway_profile_groups_from_header
 logger = logging.getLogger('django_sso_app')
 
 
-def fetch_remote_user(sso_id, encoded_jwt=None):
-    """
-    Fetches user model from remote django-sso-app backend
-    :param sso_id:
-    :param encoded_jwt:
-    :return:
-    """
-    logger.info("Getting SSO profile for ID {} ...".format(sso_id))
+def _backend_get(operation, url, **kwargs):
+    return get_backend_client().get(operation, url, **kwargs)
+
 
+def _get_remote_user_request(sso_id, encoded_jwt=None):
     if encoded_jwt is None:
         logger.debug('Using Token')
         headers = {
@@ -37,7 +41,21 @@ def fetch_remote_user(sso_id, encoded_jwt=None):
 
     url = app_settings.REMOTE_USER_URL.format(sso_id=sso_id) + '?with_password=true'
 
-    response = requests.get(url=url, headers=headers, timeout=10, verify=False)
+    return url, headers
+
+
+def fetch_remote_user(sso_id, encoded_jwt=None):
+    """
+    Fetches user model from remote django-sso-app backend
+    :param sso_id:
+    :param encoded_jwt:
+    :return:
+    """
+    logger.info("Getting SSO profile for ID {} ...".format(sso_id))
+
+    url, headers = _get_remote_user_request(sso_id, encoded_jwt)
+
+    response = _backend_get('fetch_user', url, headers=headers)
     response.raise_for_status()
     sso_user = response.json()
 
@@ -46,6 +64,55 @@ def fetch_remote_user(sso_id, encoded_jwt=None):
     return sso_user
 
 
+def fetch_remote_users(sso_ids):
+    """
+    Fetches user models from remote django-sso-app backend, one request per DJANGO_SSO_APP_USERS_BATCH_MAX_SIZE ids
+    :param sso_ids:
+    :return: {sso_id: user model}, missing remote users are skipped
+    """
+    sso_ids = [str(sso_id) for sso_id in sso_ids]
+    batch_size = app_settings.USERS_BATCH_MAX_SIZE
+    headers = {
+        "Authorization": "Token {}".format(app_settings.BACKEND_STAFF_TOKEN)
+    }
+    url = app_settings.REMOTE_USERS_BATCH_URL + '?with_password=true'
+
+    logger.info('Getting %s SSO profiles ...', len(sso_ids))
+
+    sso_users = {}
+    for i in range(0, len(sso_ids), batch_size):
+        response = get_backend_client().post('fetch_users', url, json={'sso_ids': sso_ids[i:i + batch_size]},
+                                             headers=headers)
+        response.raise_for_status()
+
+        for sso_user in response.json():
+            sso_users[str(sso_user['sso_id'])] = sso_user
+
+    logger.info('Retrieved %s SSO profiles', len(sso_users))
+
+    return sso_users
+
+
+async def afetch_remote_user(sso_id, encoded_jwt=None):
+    """
+    Fetches user model from remote django-sso-app backend without blocking the event loop
+    :param sso_id:
+    :param encoded_jwt:
+    :return:
+    """
+    logger.info('Getting SSO profile for ID %s ...', sso_id)
+
+    url, headers = _get_remote_user_request(sso_id, encoded_jwt)
+
+    response = await get_backend_client().aget('fetch_user', url, headers=headers)
+    response.raise_for_status()
+    sso_user = response.json()
+
+    logger.info('Retrieved SSO profile for ID %s', sso_id)
+
+    return sso_user
+
+
 def update_user(user, update_object, commit=True):
     logger.info('Try update user fields for "{}"'.format(user))
 
@@ -70,7 +137,7 @@ def check_remote_user_existence_by_username(username):
     params = {
         'username': username
     }
-    response = requests.get(url=url, params=params, timeout=10, verify=False)
+    response = _backend_get('check_user', url, params=params)
     response.raise_for_status()
 
     if response.status_code == requests.codes.NOT_FOUND:
@@ -94,7 +161,7 @@ def check_remote_user_existence_by_email(email):
     params = {
         'email': email
     }
-    response = requests.get(url=url, params=params, timeout=10, verify=False)
+    response = _backend_get('check_user', url, params=params)
     response.raise_for_status()
 
     if response.status_code == requests.codes.NOT_FOUND:
@@ -118,7 +185,7 @@ def get_remote_user_by_sso_id(sso_id):
     params = {
         'sso_id': sso_id
     }
-    response = requests.get(url=url, params=params, timeout=10, verify=False)
+    response = _backend_get('fetch_user', url, params=params)
     response.raise_for_status()
 
     if response.status_code == requests.codes.NOT_FOUND:
@@ -257,6 +324,8 @@ def create_local_user_from_remote_backend(remote_user_object, can_subscribe=Fals
 
     setattr(new_user, '__dssoa__remote_user', remote_user_object)  # noqa (subscription required)
 
+    REMOTE_REPLICATIONS.inc('created')
+
     return new_user
 
 
@@ -272,6 +341,8 @@ def update_local_user_from_remote_backend(user, remote_user_object, commit=True)
     # update profile
     setattr(user, 'sso_app_profile', update_profile(user.sso_app_profile, remote_object_profile, commit))
 
+    REMOTE_REPLICATIONS.inc('updated')
+
     return user
 
 
@@ -292,3 +363,276 @@ def replicate_remote_user(sso_id):
         user = update_local_user_from_remote_backend(prev_user, remote_user_object)
 
     return user
+
+
+def get_replication_key(sso_id):
+    """
+    Returns single flight key shared by user replications and updates
+    :param sso_id:
+    :return:
+    """
+    return 'replicate:{}'.format(sso_id)
+
+
+def _get_refresh_pending_key(sso_id):
+    return 'dssoa:refresh:{}'.format(sso_id)
+
+
+def mark_remote_user_refresh_pending(sso_id, sso_rev):
+    """
+    Marks local user copy as pending refresh, returns False if already pending
+    :param sso_id:
+    :param sso_rev: refresh target rev
+    :return:
+    """
+    return get_shared_cache().add(_get_refresh_pending_key(sso_id), sso_rev, app_settings.REPLICATION_REFRESH_TIMEOUT)
+
+
+def is_remote_user_refresh_pending(sso_id):
+    return get_shared_cache().get(_get_refresh_pending_key(sso_id)) is not None
+
+
+def clear_remote_user_refresh_pending(sso_id):
+    get_shared_cache().delete(_get_refresh_pending_key(sso_id))
+
+
+def refresh_local_user_from_remote_backend(sso_id, sso_rev=None):
+    """
+    Updates local user from remote backend, revoking previous profile tokens if any
+    DJANGO_SSO_APP_REPLICATION_SECURITY_FIELDS changed
+    :param sso_id:
+    :param sso_rev: refresh target rev, skips refresh if already reached by a concurrent update
+    :return:
+    """
+    User = get_user_model()
+
+    def get_refreshed_user():
+        user = User.objects.select_related('sso_app_profile').get(sso_app_profile__sso_id=sso_id)
+
+        if sso_rev is not None and user.sso_app_profile.sso_rev >= sso_rev:
+            return user
+
+    def refresh_user():
+        user = User.objects.select_related('sso_app_profile').get(sso_app_profile__sso_id=sso_id)
+        remote_user_object = fetch_remote_user(sso_id=sso_id)
+
+        security_fields = [f for f in app_settings.REPLICATION_SECURITY_FIELDS if hasattr(user, f)]
+        previous_values = [getattr(user, f) for f in security_fields]
+
+        # local profile updated from django_sso_app instance, do not update sso_rev
+        setattr(user, '__dssoa__creating', True)
+
+        try:
+            user = update_local_user_from_remote_backend(user, remote_user_object)
+
+        finally:
+            setattr(user, '__dssoa__creating', False)
+
+        changed_fields = [f for f, previous_value in zip(security_fields, previous_values)
+                          if getattr(user, f) != previous_value]
+
+        if len(changed_fields):
+            sso_rev = remote_user_object.get('sso_rev', None)
+
+            logger.warning('User "%s" security fields %s changed, revoking tokens older than rev "%s"',
+                           user, changed_fields, sso_rev)
+
+            invalidate_profile_tokens(sso_id)
+            if sso_rev is not None:
+                revoke_profile_tokens(sso_id, sso_rev)
+
+        return user
+
+    try:
+        return single_flight(get_replication_key(sso_id), refresh_user, get_refreshed_user)
+
+    finally:
+        clear_remote_user_refresh_pending(sso_id)
+
+
+# bulk sync
+
+SYNC_CURSOR_CACHE_KEY = 'dssoa:sync:cursor'
+
+
+def get_sync_cursor():
+    """
+    Returns remote users revisions page to resume sync from, None if last sync completed
+    :return:
+    """
+    return get_shared_cache().get(SYNC_CURSOR_CACHE_KEY)
+
+
+def set_sync_cursor(url):
+    if url is None:
+        get_shared_cache().delete(SYNC_CURSOR_CACHE_KEY)
+    else:
+        get_shared_cache().set(SYNC_CURSOR_CACHE_KEY, url, None)
+
+
+def fetch_remote_users_revisions(url):
+    """
+    Fetches remote backend users revisions page
+    :param url:
+    :return: ({sso_id: sso_rev}, next page url)
+    """
+    headers = {
+        "Authorization": "Token {}".format(app_settings.BACKEND_STAFF_TOKEN)
+    }
+
+    response = _backend_get('fetch_revisions', url, headers=headers)
+    response.raise_for_status()
+    data = response.json()
+
+    if isinstance(data, list):  # not paginated
+        results, next_url = data, None
+    else:
+        results, next_url = data['results'], data.get('next', None)
+
+    return dict((str(revision['sso_id']), revision['sso_rev']) for revision in results), next_url
+
+
+def _fetch_remote_user_or_none(sso_id):
+    try:
+        return fetch_remote_user(sso_id=sso_id)
+
+    except Exception as e:
+        logger.exception('Can not fetch remote user "%s": %s', sso_id, e)
+
+        return None
+
+
+def _fetch_remote_users_chunk(sso_ids, executor):
+    """
+    Fetches chunk remote users with one batch request, falling back to concurrent single user requests
+    on backends without batch entrypoint
+    :param sso_ids:
+    :param executor: single user requests executor
+    :return: remote user models (None if not fetched) in sso_ids order
+    """
+    try:
+        remote_user_objects = fetch_remote_users(sso_ids)
+
+    except requests.HTTPError as e:
+        if e.response is None or e.response.status_code not in (404, 405):
+            raise
+
+        logger.info('Remote backend has no users batch entrypoint, fetching users one by one')
+
+        return list(executor.map(_fetch_remote_user_or_none, sso_ids))
+
+    return [remote_user_objects.get(sso_id, None) for sso_id in sso_ids]
+
+
+def _sync_remote_users_page(revisions, create, stats):
+    from ..profiles.models import Profile
+
+    User = get_user_model()
+
+    # one query per page
+    local_revisions = dict((str(sso_id), sso_rev) for sso_id, sso_rev in
+                           Profile.objects.filter(sso_id__in=list(revisions.keys()))
+                                          .values_list('sso_id', 'sso_rev'))
+
+    # outdated (or missing if creating) local users
+    changed_sso_ids = [sso_id for sso_id, sso_rev in revisions.items()
+                       if local_revisions.get(sso_id, sso_rev) < sso_rev or (create and sso_id not in local_revisions)]
+
+    stats['checked'] += len(revisions)
+
+    chunk_size = app_settings.SYNC_CHUNK_SIZE
+    chunks = [changed_sso_ids[i:i + chunk_size] for i in range(0, len(changed_sso_ids), chunk_size)]
+
+    # chunks fetched in parallel, applied in order
+    with ThreadPoolExecutor(max_workers=app_settings.SYNC_CONCURRENCY) as executor, \
+            ThreadPoolExecutor(max_workers=app_settings.SYNC_CONCURRENCY) as fallback_executor:
+        futures = [executor.submit(_fetch_remote_users_chunk, chunk_sso_ids, fallback_executor)
+                   for chunk_sso_ids in chunks]
+
+        for chunk_sso_ids, future in zip(chunks, futures):
+            try:
+                remote_user_objects = future.result()
+
+            except Exception as e:
+                logger.exception('Can not fetch remote users chunk: %s', e)
+                stats['failed'] += len(chunk_sso_ids)
+                continue
+
+            users = dict((str(user.sso_app_profile.sso_id), user) for user in
+                         User.objects.select_related('sso_app_profile')
+                                     .filter(sso_app_profile__sso_id__in=chunk_sso_ids))
+
+            with transaction.atomic():
+                for sso_id, remote_user_object in zip(chunk_sso_ids, remote_user_objects):
+                    if remote_user_object is None:
+                        stats['failed'] += 1
+                        continue
+
+                    try:
+                        with transaction.atomic():
+                            user = users.get(sso_id, None)
+
+                            if user is None:
+                                create_local_user_from_remote_backend(remote_user_object)
+                                stats['created'] += 1
+
+                            else:
+                                # local profile updated from django_sso_app instance, do not update sso_rev
+                                setattr(user, '__dssoa__creating', True)
+
+                                try:
+                                    update_local_user_from_remote_backend(user, remote_user_object)
+                                finally:
+                                    setattr(user, '__dssoa__creating', False)
+
+                                stats['updated'] += 1
+
+                    except Exception as e:
+                        logger.exception('Can not sync remote user "%s": %s', sso_id, e)
+                        stats['failed'] += 1
+
+
+def sync_remote_users(create=False, resume=True):
+    """
+    Updates local users with outdated sso_rev from remote backend revisions, page by page, recording a resume cursor
+    (never past the first page with failed users)
+    :param create: replicate remote users missing locally
+    :param resume: start from last interrupted sync page
+    :return: stats
+    """
+    stats = {
+        'pages': 0,
+        'checked': 0,
+        'created': 0,
+        'updated': 0,
+        'failed': 0
+    }
+
+    url = get_sync_cursor() if resume else None
+
+    if url is None:
+        url = '{}?limit={}'.format(app_settings.REMOTE_USERS_REVISIONS_URL, app_settings.SYNC_PAGE_SIZE)
+    else:
+        logger.info('Resuming remote users sync from "%s"', url)
+
+    failed_url = None
+
+    while url is not None:
+        revisions, next_url = fetch_remote_users_revisions(url)
+        failed = stats['failed']
+
+        _sync_remote_users_page(revisions, create, stats)
+
+        stats['pages'] += 1
+
+        if failed_url is None and stats['failed'] > failed:
+            # next sync resumes from here
+            failed_url = url
+
+        url = next_url
+
+        set_sync_cursor(failed_url or url)
+
+    logger.info('Remote users sync completed: %s', stats)
+
+    return stats
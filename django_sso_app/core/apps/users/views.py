@@ -25,12 +25,13 @@ from rest_framework.views import APIView
 
 from .serializers import (CheckUserExistenceSerializer,
                           UserSerializer, NewUserSerializer,
-                          UserRevisionSerializer)
+                          UserRevisionSerializer, UsersBatchSerializer)
 
 from ...apps.emails.models import EmailAddress
 from ...permissions import StaffPermission
-from ...permissions import is_staff, is_django_staff
-from ...utils import invalidate_cookie, get_session_key
+from ...permissions import is_request_user_staff, is_django_staff
+from ...context import get_request_context
+from ...utils import invalidate_cookie
 from ...views import DjangoSsoAppBaseViewMixin
 from ... import app_settings
 from .filters import UserFilter
@@ -119,7 +120,7 @@ class UserApiViewSet(mixins.ListModelMixin,
         requesting_user = self.request.user
         queryset = User.objects.filter(is_superuser=False, is_active=True)
 
-        if is_staff(requesting_user):
+        if is_request_user_staff(self.request):
             return queryset
         else:
             return queryset.filter(pk=requesting_user.pk)
@@ -148,7 +149,7 @@ class UserApiViewSet(mixins.ListModelMixin,
         """
         logger.info('Creating user')
 
-        if not is_staff(request.user):
+        if not is_request_user_staff(request):
             msg = 'Non staff user "{}" tried to create new user'.format(request.user)
             logger.warning(msg)
 
@@ -180,7 +181,7 @@ class UserApiViewSet(mixins.ListModelMixin,
             if is_same_user and not is_django_staff(requesting_user):
 
                 # must login again if password updated
-                if get_session_key(request, '__dssoa__user_password_updated', False):
+                if get_request_context(request).user_password_updated:
                     logger.info('User {0} updated password and must login again'.format(requesting_user))
 
                     invalidate_cookie(response, app_settings.JWT_COOKIE_NAME)
@@ -196,7 +197,7 @@ class UserRevisionsApiView(mixins.ListModelMixin,
     User revisions entrypoint
     """
 
-    queryset = User.objects.filter(is_superuser=False, is_staff=False).order_by('id')
+    queryset = User.objects.filter(is_superuser=False, is_staff=False).select_related('sso_app_profile').order_by('id')
     serializer_class = UserRevisionSerializer
     permission_classes = (StaffPermission,)
 
@@ -208,6 +209,34 @@ class UserRevisionsApiView(mixins.ListModelMixin,
         return super(UserRevisionsApiView, self).list(request, *args, **kwargs)
 
 
+class UsersBatchApiView(APIView):
+    """
+    Users batch entrypoint, retrieves users by posted "sso_ids" list (unknown ones are skipped)
+    """
+
+    permission_classes = (StaffPermission,)
+
+    def get_queryset(self, sso_ids):
+        return User.objects.filter(sso_app_profile__sso_id__in=sso_ids) \
+                           .select_related('sso_app_profile') \
+                           .prefetch_related('groups',
+                                             'emailaddress_set',
+                                             'sso_app_profile__groups',
+                                             'sso_app_profile__subscriptions__service') \
+                           .order_by('id')
+
+    def post(self, request, *args, **kwargs):
+        serializer = UsersBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        sso_ids = serializer.validated_data['sso_ids']
+        logger.info('Retrieving %s users', len(sso_ids))
+
+        users = self.get_queryset(sso_ids)
+
+        return Response(UserSerializer(users, many=True, context={'request': request}).data)
+
+
 class UserDetailApiView(generics.RetrieveAPIView):
     """
     User detail entrypoint
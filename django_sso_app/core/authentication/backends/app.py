@@ -6,9 +6,15 @@ from django.contrib.auth.backends import ModelBackend
 
 from ...apps.users.utils import fetch_remote_user, create_local_user_from_remote_backend, \
                               update_local_user_from_remote_backend, create_local_user_from_jwt, \
-                              create_local_user_from_apigateway_headers
+                              create_local_user_from_apigateway_headers, get_replication_key, \
+                              mark_remote_user_refresh_pending, clear_remote_user_refresh_pending
+from ...apps.users.tasks import refresh_remote_user
 
 from ...apps.profiles.models import Profile
+from ...context import get_request_context
+from ...exceptions import BackendUnavailableException
+from ...singleflight import single_flight
+from ...timing import timed, STAGE_REPLICATION
 from ... import app_settings
 
 
@@ -16,19 +22,62 @@ logger = logging.getLogger('django_sso_app')
 User = get_user_model()
 
 
+def _jwt_claims_match_security_fields(user, decoded_jwt):
+    """
+    Returns True if jwt claims carry every DJANGO_SSO_APP_REPLICATION_SECURITY_FIELDS local user value
+    :param user:
+    :param decoded_jwt:
+    :return:
+    """
+    for field in app_settings.REPLICATION_SECURITY_FIELDS:
+        if hasattr(user, field) and (field not in decoded_jwt or decoded_jwt[field] != getattr(user, field)):
+            return False
+
+    return True
+
+
 class DjangoSsoAppAppBaseAuthenticationBackend(ModelBackend):
 
+    @staticmethod
+    def get_remote_user(request, sso_id, encoded_jwt):
+        """
+        Returns remote user prefetched by async middleware or fetches it
+        :param request:
+        :param sso_id:
+        :param encoded_jwt:
+        :return:
+        """
+        remote_user_object = get_request_context(request).remote_user if request is not None else None
+
+        if remote_user_object is not None and str(remote_user_object.get('sso_id', None)) == str(sso_id):
+            return remote_user_object
+
+        return fetch_remote_user(sso_id=sso_id, encoded_jwt=encoded_jwt)
+
     def try_replicate_user(self, request, sso_id, encoded_jwt, decoded_jwt):
         logger.debug('try_replicate_user')
 
         if app_settings.REPLICATE_PROFILE:
-            logger.info('Replicate user with sso_id "{}" from remote backend'.format(sso_id))
+            logger.info('Replicate user with sso_id "%s" from remote backend', sso_id)
+
+            def replicate_user():
+                backend_user = self.get_remote_user(request, sso_id, encoded_jwt)
+                #backend_user_profile = backend_user['profile']
 
-            # create local profile from SSO
-            backend_user = fetch_remote_user(sso_id=sso_id, encoded_jwt=encoded_jwt)
-            #backend_user_profile = backend_user['profile']
+                return create_local_user_from_remote_backend(backend_user)
 
-            user = create_local_user_from_remote_backend(backend_user)
+            def get_replicated_user():
+                return User.objects.filter(sso_app_profile__sso_id=sso_id).first()
+
+            # create local profile from SSO, once between concurrent requests
+            try:
+                with timed(request, STAGE_REPLICATION):
+                    user = single_flight(get_replication_key(sso_id), replicate_user, get_replicated_user)
+
+            except BackendUnavailableException:
+                logger.warning('Remote backend unavailable, can not replicate user with sso_id "%s"', sso_id)
+
+                user = None
 
             #if backend_user_profile.get('is_incomplete', False):
             #    redirect_to_profile_complete(user)
@@ -38,29 +87,93 @@ class DjangoSsoAppAppBaseAuthenticationBackend(ModelBackend):
 
         return user
 
-    def try_update_user(self, sso_id, user, user_profile, encoded_jwt, decoded_jwt):
+    @staticmethod
+    def try_refresh_user_in_background(request, sso_id, user, decoded_jwt):
+        """
+        Enqueues (once per sso_id) user refresh from remote backend, returns False if user must be updated in request
+        (security fields are never served stale: jwt claims must vouch for all of them)
+        :param request:
+        :param sso_id:
+        :param user:
+        :param decoded_jwt:
+        :return:
+        """
+        if not app_settings.REPLICATION_STALE_WHILE_REVALIDATE:
+            return False
+
+        remote_user_object = get_request_context(request).remote_user if request is not None else None
+
+        if remote_user_object is not None and str(remote_user_object.get('sso_id', None)) == str(sso_id):
+            # already fetched by async middleware
+            return False
+
+        if not _jwt_claims_match_security_fields(user, decoded_jwt):
+            logger.info('User "%s" security fields may have changed, updating in request', user)
+
+            return False
+
+        if mark_remote_user_refresh_pending(sso_id, decoded_jwt['sso_rev']):
+            try:
+                refresh_remote_user.delay(sso_id, decoded_jwt['sso_rev'])
+
+            except Exception:
+                logger.exception('Can not enqueue user "%s" refresh, updating in request', user)
+                clear_remote_user_refresh_pending(sso_id)
+
+                return False
+
+            logger.info('User "%s" refresh enqueued', user)
+
+        setattr(user, '__dssoa__refresh_pending', True)
+
+        return True
+
+    def try_update_user(self, sso_id, user, user_profile, encoded_jwt, decoded_jwt, request=None):
         logger.debug('try_update_user')
 
         rev_changed = user_profile.sso_rev < decoded_jwt['sso_rev']
 
         if rev_changed:
             if rev_changed:
-                logger.info('Rev changed from "{}" to "{}" for user "{}", updating ...'
-                            .format(user_profile.sso_rev, decoded_jwt['sso_rev'],
-                                    user))
+                logger.info('Rev changed from "%s" to "%s" for user "%s", updating ...',
+                            user_profile.sso_rev, decoded_jwt['sso_rev'], user)
+
+            if self.try_refresh_user_in_background(request, sso_id, user, decoded_jwt):
+                # authenticating with local copy
+                return user
 
-            # local profile updated from django_sso_app instance, do not update sso_rev
-            setattr(user, '__dssoa__creating', True)
+            def update_user():
+                # local profile updated from django_sso_app instance, do not update sso_rev
+                setattr(user, '__dssoa__creating', True)
 
-            remote_user_object = fetch_remote_user(sso_id=sso_id, encoded_jwt=encoded_jwt)
-            user = update_local_user_from_remote_backend(user, remote_user_object)
+                try:
+                    remote_user_object = self.get_remote_user(request, sso_id, encoded_jwt)
 
-            logger.info('{} updated with latest data from BACKEND'.format(user))
+                    return update_local_user_from_remote_backend(user, remote_user_object)
 
-            setattr(user, '__dssoa__creating', False)
+                finally:
+                    setattr(user, '__dssoa__creating', False)
+
+            def get_updated_user():
+                updated_user = User.objects.select_related('sso_app_profile').get(pk=user.pk)
+
+                if updated_user.sso_app_profile.sso_rev >= decoded_jwt['sso_rev']:
+                    return updated_user
+
+            # update once between concurrent requests
+            try:
+                with timed(request, STAGE_REPLICATION):
+                    user = single_flight(get_replication_key(sso_id), update_user, get_updated_user)
+
+            except BackendUnavailableException:
+                # keeping local copy (and rev), updated on next authentication
+                logger.warning('Remote backend unavailable, can not update user "%s"', user)
+
+            else:
+                logger.info('%s updated with latest data from BACKEND', user)
 
         else:
-            logger.info('Nothing changed for user "{}"'.format(user))
+            logger.info('Nothing changed for user "%s"', user)
 
         return user
 
@@ -82,7 +195,7 @@ class DjangoSsoAppApiGatewayAppAuthenticationBackend(DjangoSsoAppAppBaseAuthenti
         return user
 
     def app_authenticate(self, request, consumer_custom_id, encoded_jwt, decoded_jwt):
-        logger.info('APP authenticating by apigateway consumer {}'.format(consumer_custom_id))
+        logger.info('APP authenticating by apigateway consumer %s', consumer_custom_id)
 
         try:
             sso_id = consumer_custom_id
@@ -90,12 +203,12 @@ class DjangoSsoAppApiGatewayAppAuthenticationBackend(DjangoSsoAppAppBaseAuthenti
             user = profile.user
 
         except ObjectDoesNotExist:
-            logger.info('No profile with id "{}"'.format(sso_id))
+            logger.info('No profile with id "%s"', sso_id)
             try:
                 user = self.try_replicate_user(request, sso_id, encoded_jwt, decoded_jwt)
 
             except Exception as e:
-                logger.exception('Can not replicate user: {}'.format(e))
+                logger.exception('Can not replicate user: %s', e)
                 raise
 
         else:
@@ -106,7 +219,7 @@ class DjangoSsoAppApiGatewayAppAuthenticationBackend(DjangoSsoAppAppBaseAuthenti
                     logger.warning('decoded_jwt not set')
                     return
 
-                user = self.try_update_user(sso_id, user, profile, encoded_jwt, decoded_jwt)
+                user = self.try_update_user(sso_id, user, profile, encoded_jwt, decoded_jwt, request=request)
 
         return user
 
@@ -123,7 +236,11 @@ class DjangoSsoAppJwtAppAuthenticationBackend(DjangoSsoAppAppBaseAuthenticationB
 
         if user is None:
             # create local profile from jwt
-            logger.info('Replicating user with sso_id "{}" from JWT'.format(sso_id))
+            logger.info('Replicating user with sso_id "%s" from JWT', sso_id)
+
+            if app_settings.REPLICATE_PROFILE:
+                # remote backend unavailable, zero rev gets user updated from backend on next authentication
+                decoded_jwt = dict(decoded_jwt, sso_rev=0)
 
             user = create_local_user_from_jwt(decoded_jwt)
 
@@ -143,9 +260,9 @@ class DjangoSsoAppJwtAppAuthenticationBackend(DjangoSsoAppAppBaseAuthenticationB
             user = profile.user
 
             if app_settings.REPLICATE_PROFILE:
-                logger.debug('try_update_user "{}" jwt consumer "{}"'.format(sso_id, sso_id))
+                logger.debug('try_update_user "%s" jwt consumer "%s"', sso_id, sso_id)
 
-                user = self.try_update_user(sso_id, user, profile, encoded_jwt, decoded_jwt)
+                user = self.try_update_user(sso_id, user, profile, encoded_jwt, decoded_jwt, request=request)
 
             else:
                 # just updates user groups
@@ -167,6 +284,6 @@ class DjangoSsoAppJwtAppAuthenticationBackend(DjangoSsoAppAppBaseAuthenticationB
                     logger.warning('decoded_jwt not set')
                     raise
 
-                user = self.try_update_user(sso_id, user, profile, encoded_jwt, decoded_jwt)
+                user = self.try_update_user(sso_id, user, profile, encoded_jwt, decoded_jwt, request=request)
 
         return user
@@ -18,7 +18,7 @@ class DjangoSsoAppApiGatewayBackendAuthenticationBackend(ModelBackend):
     backend_path = 'django_sso_app.core.authentication.backends.DjangoSsoAppApiGatewayAuthenticationBackend'
 
     def backend_authenticate(self, request, consumer_custom_id, encoded_jwt, decoded_jwt):
-        logger.info('BACKEND authenticating by apigateway consumer {}'.format(consumer_custom_id))
+        logger.info('BACKEND authenticating by apigateway consumer %s', consumer_custom_id)
 
         if consumer_custom_id is None:
             logger.debug('consumer_custom_id not set, skipping authentication')
@@ -31,12 +31,12 @@ class DjangoSsoAppApiGatewayBackendAuthenticationBackend(ModelBackend):
             user = profile.user
 
         except ObjectDoesNotExist:
-            logger.debug('user with apigateway consumer_custom_id "{}" does not exists'.format(consumer_custom_id))
+            logger.debug('user with apigateway consumer_custom_id "%s" does not exists', consumer_custom_id)
 
             return
 
         else:
-            logger.debug('user with apigateway consumer_custom_id "{}" exists'.format(consumer_custom_id))
+            logger.debug('user with apigateway consumer_custom_id "%s" exists', consumer_custom_id)
 
             # allauth logic
             setattr(user, 'backend', self.backend_path)
@@ -60,11 +60,11 @@ class DjangoSsoAppJwtBackendAuthenticationBackend(ModelBackend):
             user = profile.user
 
         except ObjectDoesNotExist:
-            logger.debug('user with sso_id "{}" does not exists'.format(sso_id))
+            logger.debug('user with sso_id "%s" does not exists', sso_id)
             return
 
         else:
-            logger.debug('user with sso_id "{}" exists'.format(sso_id))
+            logger.debug('user with sso_id "%s" exists', sso_id)
 
             # allauth logic
             setattr(user, 'backend', self.backend_path)
@@ -1,18 +1,31 @@
 import logging
 
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:  # django < 3.0, sync only
+    sync_to_async = None
+
 from django.core.exceptions import ImproperlyConfigured
 from django.utils.encoding import smart_str
 
-from jwt.exceptions import InvalidSignatureError
+from jwt.exceptions import InvalidSignatureError, ExpiredSignatureError
 
 from ... import app_settings
-from ...utils import set_session_key, get_session_key, invalidate_cookie
+from ...context import get_request_context
+from ...logs import log_event, EVENT_REQUEST_STARTED, EVENT_REQUEST_FINISHED, EVENT_REQUEST_STATE
+from ...utils import invalidate_cookie
 from ...permissions import is_authenticated, is_django_staff
-from ...exceptions import RequestHasValidJwtWithNoDeviceAssociated, ServiceSubscriptionRequiredException, ProfileIncompleteException
-from ...tokens.utils import get_request_jwt, jwt_decode
+from ...exceptions import RequestHasValidJwtWithNoDeviceAssociated, ServiceSubscriptionRequiredException, \
+    ProfileIncompleteException, BackendUnavailableException
+from ...tokens.utils import get_request_jwt, get_request_parsed_token, jwt_decode
+from ...apps.users.utils import afetch_remote_user
+from ...metrics import JWT_VERIFICATION_FAILURES, CACHE_REQUESTS, flush_metrics
+from ...timing import timed, set_server_timing_header, STAGE_JWT_PARSE, STAGE_JWT_DECODE, \
+    STAGE_SESSION_FAST_PATH, STAGE_REPLICATION
 
 from .backend import DjangoSsoAppAuthenticationBackendMiddleware
 from .app import DjangoSsoAppAuthenticationAppMiddleware
+from .routes import ROUTE_SKIP
 
 logger = logging.getLogger('django_sso_app')
 
@@ -26,7 +39,12 @@ class DjangoSsoAppAuthenticationMiddleware(DjangoSsoAppAuthenticationBackendMidd
     See django.contrib.auth.middleware.RemoteUserMiddleware.
     """
 
-    def process_request(self, request):
+    def _process_request_credentials(self, request):
+        """
+        Validates request JWT and session user, returns (request_jwt, decoded_jwt) if request must be authenticated
+        :param request:
+        :return:
+        """
         # AuthenticationMiddleware is required so that request.user exists.
         if not hasattr(request, 'user'):
             raise ImproperlyConfigured(
@@ -35,21 +53,24 @@ class DjangoSsoAppAuthenticationMiddleware(DjangoSsoAppAuthenticationBackendMidd
                 " 'django.contrib.auth.middleware.AuthenticationMiddleware'"
                 " before the SsoMiddleware class.")
 
+        if self._get_route_action(request) == ROUTE_SKIP:
+            return
+
+        context = get_request_context(request)
         request_path = request.path
         request_method = request.method
         request_ip = request.META.get('REMOTE_ADDR', None)
         requesting_user = request.user
 
-        logger.info('--> "{}" request "{}" path "{}" method "{}" user "{}"'.format(request_ip,
-                                                                                   id(request),
-                                                                                   request_path,
-                                                                                   request_method,
-                                                                                   requesting_user))
+        log_event(logging.INFO, EVENT_REQUEST_STARTED,
+                  '--> "%(request_ip)s" request "%(request_id)s" path "%(path)s" method "%(method)s" user "%(user)s"',
+                  request_ip=request_ip, request_id=id(request), path=request_path, method=request_method,
+                  user=requesting_user)
 
         if is_authenticated(requesting_user):
 
             if is_django_staff(requesting_user):
-                logger.info('Skipping django staff user "{}"'.format(requesting_user))
+                logger.info('Skipping django staff user "%s"', requesting_user)
                 #  >= 1.10 has is_authenticated as parameter
                 # If a staff user is already authenticated, we don't need to
                 # continue
@@ -57,7 +78,7 @@ class DjangoSsoAppAuthenticationMiddleware(DjangoSsoAppAuthenticationBackendMidd
                 return
 
             elif self._is_admin_path(request):
-                logger.warning('Non staff user "{}" called admin path'.format(requesting_user))
+                logger.warning('Non staff user "%s" called admin path', requesting_user)
 
                 self._remove_invalid_user(request)
                 self._clear_response_jwt(request)
@@ -65,13 +86,26 @@ class DjangoSsoAppAuthenticationMiddleware(DjangoSsoAppAuthenticationBackendMidd
                 return
 
         # saving request info
-        set_session_key(request, '__dssoa__request_ip', request_ip)
-        set_session_key(request, '__dssoa__requesting_user', requesting_user)
+        context.request_ip = request_ip
+        context.requesting_user = requesting_user
+
+        if is_authenticated(requesting_user):
+            with timed(request, STAGE_SESSION_FAST_PATH):
+                session_fast_path = self._session_fast_path(request, requesting_user,
+                                                            get_request_jwt(request, encoded=False))
+
+            if session_fast_path:
+                logger.info('User "%s" already authenticated with request JWT', requesting_user)
+                CACHE_REQUESTS.inc('session', 'hit')
+
+                return
+
+            CACHE_REQUESTS.inc('session', 'miss')
 
         """
         if self.request_path.startswith('/api/v1/passepartout'):
             logger.info('is passepartout path')
-            # set_session_key(request, '__dssoa__is_passepartout_path', True)
+            # context.is_passepartout_path = True
         """
 
         try:
@@ -83,11 +117,19 @@ class DjangoSsoAppAuthenticationMiddleware(DjangoSsoAppAuthenticationBackendMidd
                 return
 
             else:
+                # parsing request JWT once, shared with views, DRF authentication and device helpers
+                with timed(request, STAGE_JWT_PARSE):
+                    parsed_token = get_request_parsed_token(request, request_jwt)
                 # decoding request JWT
-                request_device, decoded_jwt = jwt_decode(request_jwt, verify=True)
+                with timed(request, STAGE_JWT_DECODE):
+                    request_device, decoded_jwt = jwt_decode(parsed_token, verify=True)
+
+                # shared with device helpers and signals
+                context.set_decoded_token(request_device, decoded_jwt)
 
         except KeyError:
-            logger.exception('Malformed JWT "{}"'.format(request_jwt))
+            logger.exception('Malformed JWT "%s"', request_jwt)
+            JWT_VERIFICATION_FAILURES.inc('KeyError')
 
             self._remove_invalid_user(request)
             self._clear_response_jwt(request)
@@ -95,23 +137,35 @@ class DjangoSsoAppAuthenticationMiddleware(DjangoSsoAppAuthenticationBackendMidd
             return
 
         except InvalidSignatureError:
-            logger.warning('Invalid JWT signature "{}"'.format(request_jwt))
+            logger.warning('Invalid JWT signature "%s"', request_jwt)
+            JWT_VERIFICATION_FAILURES.inc('InvalidSignatureError')
 
             self._remove_invalid_user(request)
             self._clear_response_jwt(request)
 
             return
 
+        except ExpiredSignatureError:
+            logger.info('Expired JWT "%s"', request_jwt)
+            JWT_VERIFICATION_FAILURES.inc('ExpiredSignatureError')
+
+            # keeping JWT for refresh
+            self._remove_invalid_user(request)
+
+            return
+
         except RequestHasValidJwtWithNoDeviceAssociated:
-            logger.warning('RequestHasValidJwtWithNoDeviceAssociated "{}"'.format(request_jwt))
+            logger.warning('RequestHasValidJwtWithNoDeviceAssociated "%s"', request_jwt)
+            JWT_VERIFICATION_FAILURES.inc('RequestHasValidJwtWithNoDeviceAssociated')
 
             self._remove_invalid_user(request)
             self._clear_response_jwt(request)
 
             return
 
-        except Exception:
-            logger.exception('Generic middleware exception "{}"'.format(request_jwt))
+        except Exception as e:
+            logger.exception('Generic middleware exception "%s"', request_jwt)
+            JWT_VERIFICATION_FAILURES.inc(type(e).__name__)
 
             self._remove_invalid_user(request)
             self._clear_response_jwt(request)
@@ -121,8 +175,8 @@ class DjangoSsoAppAuthenticationMiddleware(DjangoSsoAppAuthenticationBackendMidd
         else:
             # caching device fingerprint
             request_device_fingerprint = decoded_jwt[FINGERPRINT_JWT_KEY]
-            logger.debug('Caching request fingerprint: {}'.format(request_device_fingerprint))
-            set_session_key(request, '__dssoa__device__fingerprint', request_device_fingerprint)
+            logger.debug('Caching request fingerprint: %s', request_device_fingerprint)
+            context.device_fingerprint = request_device_fingerprint
 
         apigateway_enabled = app_settings.APIGATEWAY_ENABLED
         request_jwt_sso_id = decoded_jwt[SSO_ID_JWT_KEY]
@@ -158,7 +212,7 @@ class DjangoSsoAppAuthenticationMiddleware(DjangoSsoAppAuthenticationBackendMidd
             else:
                 sso_id = consumer_custom_id
 
-                set_session_key(request, '__dssoa__apigateway__consumer_custom_id', consumer_custom_id)
+                context.apigateway_consumer_custom_id = consumer_custom_id
 
         else:
             sso_id = request_jwt_sso_id
@@ -172,14 +226,17 @@ class DjangoSsoAppAuthenticationMiddleware(DjangoSsoAppAuthenticationBackendMidd
 
                 # An authenticated user is associated with the request, but
                 # it does not match the authorized user in the header.
-                logger.warning('credentials and request_user sso_id differs! "{}" "{}"'.format(sso_id,
-                                                                                               requesting_user.sso_id))
+                logger.warning('credentials and request_user sso_id differs! "%s" "%s"',
+                               sso_id, requesting_user.sso_id)
 
                 self._remove_invalid_user(request)
                 self._clear_response_jwt(request)
 
                 return
 
+        return request_jwt, decoded_jwt
+
+    def _process_request_authentication(self, request, request_jwt, decoded_jwt):
         try:
             # authentication
             if app_settings.BACKEND_ENABLED:
@@ -190,51 +247,137 @@ class DjangoSsoAppAuthenticationMiddleware(DjangoSsoAppAuthenticationBackendMidd
         except ProfileIncompleteException as e:
             if self._request_path_is_disabled_for_incomplete_users(request):
                 logger.info('User must complete profile')
-                set_session_key(request, '__dssoa__redirect', e.response)
+                get_request_context(request).redirect = e.response
 
         except ServiceSubscriptionRequiredException as e:
             if self._request_path_is_disabled_for_users_to_subscribe(request):
                 logger.info('User must subscribe service')
-                set_session_key(request, '__dssoa__redirect', e.response)
+                get_request_context(request).redirect = e.response
 
         except Exception as e:
-            logger.exception('Generic middleware backend exception "{}"'.format(e))
+            logger.exception('Generic middleware backend exception "%s"', e)
+
+            self._remove_invalid_user(request)
+
+            return
+
+        else:
+            self._set_session_fast_path(request, request_jwt, decoded_jwt)
+
+    def process_request(self, request):
+        credentials = self._process_request_credentials(request)
+
+        if credentials is not None:
+            self._process_request_authentication(request, *credentials)
+
+    def _process_request_until_remote_user(self, request):
+        """
+        Processes request up to the remote user fetch
+        :return: (credentials, remote user sso_id) if remote user must be fetched, None if request is processed
+        """
+        credentials = self._process_request_credentials(request)
+
+        if credentials is None:
+            return None
+
+        remote_user_sso_id = self._get_remote_user_sso_id(request, *credentials)
 
+        if remote_user_sso_id is None:
+            self._process_request_authentication(request, *credentials)
+
+            return None
+
+        return credentials, remote_user_sso_id
+
+    def _process_request_after_remote_user(self, request, credentials, remote_user_fetched):
+        if not remote_user_fetched:
             self._remove_invalid_user(request)
 
             return
 
+        self._process_request_authentication(request, *credentials)
+
+    async def _aprocess_request(self, request):
+        if self._get_route_action(request) == ROUTE_SKIP:
+            return
+
+        # session, db and cache work batched in one thread hop before and one after the backend call
+        pending = await sync_to_async(self._process_request_until_remote_user)(request)
+
+        if pending is None:
+            return
+
+        credentials, remote_user_sso_id = pending
+        remote_user_fetched = True
+
+        try:
+            # not blocking sync thread while waiting for backend
+            with timed(request, STAGE_REPLICATION):
+                remote_user = await afetch_remote_user(sso_id=remote_user_sso_id, encoded_jwt=credentials[0])
+
+        except BackendUnavailableException:
+            # authentication backend falls back to local data
+            logger.warning('Remote backend unavailable, can not fetch remote user "%s"', remote_user_sso_id)
+
+        except Exception as e:
+            logger.exception('Can not fetch remote user "%s": %s', remote_user_sso_id, e)
+
+            remote_user_fetched = False
+
+        else:
+            get_request_context(request).remote_user = remote_user
+
+        await sync_to_async(self._process_request_after_remote_user)(request, credentials, remote_user_fetched)
+
+    async def __acall__(self, request):
+        await self._aprocess_request(request)
+
+        response = await self.get_response(request)
+
+        if get_request_context(request).route_action == ROUTE_SKIP:
+            return response
+
+        return await sync_to_async(self.process_response)(request, response)
+
     @staticmethod
     def _process_response(request, response):
-        redirect = get_session_key(request, '__dssoa__redirect', None)
+        context = get_request_context(request)
 
-        if redirect is not None:
-            return redirect
+        if context.redirect is not None:
+            return context.redirect
 
         # invalidate JWT cookie on response (if required)
-        if get_session_key(request, '__dssoa__clear_response_jwt', False):
+        if context.clear_response_jwt:
             invalidate_cookie(response, app_settings.JWT_COOKIE_NAME)
 
         return response
 
     def process_response(self, request, response):
+        context = get_request_context(request)
+
+        if context.route_action == ROUTE_SKIP:
+            return response
+
         # getting request info
-        requesting_user = getattr(request, 'user', get_session_key(request, '__dssoa__requesting_user', None))
-        request_ip = get_session_key(request, '__dssoa__request_ip')
+        requesting_user = getattr(request, 'user', context.requesting_user)
+        request_ip = context.request_ip
+
+        user_logged_in = bool(context.logged_in)  # !!
+        user_logged_out = bool(context.logged_out)
+        request_fp = context.device_fingerprint
 
-        user_logged_in = get_session_key(request, '__dssoa__logged_in', False)  # !!
-        user_logged_out = get_session_key(request, '__dssoa__logged_out', False)
-        request_fp = get_session_key(request, '__dssoa__device__fingerprint', None)
+        log_event(logging.DEBUG, EVENT_REQUEST_STATE,
+                  'login: %(logged_in)s - logout: %(logged_out)s - FP: %(fingerprint)s',
+                  logged_in=user_logged_in, logged_out=user_logged_out, fingerprint=request_fp)
 
-        logger.debug('login: {} - logout: {} - FP: {}'.format(user_logged_in, user_logged_out, request_fp))
+        response = set_server_timing_header(request, self._process_response(request, response))
 
-        response = self._process_response(request, response)
+        flush_metrics(force=False)
 
-        logger.info('<-- "{}" request "{}" user "{}" path "{}" method "{}" ({})'.format(request_ip,
-                                                                                        id(request),
-                                                                                        requesting_user,
-                                                                                        request.path,
-                                                                                        request.method,
-                                                                                        response.status_code))
+        log_event(logging.INFO, EVENT_REQUEST_FINISHED,
+                  '<-- "%(request_ip)s" request "%(request_id)s" user "%(user)s" path "%(path)s" method "%(method)s" '
+                  '(%(status)s)',
+                  request_ip=request_ip, request_id=id(request), user=requesting_user, path=request.path,
+                  method=request.method, status=response.status_code)
 
         return response
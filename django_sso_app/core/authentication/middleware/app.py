@@ -4,9 +4,14 @@ import logging
 from django.contrib import auth
 
 from ...permissions import is_authenticated
-from ...utils import get_session_key, check_user_can_login
+from ...context import get_request_context
+from ...utils import check_user_can_login
 from ... import app_settings
-from ...apps.groups.utils import set_default_user_groups
+from ...apps.groups.utils import reconcile_default_groups
+
+from ...apps.profiles.models import Profile
+
+from ...timing import timed, STAGE_AUTHENTICATE, STAGE_ELIGIBILITY, STAGE_GROUPS
 
 from .base import DjangoSsoAppAuthenticationBaseMiddleware
 
@@ -15,41 +20,66 @@ logger = logging.getLogger('django_sso_app')
 
 class DjangoSsoAppAuthenticationAppMiddleware(DjangoSsoAppAuthenticationBaseMiddleware):
 
+    @staticmethod
+    def _get_remote_user_sso_id(request, request_jwt, decoded_jwt):
+        """
+        Returns sso_id of the user to fetch from remote backend (not replicated or rev changed), None otherwise
+        :param request:
+        :param request_jwt:
+        :param decoded_jwt:
+        :return:
+        """
+        if app_settings.BACKEND_ENABLED or not app_settings.REPLICATE_PROFILE or is_authenticated(request.user):
+            return None
+
+        if app_settings.APIGATEWAY_ENABLED:
+            sso_id = get_request_context(request).apigateway_consumer_custom_id
+        else:
+            sso_id = decoded_jwt['sso_id']
+
+        sso_rev = Profile.objects.filter(sso_id=sso_id).values_list('sso_rev', flat=True).first()
+
+        if sso_rev is None or sso_rev < decoded_jwt['sso_rev']:
+            return sso_id
+
     def app_process_request(self, request, request_jwt, decoded_jwt):
         user = getattr(request, 'user', None)
 
         if not is_authenticated(user):
             # We are seeing this user for the first time in this session, attempt
             # to authenticate the user.
-            if app_settings.APIGATEWAY_ENABLED:
-                consumer_custom_id = get_session_key(request, '__dssoa__apigateway__consumer_custom_id')
-
-                user = auth.authenticate(request=request,
-                                         consumer_custom_id=consumer_custom_id,
-                                         encoded_jwt=request_jwt,
-                                         decoded_jwt=decoded_jwt)
-            else:
-                user = auth.authenticate(request=request,
-                                         encoded_jwt=request_jwt,
-                                         decoded_jwt=decoded_jwt)
+            with timed(request, STAGE_AUTHENTICATE):
+                if app_settings.APIGATEWAY_ENABLED:
+                    consumer_custom_id = get_request_context(request).apigateway_consumer_custom_id
+
+                    user = auth.authenticate(request=request,
+                                             consumer_custom_id=consumer_custom_id,
+                                             encoded_jwt=request_jwt,
+                                             decoded_jwt=decoded_jwt)
+                else:
+                    user = auth.authenticate(request=request,
+                                             encoded_jwt=request_jwt,
+                                             decoded_jwt=decoded_jwt)
 
             # set request user
             setattr(request, 'user', user)  # !!
 
         # further checks
         if is_authenticated(user):
-            if app_settings.REPLICATE_PROFILE:
-                check_user_can_login(user)
-            else:
-                if app_settings.SERVICE_SUBSCRIPTION_REQUIRED:
-                    check_user_can_login(user, skip_profile_completion_checks=True)
+            with timed(request, STAGE_ELIGIBILITY):
+                if app_settings.REPLICATE_PROFILE:
+                    check_user_can_login(user, cached=True)
                 else:
-                    check_user_can_login(user, skip_profile_completion_checks=True,
-                                         skip_service_subscription_checks=True)
+                    if app_settings.SERVICE_SUBSCRIPTION_REQUIRED:
+                        check_user_can_login(user, skip_profile_completion_checks=True, cached=True)
+                    else:
+                        check_user_can_login(user, skip_profile_completion_checks=True,
+                                             skip_service_subscription_checks=True, cached=True)
 
             if app_settings.MANAGE_USER_GROUPS:
                 # default groups check
-                set_default_user_groups(user)
+                with timed(request, STAGE_GROUPS):
+                    reconcile_default_groups(user)
                 # update_profile_groups(user.sso_app_profile)  # profile groups are managed by backend
 
-            logger.info('User "{}" authenticated successfully!'.format(user))
+            logger.info('User "%s" authenticated successfully!', user)
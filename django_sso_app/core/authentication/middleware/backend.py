@@ -3,9 +3,12 @@ import logging
 from django.contrib import auth
 
 from ...permissions import is_authenticated
-from ...utils import check_user_can_login, get_session_key
+from ...context import get_request_context
+from ...utils import check_user_can_login
 from ... import app_settings
-from ...apps.groups.utils import set_default_user_groups, set_default_profile_groups
+from ...apps.groups.utils import reconcile_default_groups
+
+from ...timing import timed, STAGE_AUTHENTICATE, STAGE_ELIGIBILITY, STAGE_GROUPS
 
 from .base import DjangoSsoAppAuthenticationBaseMiddleware
 
@@ -19,28 +22,30 @@ class DjangoSsoAppAuthenticationBackendMiddleware(DjangoSsoAppAuthenticationBase
         if not is_authenticated(request.user):
             # We are seeing this user for the first time in this session, attempt
             # to authenticate the user.
-            if app_settings.APIGATEWAY_ENABLED:
-                consumer_custom_id = get_session_key(request, '__dssoa__apigateway__consumer_custom_id')
-
-                user = auth.authenticate(request=request,
-                                         consumer_custom_id=consumer_custom_id,
-                                         encoded_jwt=request_jwt,
-                                         decoded_jwt=decoded_jwt)
-            else:
-                user = auth.authenticate(request=request,
-                                         encoded_jwt=request_jwt,
-                                         decoded_jwt=decoded_jwt)
+            with timed(request, STAGE_AUTHENTICATE):
+                if app_settings.APIGATEWAY_ENABLED:
+                    consumer_custom_id = get_request_context(request).apigateway_consumer_custom_id
+
+                    user = auth.authenticate(request=request,
+                                             consumer_custom_id=consumer_custom_id,
+                                             encoded_jwt=request_jwt,
+                                             decoded_jwt=decoded_jwt)
+                else:
+                    user = auth.authenticate(request=request,
+                                             encoded_jwt=request_jwt,
+                                             decoded_jwt=decoded_jwt)
 
             # set request.user
             setattr(request, 'user', user)  # !!
 
         # further checks
         if is_authenticated(user):
-            check_user_can_login(user)
+            with timed(request, STAGE_ELIGIBILITY):
+                check_user_can_login(user, cached=True)
 
             if app_settings.MANAGE_USER_GROUPS:
                 # default groups check
-                set_default_user_groups(user)
-                set_default_profile_groups(user.sso_app_profile)
+                with timed(request, STAGE_GROUPS):
+                    reconcile_default_groups(user, user.sso_app_profile)
 
-            logger.info('User "{}" authenticated successfully!'.format(user))
+            logger.info('User "%s" authenticated successfully!', user)
@@ -1,24 +1,27 @@
 import logging
 
 from django.contrib import auth
-from django.urls import reverse
 from django.utils.deprecation import MiddlewareMixin  # https://stackoverflow.com/questions/42232606/django
                                                       # -exception-middleware-typeerror-object-takes-no-parameters
 from django.conf import settings
 
+from jwt.exceptions import ExpiredSignatureError
+
+from ...cache import warn_if_shared_cache_is_process_local
 from ...permissions import is_authenticated
-from ...utils import set_session_key
+from ...context import get_request_context
+from ...tokens.cache import get_token_digest
+from ...tokens.parsed import check_expiration
+from ...tokens.revocation import is_token_revoked
 from ... import app_settings
+from .routes import get_route_action, ROUTE_ENFORCE
 
 logger = logging.getLogger('django_sso_app')
 
 
 ADMIN_URL = '/{}'.format(getattr(settings, 'ADMIN_URL', 'admin/'))
-PROFILE_INCOMPLETE_ENABLED_PATHS = [
-    reverse('javascript-catalog'),
-    reverse('profile.complete'),
-]
-USER_TO_SUBSCRIBE_ENABLED_PATHS = PROFILE_INCOMPLETE_ENABLED_PATHS
+SESSION_FAST_PATH_KEY = '_dssoa_verified_jwt'
+SESSION_FAST_PATH_CLAIMS = ('id', 'fp', 'sso_id', 'sso_rev', 'exp')
 
 
 class DjangoSsoAppAuthenticationBaseMiddleware(MiddlewareMixin):
@@ -36,7 +39,7 @@ class DjangoSsoAppAuthenticationBaseMiddleware(MiddlewareMixin):
 
     @staticmethod
     def _clear_response_jwt(request):
-        set_session_key(request, '__dssoa__clear_response_jwt', True)
+        get_request_context(request).clear_response_jwt = True
 
     @staticmethod
     def _remove_invalid_user(request):
@@ -45,7 +48,7 @@ class DjangoSsoAppAuthenticationBaseMiddleware(MiddlewareMixin):
         """
 
         if is_authenticated(request.user):
-            logger.info('removing invalid user "{}"'.format(request.user))
+            logger.info('removing invalid user "%s"', request.user)
 
             auth.logout(request)
 
@@ -54,27 +57,84 @@ class DjangoSsoAppAuthenticationBaseMiddleware(MiddlewareMixin):
         return request.path.startswith(ADMIN_URL)
 
     @staticmethod
-    def _request_path_is_disabled_for_incomplete_users(request):
-        request_path = request.path
-        return (request_path not in PROFILE_INCOMPLETE_ENABLED_PATHS) and \
-                not (request_path.startswith('/static/')) and \
-                not (request_path.startswith('/media/')) and \
-                not (request_path.startswith('/logout/')) and \
-                not (request_path.startswith('/password/reset/')) and \
-                not (request_path.startswith('/confirm-email/')) and \
-                not (request_path.startswith('/__debug__/')) and \
-                not (request_path.startswith('/api/v1/'))  # keep api endpoints enabled
+    def _get_route_action(request):
+        context = get_request_context(request)
+
+        if context.route_action is None:
+            context.route_action = get_route_action(request.path)
+
+        return context.route_action
+
+    def _request_path_is_disabled_for_incomplete_users(self, request):
+        return self._get_route_action(request) == ROUTE_ENFORCE
+
+    def _request_path_is_disabled_for_users_to_subscribe(self, request):
+        return self._get_route_action(request) == ROUTE_ENFORCE
 
     @staticmethod
-    def _request_path_is_disabled_for_users_to_subscribe(request):
-        request_path = request.path
-        return (request_path not in USER_TO_SUBSCRIBE_ENABLED_PATHS) and \
-                not (request_path.startswith('/static/')) and \
-                not (request_path.startswith('/media/')) and \
-                not (request_path.startswith('/logout/')) and \
-                not (request_path.startswith('/password/reset/')) and \
-                not (request_path.startswith('/confirm-email/')) and \
-                not (request_path.startswith('/api/v1/'))  # keep api endpoints enabled
+    def _is_session_fast_path_enabled():
+        # revocation list is the only check of deleted devices and profile rev updates
+        if not app_settings.SESSION_FAST_PATH_ENABLED or not app_settings.TOKENS_REVOCATION_ENABLED:
+            return False
+
+        warn_if_shared_cache_is_process_local('SESSION_FAST_PATH_ENABLED')
+
+        return True
+
+    def _session_fast_path(self, request, requesting_user, request_jwt):
+        """
+        Returns True if session user has already been authenticated with request JWT
+        (same digest, not expired nor revoked).
+
+        Skips device, login eligibility and groups checks: requires tokens revocation and a cache shared
+        between processes
+        """
+        session = getattr(request, 'session', None)
+
+        if session is None or request_jwt is None or not self._is_session_fast_path_enabled():
+            return False
+
+        verified_jwt = session.get(SESSION_FAST_PATH_KEY, None)
+
+        if verified_jwt is None or verified_jwt['user_id'] != requesting_user.pk or \
+                verified_jwt['digest'] != get_token_digest(request_jwt):
+            return False
+
+        claims = verified_jwt['claims']
+
+        try:
+            check_expiration(claims)
+        except ExpiredSignatureError:
+            return False
+
+        if is_token_revoked(claims):
+            return False
+
+        if app_settings.APIGATEWAY_ENABLED and \
+                request.META.get(self.consumer_id_header, None) != claims['sso_id']:
+            return False
+
+        get_request_context(request).device_fingerprint = claims['fp']
+
+        return True
+
+    @classmethod
+    def _set_session_fast_path(cls, request, request_jwt, decoded_jwt):
+        session = getattr(request, 'session', None)
+
+        if session is None or not is_authenticated(request.user) or not cls._is_session_fast_path_enabled():
+            return
+
+        digest = get_token_digest(request_jwt)
+        verified_jwt = session.get(SESSION_FAST_PATH_KEY, None)
+
+        if verified_jwt is None or verified_jwt['digest'] != digest:
+            session[SESSION_FAST_PATH_KEY] = {
+                'digest': digest,
+                'user_id': request.user.pk,
+                'claims': dict((claim, decoded_jwt[claim]) for claim in SESSION_FAST_PATH_CLAIMS
+                               if claim in decoded_jwt)
+            }
 
     def process_request(self, request):
         raise NotImplementedError('process_request')
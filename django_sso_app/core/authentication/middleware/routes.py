@@ -0,0 +1,93 @@
+import re
+import logging
+
+from django.urls import reverse
+
+from ... import app_settings
+
+logger = logging.getLogger('django_sso_app')
+
+# skip SSO entirely
+ROUTE_SKIP = 'skip'
+# authenticate request JWT, never redirect to profile completion or service subscription
+ROUTE_AUTHENTICATE = 'authenticate'
+# authenticate and enforce profile completion and service subscription
+ROUTE_ENFORCE = 'enforce'
+
+ROUTE_ACTIONS = (ROUTE_SKIP, ROUTE_AUTHENTICATE, ROUTE_ENFORCE)
+
+_route_policy_table = None
+
+
+def get_default_route_policies():
+    return [
+        ('/static/', ROUTE_SKIP),
+        ('/media/', ROUTE_SKIP),
+        ('/__debug__/', ROUTE_SKIP),
+
+        ('^{}$'.format(re.escape(reverse('javascript-catalog'))), ROUTE_AUTHENTICATE),
+        ('^{}$'.format(re.escape(reverse('profile.complete'))), ROUTE_AUTHENTICATE),
+        ('/logout/', ROUTE_AUTHENTICATE),
+        ('/password/reset/', ROUTE_AUTHENTICATE),
+        ('/confirm-email/', ROUTE_AUTHENTICATE),
+        ('/api/v1/', ROUTE_AUTHENTICATE),  # keep api endpoints enabled
+    ]
+
+
+class RoutePolicyTable(object):
+    """
+    Request path to middleware action table, compiled once into a single regex.
+
+    Routes are path prefixes or (if starting with "^") regular expressions, first matching route wins;
+    DJANGO_SSO_APP_ROUTE_POLICIES entries ("path=action" strings or (path, action) tuples) precede defaults,
+    unmatched paths are enforced.
+    """
+
+    def __init__(self, policies, default_action=ROUTE_ENFORCE, source=None):
+        self.default_action = default_action
+        self.source = source
+        self.actions = []
+
+        patterns = []
+        for policy in policies:
+            if isinstance(policy, str):
+                route, action = policy.rsplit('=', 1)
+            else:
+                route, action = policy
+
+            if action not in ROUTE_ACTIONS:
+                raise ValueError('Wrong route "{}" action "{}"'.format(route, action))
+
+            if route.startswith('^'):
+                pattern = route[1:]
+            else:
+                pattern = re.escape(route)
+
+            patterns.append('(?P<route_{}>{})'.format(len(self.actions), pattern))
+            self.actions.append(action)
+
+        self.regex = re.compile('^(?:{})'.format('|'.join(patterns))) if len(patterns) else None
+
+    def get_action(self, path):
+        if self.regex is not None:
+            match = self.regex.match(path)
+
+            if match is not None:
+                return self.actions[int(match.lastgroup[6:])]
+
+        return self.default_action
+
+
+def get_route_policy_table():
+    global _route_policy_table
+
+    policies = app_settings.ROUTE_POLICIES
+
+    if _route_policy_table is None or _route_policy_table.source != policies:
+        _route_policy_table = RoutePolicyTable(list(policies) + get_default_route_policies(), source=policies)
+
+    return _route_policy_table
+
+
+def get_route_action(path):
+    return get_route_policy_table().get_action(path)
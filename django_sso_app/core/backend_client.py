@@ -0,0 +1,331 @@
+import os
+import ssl
+import time
+import random
+import asyncio
+import logging
+import threading
+import weakref
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:  # django < 3.0
+    sync_to_async = None
+
+from . import app_settings
+from .exceptions import BackendUnavailableException
+from .metrics import BACKEND_REQUESTS, get_gauge
+
+logger = logging.getLogger('django_sso_app')
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS')
+RETRY_STATUS_CODES = (502, 503, 504)
+
+BACKEND_CIRCUIT_OPEN = get_gauge('django_sso_app_backend_circuit_open', 'Remote backend circuit breaker open (1)')
+
+_client = None
+_client_lock = threading.Lock()
+
+
+class CircuitBreaker(object):
+    """
+    Thread safe, in-process circuit breaker.
+
+    Opens after DJANGO_SSO_APP_BACKEND_CIRCUIT_BREAKER_THRESHOLD consecutive failures, after
+    DJANGO_SSO_APP_BACKEND_CIRCUIT_BREAKER_RESET_TIMEOUT seconds lets one probe request through (half open),
+    closes on its success.
+    """
+
+    def __init__(self):
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def acquire(self):
+        """
+        Returns None if circuit is open, True if request is the half open probe (to be released), False otherwise
+        :return:
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return False
+
+            reset_timeout = app_settings.BACKEND_CIRCUIT_BREAKER_RESET_TIMEOUT
+
+            if self._probing or time.monotonic() - self._opened_at < reset_timeout:
+                return None
+
+            # half open
+            self._probing = True
+
+            return True
+
+    def release_probe(self):
+        """
+        Ends half open probe, next request probes again unless its outcome was recorded
+        :return:
+        """
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info('Remote backend circuit closed')
+                BACKEND_CIRCUIT_OPEN.set(0)
+
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+
+            threshold_reached = self._failures >= app_settings.BACKEND_CIRCUIT_BREAKER_THRESHOLD
+
+            if self._probing or (self._opened_at is None and threshold_reached):
+                if self._opened_at is None:
+                    logger.warning('Remote backend circuit opened after %s failures', self._failures)
+                    BACKEND_CIRCUIT_OPEN.set(1)
+
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+class BackendClient(object):
+    """
+    Remote django-sso-app backend HTTP client, one per process.
+
+    Keeps alive pooled connections, uses (connect, read) timeouts, retries idempotent requests (and requests
+    not yet sent) with jittered exponential backoff and stops calling the backend while its circuit is open.
+    Async requests (httpx 'async' extra) share the same policy and circuit, on one pooled client per event loop.
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.breaker = CircuitBreaker()
+        self.session = requests.Session()
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._async_clients_lock = threading.Lock()
+
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=app_settings.BACKEND_POOL_MAXSIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @staticmethod
+    def get_timeout():
+        return app_settings.BACKEND_CONNECT_TIMEOUT, app_settings.BACKEND_READ_TIMEOUT
+
+    @staticmethod
+    def get_backoff(attempt):
+        # full jitter
+        return random.uniform(0, app_settings.BACKEND_RETRY_BACKOFF * (2 ** attempt))
+
+    @staticmethod
+    def get_tls_verify():
+        if not app_settings.BACKEND_TLS_VERIFY:
+            return False
+
+        return app_settings.BACKEND_CA_BUNDLE or True
+
+    def _check_circuit(self, operation):
+        """
+        Raises BackendUnavailableException if circuit is open
+        :return: True if request is the half open probe
+        """
+        probe = self.breaker.acquire()
+
+        if probe is None:
+            BACKEND_REQUESTS.inc(operation, 'circuit_open')
+
+            raise BackendUnavailableException('Remote backend circuit is open')
+
+        return probe
+
+    def _should_retry_error(self, operation, method, url, e, attempt, not_sent, transient):
+        """
+        Records failed request, returns True if it must be retried
+        :param not_sent: request did not reach the backend (connect timeout)
+        :param transient: connection error or timeout
+        """
+        BACKEND_REQUESTS.inc(operation, 'error')
+        self.breaker.record_failure()
+
+        # requests not sent can always be retried
+        retry = not_sent or (method in IDEMPOTENT_METHODS and transient)
+
+        if not retry or attempt >= app_settings.BACKEND_MAX_RETRIES:
+            return False
+
+        logger.info('Remote backend %s "%s" failed (%s), retrying', method, url, e)
+
+        return True
+
+    def _should_retry_response(self, operation, method, url, status_code, attempt):
+        """
+        Records response, returns True if it must be retried
+        """
+        BACKEND_REQUESTS.inc(operation, str(status_code))
+
+        if status_code < 500:
+            self.breaker.record_success()
+
+            return False
+
+        self.breaker.record_failure()
+
+        if method not in IDEMPOTENT_METHODS or status_code not in RETRY_STATUS_CODES or \
+                attempt >= app_settings.BACKEND_MAX_RETRIES:
+            return False
+
+        logger.info('Remote backend %s "%s" returned %s, retrying', method, url, status_code)
+
+        return True
+
+    def request(self, operation, method, url, **kwargs):
+        """
+        Calls remote backend, raises BackendUnavailableException if circuit is open
+        :param operation: metrics label
+        :param method:
+        :param url:
+        :param kwargs: requests arguments
+        :return:
+        """
+        method = method.upper()
+        kwargs.setdefault('timeout', self.get_timeout())
+        kwargs.setdefault('verify', self.get_tls_verify())
+        attempt = 0
+
+        while True:
+            probe = self._check_circuit(operation)
+
+            try:
+                try:
+                    response = self.session.request(method, url, **kwargs)
+
+                except requests.RequestException as e:
+                    if not self._should_retry_error(operation, method, url, e, attempt,
+                                                    isinstance(e, requests.ConnectTimeout),
+                                                    isinstance(e, (requests.ConnectionError, requests.Timeout))):
+                        raise
+
+                else:
+                    if not self._should_retry_response(operation, method, url, response.status_code, attempt):
+                        return response
+
+            finally:
+                if probe:
+                    # unexpected errors must not leave the circuit open for good
+                    self.breaker.release_probe()
+
+            time.sleep(self.get_backoff(attempt))
+            attempt += 1
+
+    def get_async_client(self):
+        """
+        Returns running event loop pooled httpx client
+        :return:
+        """
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+
+        if client is None:
+            with self._async_clients_lock:
+                client = self._async_clients.get(loop)
+
+                if client is None:
+                    verify = self.get_tls_verify()
+                    if isinstance(verify, str):
+                        verify = ssl.create_default_context(cafile=verify)
+
+                    client = httpx.AsyncClient(
+                        timeout=httpx.Timeout(app_settings.BACKEND_READ_TIMEOUT,
+                                              connect=app_settings.BACKEND_CONNECT_TIMEOUT),
+                        limits=httpx.Limits(max_connections=app_settings.BACKEND_POOL_MAXSIZE),
+                        verify=verify)
+                    self._async_clients[loop] = client
+
+        return client
+
+    async def arequest(self, operation, method, url, **kwargs):
+        """
+        Calls remote backend without blocking the event loop (in a thread outside the sync one if httpx
+        is not installed), raises BackendUnavailableException if circuit is open
+        :param operation: metrics label
+        :param method:
+        :param url:
+        :param kwargs: httpx arguments (requests ones if httpx is not installed)
+        :return: httpx (requests) response
+        """
+        if httpx is None:
+            return await sync_to_async(self.request, thread_sensitive=False)(operation, method, url, **kwargs)
+
+        method = method.upper()
+        client = self.get_async_client()
+        attempt = 0
+
+        while True:
+            probe = self._check_circuit(operation)
+
+            try:
+                try:
+                    response = await client.request(method, url, **kwargs)
+
+                except httpx.HTTPError as e:
+                    if not self._should_retry_error(operation, method, url, e, attempt,
+                                                    isinstance(e, httpx.ConnectTimeout),
+                                                    isinstance(e, httpx.TransportError)):
+                        raise
+
+                else:
+                    if not self._should_retry_response(operation, method, url, response.status_code, attempt):
+                        return response
+
+            finally:
+                if probe:
+                    self.breaker.release_probe()
+
+            await asyncio.sleep(self.get_backoff(attempt))
+            attempt += 1
+
+    def get(self, operation, url, **kwargs):
+        return self.request(operation, 'GET', url, **kwargs)
+
+    def post(self, operation, url, **kwargs):
+        return self.request(operation, 'POST', url, **kwargs)
+
+    async def aget(self, operation, url, **kwargs):
+        return await self.arequest(operation, 'GET', url, **kwargs)
+
+
+def get_backend_client():
+    """
+    Returns process backend client (recreated after fork)
+    :return:
+    """
+    global _client
+
+    client = _client
+
+    if client is None or client.pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client.pid != os.getpid():
+                _client = BackendClient()
+
+            client = _client
+
+    return client
@@ -0,0 +1,125 @@
+import logging
+import threading
+import time
+
+from collections import OrderedDict
+
+from django.core.cache import caches
+
+from . import app_settings
+
+logger = logging.getLogger('django_sso_app')
+
+_MISSING = object()
+
+
+# cache backends not shared between processes
+PROCESS_LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+_warned_features = set()
+
+
+def get_shared_cache():
+    """
+    Returns the django cache shared between processes
+    :return:
+    """
+    return caches[app_settings.CACHE_ALIAS]
+
+
+def incr_shared_counter(key, seed=0):
+    """
+    Atomically increments shared cache counter, (re)creating it with seed value if missing or evicted
+    :param key:
+    :param seed:
+    :return: (incremented value, True if counter has been (re)created)
+    """
+    shared_cache = get_shared_cache()
+    created = shared_cache.add(key, seed, None)
+
+    try:
+        return shared_cache.incr(key), created
+
+    except ValueError:
+        # evicted between add and incr
+        created = shared_cache.add(key, seed, None)
+
+        return shared_cache.incr(key), created
+
+
+def is_shared_cache_process_local():
+    """
+    Returns True if DJANGO_SSO_APP_CACHE_ALIAS cache is not shared between processes (django default)
+    :return:
+    """
+    cache_class = type(get_shared_cache())
+
+    return '{}.{}'.format(cache_class.__module__, cache_class.__name__) in PROCESS_LOCAL_CACHE_BACKENDS
+
+
+def warn_if_shared_cache_is_process_local(feature):
+    """
+    Logs (once per feature) that feature invalidation will not reach other processes
+    :param feature: enabling setting name
+    :return:
+    """
+    if feature not in _warned_features and is_shared_cache_process_local():
+        _warned_features.add(feature)
+        logger.warning('DJANGO_SSO_APP_%s requires a cache shared between processes, "%s" cache is process local: '
+                       'invalidations will not reach other workers', feature, app_settings.CACHE_ALIAS)
+
+
+class LocalLRUCache(object):
+    """
+    Thread safe, in-process, least recently used cache with per entry timeout
+    """
+
+    def __init__(self, maxsize=1024, timeout=None):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires_at, value = self._data[key]
+            except KeyError:
+                return default
+
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+
+            return value
+
+    def set(self, key, value, timeout=_MISSING):
+        if timeout is _MISSING:
+            timeout = self.timeout
+        expires_at = None if timeout is None else time.monotonic() + timeout
+
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
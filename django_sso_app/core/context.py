@@ -0,0 +1,212 @@
+import weakref
+import logging
+
+from . import app_settings
+
+logger = logging.getLogger('django_sso_app')
+
+REQUEST_CONTEXT_ATTRIBUTE = '__dssoa__context'
+
+# legacy request keys (see utils.set_session_key) to context slots
+REQUEST_KEYS = {
+    '__dssoa__route_action': 'route_action',
+    '__dssoa__request_ip': 'request_ip',
+    '__dssoa__requesting_user': 'requesting_user',
+    '__dssoa__parsed_token': 'parsed_token',
+    '__dssoa__apigateway__consumer_custom_id': 'apigateway_consumer_custom_id',
+    '__dssoa__device': '_device',
+    '__dssoa__device__fingerprint': 'device_fingerprint',
+    '__dssoa__jwt_token': 'jwt_token',
+    '__dssoa__redirect': 'redirect',
+    '__dssoa__clear_response_jwt': 'clear_response_jwt',
+    '__dssoa__logged_in': 'logged_in',
+    '__dssoa__logged_out': 'logged_out',
+    '__dssoa__remote_user': 'remote_user',
+    '__dssoa__timer': 'timer',
+    '__dssoa__user_password_updated': 'user_password_updated',
+    '__dssoa__user_is_unsubscribed': 'user_is_unsubscribed',
+    '__dssoa__passepartout__redirect_url': 'passepartout_redirect_url',
+}
+
+_UNSET = object()
+
+
+class RequestContext(object):
+    """
+    Per request SSO state shared by middleware, views, adapter and signals.
+
+    Plain slots hold values set along the request, properties (decoded token, device, profile, groups,
+    staff flag and login eligibility) are computed at most once per request user.
+    """
+
+    __slots__ = ('_request', 'route_action', 'request_ip', 'requesting_user', '_parsed_token',
+                 'apigateway_consumer_custom_id', '_device', 'device_fingerprint', 'jwt_token', 'redirect',
+                 'clear_response_jwt', 'logged_in', 'logged_out', 'remote_user', 'timer',
+                 'user_password_updated', 'user_is_unsubscribed', 'passepartout_redirect_url',
+                 '_decoded_token', '_user_key', '_profile', '_groups', '_is_staff', '_eligibility')
+
+    def __init__(self, request):
+        self._request = weakref.ref(request)
+
+        for slot in self.__slots__[1:]:
+            setattr(self, slot, None)
+
+        self._decoded_token = _UNSET
+        self._reset_user_state(None)
+
+    @property
+    def request(self):
+        return self._request()
+
+    # token
+
+    @property
+    def parsed_token(self):
+        return self._parsed_token
+
+    @parsed_token.setter
+    def parsed_token(self, parsed_token):
+        if parsed_token is not self._parsed_token:
+            self._parsed_token = parsed_token
+            self._decoded_token = _UNSET
+
+    @property
+    def decoded_token(self):
+        """
+        Returns request parsed token (device, verified payload), None if request has no JWT
+        :return:
+        """
+        if self._decoded_token is _UNSET:
+            from .tokens.utils import get_request_parsed_token, jwt_decode
+
+            parsed_token = get_request_parsed_token(self.request)
+
+            if parsed_token is None:
+                self._decoded_token = None
+            else:
+                self.set_decoded_token(*jwt_decode(parsed_token, verify=True))
+
+        return self._decoded_token
+
+    def set_decoded_token(self, device, payload):
+        self._decoded_token = (device, payload)
+
+    # device
+
+    @property
+    def device(self):
+        """
+        Returns request device, getting or creating it by request fingerprint
+        :return:
+        """
+        if self._device is None:
+            from .apps.devices.utils import _get_or_create_request_device
+
+            self.device = _get_or_create_request_device(self.request)
+
+        return self._device
+
+    @device.setter
+    def device(self, device):
+        self._device = device
+        self.device_fingerprint = device.fingerprint if device is not None else None
+
+    # user
+
+    def _reset_user_state(self, user_key):
+        self._user_key = user_key
+        self._profile = _UNSET
+        self._groups = _UNSET
+        self._is_staff = _UNSET
+        self._eligibility = _UNSET
+
+    @staticmethod
+    def _get_user_key(user):
+        from .tokens.models import TokenUser
+
+        if isinstance(user, TokenUser):
+            # claims backed, not loading user
+            return 'sso_id', user.sso_id
+
+        return getattr(user, 'pk', None)
+
+    def _get_user(self):
+        user = getattr(self.request, 'user', None)
+        user_key = self._get_user_key(user)
+
+        if user_key != self._user_key:
+            # request user changed (login, logout)
+            self._reset_user_state(user_key)
+
+        return user
+
+    @property
+    def profile(self):
+        user = self._get_user()
+
+        if self._profile is _UNSET:
+            from .permissions import is_authenticated
+
+            self._profile = getattr(user, 'sso_app_profile', None) if is_authenticated(user) else None
+
+        return self._profile
+
+    @property
+    def groups(self):
+        """
+        Returns request user profile group names
+        :return:
+        """
+        user = self._get_user()
+
+        if self._groups is _UNSET:
+            from .permissions import get_user_identity
+
+            identity = get_user_identity(user)
+            self._groups = frozenset() if identity is None else identity['groups']
+
+        return self._groups
+
+    @property
+    def is_staff(self):
+        user = self._get_user()
+
+        if self._is_staff is _UNSET:
+            from .permissions import is_django_staff
+
+            self._is_staff = bool(user is not None and is_django_staff(user)) or \
+                not self.groups.isdisjoint(app_settings.STAFF_USER_GROUPS)
+
+        return self._is_staff
+
+    @property
+    def eligibility(self):
+        """
+        Returns request user profile login eligibility snapshot, None if no profile
+        :return:
+        """
+        profile = self.profile
+
+        if self._eligibility is _UNSET:
+            from .utils import get_login_eligibility
+
+            self._eligibility = None if profile is None else get_login_eligibility(profile)
+
+        return self._eligibility
+
+
+def get_request_context(request):
+    """
+    Returns request SSO context, creating it if missing
+    :param request: django or rest framework request
+    :return:
+    """
+    # rest framework Request wraps django HttpRequest
+    request = getattr(request, '_request', request)
+    context = getattr(request, REQUEST_CONTEXT_ATTRIBUTE, None)
+
+    if context is None:
+        context = RequestContext(request)
+        setattr(request, REQUEST_CONTEXT_ATTRIBUTE, context)
+
+    return context
@@ -11,7 +11,9 @@ class DjangoStaffUsersCanNotLoginException(BaseException):
 
 
 class AuthenticationFailed(BaseException):
-    pass
+    def __init__(self, msg=None, code=None):
+        super(AuthenticationFailed, self).__init__(msg)
+        self.code = code
 
 
 class InvalidToken(BaseException):
@@ -48,3 +50,7 @@ class UndefinedRequestUserException(BaseException):
 
 class AnonymousUserException(BaseException):
     pass
+
+
+class BackendUnavailableException(BaseException):
+    pass
@@ -0,0 +1,81 @@
+import json
+import random
+import logging
+
+from . import app_settings
+
+logger = logging.getLogger('django_sso_app')
+
+# high frequency request events
+EVENT_REQUEST_STARTED = 'request_started'
+EVENT_REQUEST_FINISHED = 'request_finished'
+EVENT_REQUEST_STATE = 'request_state'
+EVENT_REQUEST_JWT = 'request_jwt'
+
+_RECORD_ATTRIBUTES = frozenset(logging.LogRecord('', logging.NOTSET, '', 0, '', (), None).__dict__.keys()) | \
+    frozenset(('message', 'asctime'))
+
+
+def is_event_sampled(event):
+    """
+    Returns True if event must be logged, according to DJANGO_SSO_APP_LOG_SAMPLE_RATES
+    :param event:
+    :return:
+    """
+    sample_rate = float(app_settings.LOG_SAMPLE_RATES.get(event, 1.))
+
+    return sample_rate >= 1. or random.random() < sample_rate
+
+
+def log_event(level, event, message, **fields):
+    """
+    Logs structured event, message is formatted (%-style, by fields name) only if the record is emitted
+    :param level:
+    :param event:
+    :param message:
+    :param fields:
+    :return:
+    """
+    if logger.isEnabledFor(level) and is_event_sampled(event):
+        logger.log(level, message, fields, extra={'event': event, 'event_fields': fields})
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record, structured event fields and extra record attributes are kept as keys.
+
+    LOGGING = {
+        'formatters': {
+            'json': {
+                '()': 'django_sso_app.core.logs.JsonFormatter'
+            }
+        },
+        ...
+    }
+    """
+
+    def format(self, record):
+        data = {
+            'timestamp': self.formatTime(record, self.datefmt),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+
+        event = getattr(record, 'event', None)
+
+        if event is not None:
+            data['event'] = event
+            data.update(record.event_fields)
+
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and key not in ('event', 'event_fields') and key not in data:
+                data[key] = value
+
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+
+        if record.stack_info:
+            data['stack_info'] = self.formatStack(record.stack_info)
+
+        return json.dumps(data, default=str)
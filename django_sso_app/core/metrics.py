@@ -0,0 +1,347 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+
+from . import app_settings
+
+logger = logging.getLogger('django_sso_app')
+
+# seconds
+DEFAULT_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10.)
+MULTIPROCESS_FILE_PREFIX = 'django_sso_app_'
+
+_metrics = {}
+_metrics_lock = threading.Lock()
+_flushed_at = None
+
+
+class Metric(object):
+    """
+    Thread safe, in-process metric with one series per label values tuple
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def collect(self):
+        """
+        Returns {labelvalues: value}
+        :return:
+        """
+        with self._lock:
+            return dict((labelvalues, self._copy(value)) for labelvalues, value in self._series.items())
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+    @staticmethod
+    def merge(value, other):
+        raise NotImplementedError('merge')
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *labelvalues, amount=1):
+        """
+        Increments series, labelvalues ordered as labelnames
+        :param labelvalues:
+        :param amount:
+        :return:
+        """
+        with self._lock:
+            self._series[labelvalues] = self._series.get(labelvalues, 0) + amount
+
+    @staticmethod
+    def merge(value, other):
+        return value + other
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, *labelvalues):
+        with self._lock:
+            # (value, updated at), multiprocess aggregation keeps latest value
+            self._series[labelvalues] = (value, time.time())
+
+    @staticmethod
+    def merge(value, other):
+        return value if value[1] >= other[1] else other
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labelvalues):
+        """
+        Records value, labelvalues ordered as labelnames
+        :param value:
+        :param labelvalues:
+        :return:
+        """
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            series = self._series.get(labelvalues, None)
+
+            if series is None:
+                # [bucket counts (+Inf last), sum, count]
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0., 0]
+
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @staticmethod
+    def _copy(value):
+        return [list(value[0]), value[1], value[2]]
+
+    @staticmethod
+    def merge(value, other):
+        return [[a + b for a, b in zip(value[0], other[0])], value[1] + other[1], value[2] + other[2]]
+
+    @staticmethod
+    def get_cumulative_counts(value):
+        counts = list(value[0])
+
+        for i in range(1, len(counts)):
+            counts[i] += counts[i - 1]
+
+        return counts
+
+
+def _get_metric(metric_class, name, *args, **kwargs):
+    metric = _metrics.get(name, None)
+
+    if metric is None:
+        with _metrics_lock:
+            metric = _metrics.get(name, None)
+
+            if metric is None:
+                metric = _metrics[name] = metric_class(name, *args, **kwargs)
+
+    return metric
+
+
+def get_counter(name, documentation='', labelnames=()):
+    """
+    Returns process counter named name, creating it if missing
+    :param name:
+    :param documentation:
+    :param labelnames:
+    :return:
+    """
+    return _get_metric(Counter, name, documentation, labelnames)
+
+
+def get_gauge(name, documentation='', labelnames=()):
+    return _get_metric(Gauge, name, documentation, labelnames)
+
+
+def get_histogram(name, documentation='', labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _get_metric(Histogram, name, documentation, labelnames, buckets)
+
+
+def get_metrics():
+    return list(_metrics.values())
+
+
+# multiprocess
+
+def _get_multiprocess_path():
+    return os.path.join(app_settings.METRICS_MULTIPROCESS_DIR,
+                        '{}{}.json'.format(MULTIPROCESS_FILE_PREFIX, os.getpid()))
+
+
+def flush_metrics(force=True):
+    """
+    Dumps process metrics to DJANGO_SSO_APP_METRICS_MULTIPROCESS_DIR (if set), at most every
+    DJANGO_SSO_APP_METRICS_FLUSH_INTERVAL seconds if not forced
+    :param force:
+    :return:
+    """
+    global _flushed_at
+
+    if app_settings.METRICS_MULTIPROCESS_DIR is None:
+        return False
+
+    now = time.monotonic()
+
+    if not force and _flushed_at is not None and now - _flushed_at < app_settings.METRICS_FLUSH_INTERVAL:
+        return False
+
+    _flushed_at = now
+
+    snapshot = dict((metric.name, {
+        'type': metric.type,
+        'documentation': metric.documentation,
+        'labelnames': metric.labelnames,
+        'buckets': getattr(metric, 'buckets', None),
+        'series': [[labelvalues, value] for labelvalues, value in metric.collect().items()]
+    }) for metric in get_metrics())
+
+    path = _get_multiprocess_path()
+    tmp_path = '{}.tmp'.format(path)
+
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f)
+
+        # atomic
+        os.replace(tmp_path, path)
+
+    except OSError:
+        logger.exception('Can not flush metrics to "{}"'.format(path))
+
+        return False
+
+    return True
+
+
+def _load_multiprocess_snapshots():
+    directory = app_settings.METRICS_MULTIPROCESS_DIR
+
+    for file_name in os.listdir(directory):
+        if file_name.startswith(MULTIPROCESS_FILE_PREFIX) and file_name.endswith('.json'):
+            try:
+                with open(os.path.join(directory, file_name)) as f:
+                    yield json.load(f)
+
+            except (OSError, ValueError):
+                logger.warning('Can not load metrics file "{}"'.format(file_name))
+
+
+def collect_metrics():
+    """
+    Returns [(metric, {labelvalues: value})], aggregated between processes if
+    DJANGO_SSO_APP_METRICS_MULTIPROCESS_DIR is set
+    :return:
+    """
+    if app_settings.METRICS_MULTIPROCESS_DIR is None:
+        return [(metric, metric.collect()) for metric in get_metrics()]
+
+    flush_metrics()
+
+    metric_classes = dict((metric_class.type, metric_class) for metric_class in (Counter, Gauge, Histogram))
+    metrics = {}
+
+    for snapshot in _load_multiprocess_snapshots():
+        for name, data in snapshot.items():
+            if name not in metrics:
+                metric_class = metric_classes[data['type']]
+                if metric_class is Histogram:
+                    metric = Histogram(name, data['documentation'], data['labelnames'], data['buckets'])
+                else:
+                    metric = metric_class(name, data['documentation'], data['labelnames'])
+
+                metrics[name] = (metric, {})
+
+            metric, series = metrics[name]
+
+            for labelvalues, value in data['series']:
+                labelvalues = tuple(labelvalues)
+
+                if labelvalues in series:
+                    series[labelvalues] = metric.merge(series[labelvalues], value)
+                else:
+                    series[labelvalues] = value
+
+    return [metrics[name] for name in sorted(metrics.keys())]
+
+
+# text exposition
+
+def _escape_label_value(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    labels = list(zip(labelnames, labelvalues)) + list(extra)
+
+    if not len(labels):
+        return ''
+
+    return '{' + ','.join('{}="{}"'.format(name, _escape_label_value(value)) for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value))
+
+
+def generate_text():
+    """
+    Returns metrics in prometheus text exposition format (0.0.4)
+    :return:
+    """
+    lines = []
+
+    for metric, series in collect_metrics():
+        documentation = metric.documentation.replace('\\', r'\\').replace('\n', r'\n')
+
+        lines.append('# HELP {} {}'.format(metric.name, documentation))
+        lines.append('# TYPE {} {}'.format(metric.name, metric.type))
+
+        for labelvalues, value in sorted(series.items()):
+            if metric.type == 'histogram':
+                counts = Histogram.get_cumulative_counts(value)
+
+                for bound, count in zip(list(metric.buckets) + [float('inf')], counts):
+                    lines.append('{}_bucket{} {}'.format(metric.name,
+                                                         _format_labels(metric.labelnames, labelvalues,
+                                                                        (('le', _format_value(bound)), )),
+                                                         _format_value(count)))
+
+                labels = _format_labels(metric.labelnames, labelvalues)
+                lines.append('{}_sum{} {}'.format(metric.name, labels, _format_value(value[1])))
+                lines.append('{}_count{} {}'.format(metric.name, labels, _format_value(value[2])))
+
+            else:
+                if metric.type == 'gauge':
+                    value = value[0]
+
+                lines.append('{}{} {}'.format(metric.name, _format_labels(metric.labelnames, labelvalues),
+                                              _format_value(value)))
+
+    return '\n'.join(lines) + '\n'
+
+
+# sso metrics
+
+LOGINS = get_counter('django_sso_app_logins_total', 'User logins')
+LOGOUTS = get_counter('django_sso_app_logouts_total', 'User logouts')
+DEVICES = get_counter('django_sso_app_devices_total', 'Device creations and deletions', ('action', ))
+JWT_VERIFICATION_FAILURES = get_counter('django_sso_app_jwt_verification_failures_total',
+                                        'Request JWT verification failures', ('exception', ))
+REMOTE_REPLICATIONS = get_counter('django_sso_app_remote_replications_total',
+                                  'Users replicated from remote backend', ('action', ))
+BACKEND_REQUESTS = get_counter('django_sso_app_backend_requests_total',
+                               'Remote backend requests', ('operation', 'status'))
+APIGATEWAY_REQUESTS = get_counter('django_sso_app_apigateway_requests_total',
+                                  'Api gateway (kong) admin requests', ('method', 'status'))
+APIGATEWAY_REQUEST_DURATION = get_histogram('django_sso_app_apigateway_request_duration_seconds',
+                                            'Api gateway (kong) admin request duration', ('method', ))
+EVENTS_POLL_LAG = get_gauge('django_sso_app_events_poll_lag_seconds',
+                            'Seconds between last processed event and poll time', ('event_type', ))
+CACHE_REQUESTS = get_counter('django_sso_app_cache_requests_total', 'SSO cache lookups', ('cache', 'result'))
@@ -4,6 +4,9 @@ from django.core.exceptions import ObjectDoesNotExist
 from rest_framework import permissions
 
 from . import app_settings
+from .cache import get_shared_cache
+from .context import get_request_context
+from .metrics import CACHE_REQUESTS
 
 
 def is_authenticated(user):
@@ -14,18 +17,108 @@ def is_django_staff(user):
     return user and (user.is_staff or user.is_superuser)
 
 
+def _get_identity_cache_key(sso_id):
+    return 'dssoa:identity:{}'.format(sso_id)
+
+
+def invalidate_user_identity(sso_id):
+    get_shared_cache().delete(_get_identity_cache_key(sso_id))
+
+
+def invalidate_users_identities(sso_ids):
+    get_shared_cache().delete_many([_get_identity_cache_key(sso_id) for sso_id in sso_ids])
+
+
+def get_user_identity(user):
+    """
+    Returns user profile identity snapshot (sso_id, sso_rev, group names), None if user has no profile.
+
+    Stateless token users are answered from token claims, loaded profiles from the shared cache
+    (valid while profile sso_rev matches), otherwise profile and group names are loaded in one query
+    :param user:
+    :return:
+    """
+    if not is_authenticated(user):
+        return None
+
+    token_groups = getattr(user, 'token_groups', None)
+
+    if token_groups is not None:
+        # stateless token user, identity from verified claims
+        return {
+            'sso_id': user.sso_id,
+            'sso_rev': user.sso_rev,
+            'groups': token_groups
+        }
+
+    profile_descriptor = getattr(type(user), 'sso_app_profile', None)
+
+    if profile_descriptor is not None and profile_descriptor.related.is_cached(user):
+        profile = profile_descriptor.related.get_cached_value(user)
+
+        if profile is None:
+            return None
+
+        sso_id, sso_rev = profile.sso_id, profile.sso_rev
+        cached = isinstance(sso_rev, int)  # not an F() expression
+
+        if cached:
+            identity = get_shared_cache().get(_get_identity_cache_key(sso_id))
+
+            if identity is not None and identity['sso_rev'] == sso_rev:
+                CACHE_REQUESTS.inc('identity', 'hit')
+
+                return identity
+
+            CACHE_REQUESTS.inc('identity', 'miss')
+
+        groups = frozenset(profile.groups.values_list('name', flat=True))
+
+    else:
+        from .apps.profiles.models import Profile
+
+        rows = list(Profile.objects.filter(user_id=user.pk).values_list('sso_id', 'sso_rev', 'groups__name'))
+
+        if not len(rows):
+            return None
+
+        sso_id, sso_rev = rows[0][0], rows[0][1]
+        cached = True
+        groups = frozenset(group_name for _sso_id, _sso_rev, group_name in rows if group_name is not None)
+
+    identity = {
+        'sso_id': sso_id,
+        'sso_rev': sso_rev,
+        'groups': groups
+    }
+
+    if cached:
+        get_shared_cache().set(_get_identity_cache_key(sso_id), identity, app_settings.IDENTITY_CACHE_TIMEOUT)
+
+    return identity
+
+
 def is_staff(user):
     if user is not None:
         if is_django_staff(user):
             return True
 
-        profile = getattr(user, 'sso_app_profile', None)
-        if profile is not None:
-            return profile.groups.filter(name__in=app_settings.STAFF_USER_GROUPS).count() > 0
+        identity = get_user_identity(user)
+        if identity is not None:
+            return not identity['groups'].isdisjoint(app_settings.STAFF_USER_GROUPS)
 
     return False
 
 
+def is_request_user_staff(request):
+    """
+    Returns True if request user is staff, evaluated once per request
+    :param request:
+    :return:
+    """
+    return get_request_context(request).is_staff
+
+
 def try_authenticate(username, email, password):
     credentials = username or email or None
     user = None
@@ -57,7 +150,7 @@ class StaffPermission(permissions.IsAuthenticated):
     message = 'You must be a staff member.'
 
     def has_permission(self, request, view):
-        if is_staff(request.user):
+        if is_request_user_staff(request):
             return True
         return False
 
@@ -76,7 +169,7 @@ class OwnerOrStaffPermission(permissions.IsAuthenticated):
 
     def has_object_permission(self, request, view, obj):
         user = request.user
-        if user and (is_staff(user) or (user == getattr(obj, 'user', None))):
+        if user and (is_request_user_staff(request) or (user == getattr(obj, 'user', None))):
             return True
         return False
 
@@ -85,7 +178,7 @@ class PublicObjectOrOwnerOrStaffPermission(permissions.IsAuthenticated):
 
     def has_object_permission(self, request, view, obj):
         user = request.user
-        user_is_staff = is_staff(user)
+        user_is_staff = is_request_user_staff(request)
 
         if user_is_staff:
             return True
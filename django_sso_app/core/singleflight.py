@@ -0,0 +1,110 @@
+import time
+import uuid
+import logging
+import threading
+
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from . import app_settings
+from .cache import get_shared_cache
+from .metrics import get_counter
+
+logger = logging.getLogger('django_sso_app')
+
+COALESCED_CALLS = get_counter('django_sso_app_coalesced_calls_total',
+                              'Calls waiting for a concurrent call with the same key', ('scope', ))
+
+LOCK_POLL_INTERVAL = .05
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def _get_lock_key(key):
+    return 'dssoa:lock:{}'.format(key)
+
+
+def _wait_lock_release(lock_key):
+    cache = get_shared_cache()
+    deadline = time.monotonic() + app_settings.SINGLE_FLIGHT_WAIT_TIMEOUT
+
+    while cache.get(lock_key) is not None:
+        if time.monotonic() >= deadline:
+            logger.warning('Timeout waiting for "%s" lock release', lock_key)
+            break
+
+        time.sleep(LOCK_POLL_INTERVAL)
+
+
+def _run_locked(key, fn, on_wait):
+    cache = get_shared_cache()
+    lock_key = _get_lock_key(key)
+    token = uuid.uuid4().hex
+
+    # atomic, one process holds the lock
+    if cache.add(lock_key, token, app_settings.SINGLE_FLIGHT_LOCK_TIMEOUT):
+        try:
+            return fn()
+
+        finally:
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
+
+    logger.info('"%s" running in another process, waiting', key)
+    COALESCED_CALLS.inc('cache')
+
+    _wait_lock_release(lock_key)
+
+    result = on_wait()
+
+    return fn() if result is None else result
+
+
+def single_flight(key, fn, on_wait):
+    """
+    Runs fn once per key between threads (in-process future) and processes (short lived shared cache lock).
+
+    Concurrent callers wait for the running call, then return on_wait() (e.g. reloading its outcome from db),
+    calling fn themselves if on_wait() returns None
+    :param key:
+    :param fn: called without arguments
+    :param on_wait: called without arguments, after concurrent call completion
+    :return:
+    """
+    with _flights_lock:
+        future = _flights.get(key, None)
+        is_leader = future is None
+
+        if is_leader:
+            future = _flights[key] = Future()
+
+    if not is_leader:
+        logger.info('"%s" running in another thread, waiting', key)
+        COALESCED_CALLS.inc('process')
+
+        try:
+            # re-raises leader exception
+            future.result(timeout=app_settings.SINGLE_FLIGHT_WAIT_TIMEOUT)
+
+        except FutureTimeoutError:
+            logger.warning('Timeout waiting for "%s"', key)
+
+        result = on_wait()
+
+        return fn() if result is None else result
+
+    try:
+        result = _run_locked(key, fn, on_wait)
+
+    except Exception as e:
+        future.set_exception(e)
+        raise
+
+    else:
+        future.set_result(None)
+
+        return result
+
+    finally:
+        with _flights_lock:
+            _flights.pop(key, None)
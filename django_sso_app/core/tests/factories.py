@@ -292,21 +292,21 @@ class UserTestCase(TestCase):
             app_settings.JWT_COOKIE_NAME: self._get_jwt(device, secret)
         })
 
-    def _get_jwt_payload(self, sso_id=None, sso_rev=None, fingerprint=None):
-        return {
+    def _get_jwt_payload(self, sso_id=None, sso_rev=None, fingerprint=None, **claims):
+        return dict({
             'id': random.randint(1, 1000),
             'fp': fingerprint or self._get_random_string(),
             'fingerprint': self._get_random_string(),
             'sso_id': sso_id or self._get_random_uuid(),
             'sso_rev': sso_rev or random.randint(0, 100)
-        }
+        }, **claims)
 
-    def _get_valid_jwt(self, sso_id=None, sso_rev=None, fingerprint=None, secret=None):
+    def _get_valid_jwt(self, sso_id=None, sso_rev=None, fingerprint=None, secret=None, **claims):
         from django_sso_app import app_settings
 
         secret = secret or app_settings.TOKENS_JWT_SECRET
 
-        valid_new_profile_jwt_payload = self._get_jwt_payload(sso_id, sso_rev, fingerprint)
+        valid_new_profile_jwt_payload = self._get_jwt_payload(sso_id, sso_rev, fingerprint, **claims)
 
         return jwt.encode(
             valid_new_profile_jwt_payload,
@@ -314,11 +314,11 @@ class UserTestCase(TestCase):
             app_settings.JWT_ALGORITHM
         )
 
-    def _get_valid_jwt_cookie(self, sso_id=None, sso_rev=None, fingerprint=None, secret=None):
+    def _get_valid_jwt_cookie(self, sso_id=None, sso_rev=None, fingerprint=None, secret=None, **claims):
         from django_sso_app import app_settings
 
         return SimpleCookie({
-            app_settings.JWT_COOKIE_NAME: self._get_valid_jwt(sso_id, sso_rev, fingerprint, secret=secret)
+            app_settings.JWT_COOKIE_NAME: self._get_valid_jwt(sso_id, sso_rev, fingerprint, secret=secret, **claims)
         })
 
     def _get_new_api_token(self, user):
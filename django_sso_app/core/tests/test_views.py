@@ -1,4 +1,9 @@
+import json
+import time
 import logging
+import threading
+
+from unittest import mock
 
 from allauth.account.models import (
     EmailAddress,
@@ -6,12 +11,25 @@ from allauth.account.models import (
 from django.contrib.auth import get_user_model
 from django.core import mail
 from django.urls import reverse
+from django.test import RequestFactory
 from django.test.utils import override_settings
 
 from rest_framework import status
 
 from allauth.account.adapter import get_adapter
 
+from ..authentication.middleware.base import SESSION_FAST_PATH_KEY
+from ..authentication.middleware.routes import get_route_action, ROUTE_SKIP, ROUTE_AUTHENTICATE, ROUTE_ENFORCE
+from ..context import get_request_context
+from ..logs import log_event, JsonFormatter, EVENT_REQUEST_STARTED
+from ..cache import get_shared_cache
+from ..singleflight import single_flight
+from ..permissions import is_staff
+from ..tokens.authentication import JWTAuthentication
+from ..tokens.utils import jwt_decode
+from ..utils import set_session_key, get_session_key
+from ..timing import get_stage_histogram, STAGE_JWT_DECODE, STAGE_AUTHENTICATE
+from .. import app_settings
 from .factories import UserTestCase
 
 User = get_user_model()
@@ -290,3 +308,230 @@ class TestSignup(UserTestCase):
 
         self.assertIsNotNone(new_user.sso_app_profile.groups.filter(name='incomplete').first(),
                              'incomplete user did not enter "incomplete" group on login')
+
+
+class TestRoutePolicies(UserTestCase):
+
+    def test_route_policy_table_maps_paths_to_actions(self):
+        self.assertEqual(get_route_action('/static/css/project.css'), ROUTE_SKIP)
+        self.assertEqual(get_route_action('/api/v1/auth/users/'), ROUTE_AUTHENTICATE)
+        self.assertEqual(get_route_action(reverse('profile.complete')), ROUTE_AUTHENTICATE)
+        self.assertEqual(get_route_action(reverse('profile')), ROUTE_ENFORCE)
+
+        with self.settings(DJANGO_SSO_APP_ROUTE_POLICIES=['/healthz=skip', '^/profile/$=authenticate']):
+            self.assertEqual(get_route_action('/healthz'), ROUTE_SKIP)
+            self.assertEqual(get_route_action(reverse('profile')), ROUTE_AUTHENTICATE)
+            self.assertEqual(get_route_action(reverse('profile.update')), ROUTE_ENFORCE)
+
+    def test_skipped_routes_bypass_sso(self):
+        client = self._get_client()
+        client.cookies = self._get_valid_jwt_cookie(secret='invalid_secret')
+
+        response = client.get('/static/missing.css')
+
+        self.assertNotIn(app_settings.JWT_COOKIE_NAME, response.cookies, 'skipped route invalidated jwt')
+
+        response = client.get(reverse('profile'))
+
+        self.assertEqual(response.cookies[app_settings.JWT_COOKIE_NAME].value, '')
+
+
+@override_settings(DJANGO_SSO_APP_SESSION_FAST_PATH_ENABLED=True)
+class TestSessionFastPath(UserTestCase):
+
+    def test_session_user_skips_jwt_processing_until_revocation(self):
+        new_pass = self._get_random_pass()
+        new_user = self._get_new_user(password=new_pass)
+
+        client = self._get_client()
+        client.post(
+            reverse('account_login'),
+            data=self._get_login_object(new_user.email, new_pass)
+        )
+
+        profile_url = reverse('django_sso_app_profile:rest-detail', args=(new_user.sso_app_profile.sso_id,))
+        process_request_path = 'django_sso_app.core.authentication.middleware.' \
+                               'DjangoSsoAppAuthenticationMiddleware.backend_process_request'
+
+        response = client.get(profile_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(SESSION_FAST_PATH_KEY, client.session)
+
+        with mock.patch(process_request_path) as backend_process_request:
+            response = client.get(profile_url)
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertFalse(backend_process_request.called)
+
+        new_user.sso_app_profile.devices.all().delete()
+
+        response = client.get(profile_url)
+        self.assertNotEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_session_fast_path_requires_tokens_revocation(self):
+        new_pass = self._get_random_pass()
+        new_user = self._get_new_user(password=new_pass)
+
+        with self.settings(DJANGO_SSO_APP_TOKENS_REVOCATION_ENABLED=False):
+            client = self._get_client()
+            client.post(
+                reverse('account_login'),
+                data=self._get_login_object(new_user.email, new_pass)
+            )
+
+            response = client.get(reverse('django_sso_app_profile:rest-detail',
+                                          args=(new_user.sso_app_profile.sso_id,)))
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn(SESSION_FAST_PATH_KEY, client.session)
+
+
+class TestServerTiming(UserTestCase):
+
+    def test_server_timing_header_reports_auth_stages(self):
+        new_user = self._get_new_user()
+        device = self._get_user_device(new_user)
+        profile_url = reverse('django_sso_app_profile:rest-detail', args=(new_user.sso_app_profile.sso_id,))
+
+        client = self._get_client()
+        client.cookies = self._get_jwt_cookie(device)
+
+        response = client.get(profile_url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('Server-Timing', response)
+
+        decoded_count = get_stage_histogram().collect()[(STAGE_JWT_DECODE, )][2]
+
+        with self.settings(DJANGO_SSO_APP_SERVER_TIMING_ENABLED=True):
+            client = self._get_client()
+            client.cookies = self._get_jwt_cookie(device)
+
+            response = client.get(profile_url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('{};dur='.format(STAGE_JWT_DECODE), response['Server-Timing'])
+        self.assertIn('{};dur='.format(STAGE_AUTHENTICATE), response['Server-Timing'])
+        self.assertEqual(get_stage_histogram().collect()[(STAGE_JWT_DECODE, )][2], decoded_count + 1)
+
+
+class TestRequestContext(UserTestCase):
+
+    def test_request_token_is_decoded_once(self):
+        new_user = self._get_new_user()
+        device = self._get_user_device(new_user)
+        raw_token = self._get_jwt(device, None)
+
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION='Bearer {}'.format(raw_token))
+        authentication = JWTAuthentication()
+
+        with mock.patch('django_sso_app.core.tokens.utils.jwt_decode', wraps=jwt_decode) as decode:
+            first_token = authentication.get_validated_token(raw_token.encode('utf-8'), request)
+            second_token = authentication.get_validated_token(raw_token.encode('utf-8'), request)
+
+            self.assertEqual(decode.call_count, 1)
+
+        self.assertEqual(first_token, second_token)
+        self.assertEqual(get_request_context(request).decoded_token[1]['fp'], device.fingerprint)
+
+    def test_legacy_request_keys_are_context_slots(self):
+        request = RequestFactory().get('/')
+
+        set_session_key(request, '__dssoa__device__fingerprint', 'fingerprint')
+
+        self.assertEqual(get_request_context(request).device_fingerprint, 'fingerprint')
+        self.assertEqual(get_session_key(request, '__dssoa__device__fingerprint'), 'fingerprint')
+        self.assertTrue(get_session_key(request, '__dssoa__logged_in', True))
+        self.assertFalse(hasattr(get_request_context(request), '__dict__'))
+
+    def test_request_user_identity_is_loaded_once(self):
+        new_user = self._get_new_user()
+        new_user.sso_app_profile.add_to_group(app_settings.STAFF_USER_GROUPS[0])
+
+        request = RequestFactory().get('/')
+        request.user = User.objects.get(pk=new_user.pk)
+        context = get_request_context(request)
+
+        # profile and group names in one query
+        with self.assertNumQueries(1):
+            self.assertTrue(context.is_staff)
+            self.assertTrue(context.is_staff)
+            self.assertIn(app_settings.STAFF_USER_GROUPS[0], context.groups)
+
+        # loaded profile identity is cached by sso_rev
+        user = User.objects.select_related('sso_app_profile').get(pk=new_user.pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(is_staff(user))
+
+    def test_user_identity_is_invalidated_on_group_changes(self):
+        new_user = self._get_new_user()
+        profile = new_user.sso_app_profile
+        sso_rev = profile.sso_rev
+
+        self.assertFalse(is_staff(User.objects.select_related('sso_app_profile').get(pk=new_user.pk)))
+
+        # default groups updates do not update rev
+        setattr(profile.user, '__dssoa__updating_default_groups', True)
+        profile.add_to_group(app_settings.STAFF_USER_GROUPS[0])
+
+        user = User.objects.select_related('sso_app_profile').get(pk=new_user.pk)
+
+        self.assertEqual(user.sso_app_profile.sso_rev, sso_rev)
+        self.assertTrue(is_staff(user))
+
+
+class TestStructuredLogging(UserTestCase):
+
+    def test_request_events_are_sampled_and_formatted_as_json(self):
+        with self.assertLogs('django_sso_app', level='INFO') as logs:
+            with self.settings(DJANGO_SSO_APP_LOG_SAMPLE_RATES={EVENT_REQUEST_STARTED: 0}):
+                log_event(logging.INFO, EVENT_REQUEST_STARTED, '--> path "%(path)s"', path='/sampled/')
+
+            log_event(logging.INFO, EVENT_REQUEST_STARTED, '--> path "%(path)s"', path='/logged/')
+
+        self.assertEqual(len(logs.records), 1)
+
+        data = json.loads(JsonFormatter().format(logs.records[0]))
+
+        self.assertEqual(data['event'], EVENT_REQUEST_STARTED)
+        self.assertEqual(data['path'], '/logged/')
+        self.assertEqual(data['message'], '--> path "/logged/"')
+        self.assertEqual(data['level'], 'INFO')
+
+
+class TestSingleFlight(UserTestCase):
+
+    def test_concurrent_calls_are_coalesced_in_process(self):
+        key = self._get_random_string()
+        calls = []
+        results = []
+
+        def fn():
+            calls.append(1)
+            time.sleep(.2)
+            return 'leader'
+
+        def run():
+            results.append(single_flight(key, fn, lambda: 'follower'))
+
+        threads = [threading.Thread(target=run) for _i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(results), ['follower'] * 4 + ['leader'])
+
+    def test_calls_wait_for_other_processes_lock(self):
+        key = self._get_random_string()
+        lock_key = 'dssoa:lock:{}'.format(key)
+
+        # lock held by another process
+        get_shared_cache().set(lock_key, 'other', 10)
+        threading.Timer(.2, get_shared_cache().delete, (lock_key, )).start()
+
+        result = single_flight(key, lambda: self.fail('called while locked'), lambda: 'other process result')
+
+        self.assertEqual(result, 'other process result')
+        self.assertIsNone(get_shared_cache().get(lock_key))
@@ -0,0 +1,111 @@
+import time
+import logging
+
+from contextlib import contextmanager
+
+from . import app_settings
+from .metrics import get_histogram
+from .context import get_request_context
+
+logger = logging.getLogger('django_sso_app')
+
+STAGE_HISTOGRAM_NAME = 'django_sso_app_stage_duration_seconds'
+
+# auth pipeline stages
+STAGE_JWT_PARSE = 'jwt_parse'
+STAGE_JWT_DECODE = 'jwt_decode'  # signature verification, device lookup and revocation check
+STAGE_SESSION_FAST_PATH = 'session_fast_path'
+STAGE_AUTHENTICATE = 'authenticate'
+STAGE_REPLICATION = 'replication'
+STAGE_ELIGIBILITY = 'eligibility'
+STAGE_GROUPS = 'groups'
+STAGE_DEVICE = 'device'
+
+
+def get_stage_histogram():
+    return get_histogram(STAGE_HISTOGRAM_NAME, 'SSO auth pipeline stage duration', labelnames=('stage',))
+
+
+class RequestTimer(object):
+    """
+    Request scoped stage timer.
+
+    Stage durations are summed per request (for the Server-Timing header) and observed
+    into the process stage histogram.
+    """
+
+    __slots__ = ('stages', )
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, stage, duration):
+        self.stages[stage] = self.stages.get(stage, 0.) + duration
+
+        get_stage_histogram().observe(duration, stage)
+
+    @contextmanager
+    def stage(self, stage):
+        started_at = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started_at)
+
+    def get_server_timing(self):
+        """
+        Returns Server-Timing header value (durations in milliseconds)
+        :return:
+        """
+        return ', '.join('{};dur={:.3f}'.format(stage, duration * 1000) for stage, duration in self.stages.items())
+
+
+def get_request_timer(request):
+    """
+    Returns request timer, None if timing is disabled or no request
+    :param request:
+    :return:
+    """
+    if request is None or not app_settings.TIMING_ENABLED:
+        return None
+
+    context = get_request_context(request)
+
+    if context.timer is None:
+        context.timer = RequestTimer()
+
+    return context.timer
+
+
+@contextmanager
+def timed(request, stage):
+    """
+    Records the duration of the enclosed block as request stage
+    :param request:
+    :param stage:
+    :return:
+    """
+    timer = get_request_timer(request)
+
+    if timer is None:
+        yield
+
+    else:
+        with timer.stage(stage):
+            yield
+
+
+def set_server_timing_header(request, response):
+    timer = get_request_context(request).timer
+
+    if app_settings.SERVER_TIMING_ENABLED and timer is not None and len(timer.stages):
+        server_timing = timer.get_server_timing()
+        previous_server_timing = response.get('Server-Timing', None)
+
+        if previous_server_timing:
+            server_timing = '{}, {}'.format(previous_server_timing, server_timing)
+
+        response['Server-Timing'] = server_timing
+
+    return response
@@ -6,8 +6,10 @@ from django.contrib.auth import get_user_model
 from rest_framework import authentication
 
 from .. import app_settings
+from ..context import get_request_context
 from ..exceptions import AuthenticationFailed, InvalidToken
-from .utils import get_request_jwt_header, jwt_decode
+from .models import TokenUser
+from .utils import get_request_jwt_header, get_request_parsed_token, jwt_decode
 
 User = get_user_model()
 
@@ -32,7 +34,7 @@ class JWTAuthentication(authentication.BaseAuthentication):
         if raw_token is None:
             return None
 
-        validated_token = self.get_validated_token(raw_token)
+        validated_token = self.get_validated_token(raw_token, request)
 
         return self.get_user(validated_token), None
 
@@ -70,15 +72,21 @@ class JWTAuthentication(authentication.BaseAuthentication):
 
         return parts[1]
 
-    def get_validated_token(self, raw_token):
+    def get_validated_token(self, raw_token, request=None):
         """
         Validates an encoded JSON web token and returns a validated token
         wrapper object.
+        Reuses the request parsed token (if any) so the token is parsed and verified once per request.
         """
         messages = []
 
         try:
-            _device, decoded_jwt = jwt_decode(raw_token, verify=True)
+            if request is not None:
+                get_request_parsed_token(request, raw_token)
+                # decoded once per request
+                _device, decoded_jwt = get_request_context(request).decoded_token
+            else:
+                _device, decoded_jwt = jwt_decode(raw_token, verify=True)
 
             return decoded_jwt
 
@@ -94,14 +102,24 @@ class JWTAuthentication(authentication.BaseAuthentication):
     def get_user(self, validated_token):
         """
         Attempts to find and return a user using the given validated token.
+        Returns a lazy TokenUser if TOKENS_STATELESS_USER is enabled.
         """
         try:
             sso_id = validated_token[app_settings.USER_ID_CLAIM]
         except KeyError:
             raise InvalidToken(_('Token contained no recognizable user identification'))
 
+        if app_settings.TOKENS_STATELESS_USER:
+            user = TokenUser(validated_token)
+
+            if not user.is_active:
+                raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+
+            return user
+
         try:
-            user = User.objects.get(**{app_settings.USER_ID_FIELD: sso_id})
+            user = User.objects.select_related('sso_app_profile') \
+                               .get(**{app_settings.DJANGO_SSO_APP_USER_ID_FIELD: sso_id})
         except User.DoesNotExist:
             raise AuthenticationFailed(_('User not found'), code='user_not_found')
 
@@ -0,0 +1,186 @@
+import time
+import hashlib
+import logging
+
+from django.utils.encoding import force_bytes
+from django.utils.module_loading import import_string
+
+from .. import app_settings
+from ..cache import LocalLRUCache, get_shared_cache, incr_shared_counter, warn_if_shared_cache_is_process_local
+from ..metrics import CACHE_REQUESTS
+
+logger = logging.getLogger('django_sso_app')
+
+CACHE_KEY_PREFIX = 'dssoa:tokens'
+
+_tokens_cache = None
+_tokens_cache_class_path = None
+
+
+def get_token_digest(raw_token):
+    """
+    Returns raw token cache digest (bound to actual shape)
+    :param raw_token:
+    :return:
+    """
+    return hashlib.sha256(force_bytes(app_settings.SHAPE) + b':' + force_bytes(raw_token)).hexdigest()
+
+
+class DecodedTokenCache(object):
+    """
+    Verified JWT cache.
+
+    Stores (device_id, fingerprint, payload) entries keyed by raw token digest in a local LRU
+    backed by the shared django cache. Each entry records its device and profile versions, kept as
+    shared cache counters incremented on device deletion and on profile rev update, and is discarded
+    when they no longer match.
+    Requires a cache shared between processes (DJANGO_SSO_APP_CACHE_ALIAS), invalidations are
+    process local otherwise.
+    """
+
+    def __init__(self):
+        self.local = LocalLRUCache(maxsize=app_settings.TOKENS_CACHE_LOCAL_MAXSIZE,
+                                   timeout=app_settings.TOKENS_CACHE_LOCAL_TIMEOUT)
+
+    @staticmethod
+    def _get_entry_key(digest):
+        return '{}:{}'.format(CACHE_KEY_PREFIX, digest)
+
+    @staticmethod
+    def _get_device_version_key(device_id):
+        return '{}:device:{}:version'.format(CACHE_KEY_PREFIX, device_id)
+
+    @staticmethod
+    def _get_profile_version_key(sso_id):
+        return '{}:profile:{}:version'.format(CACHE_KEY_PREFIX, sso_id)
+
+    def _get_version_keys(self, device_id, payload):
+        sso_id = payload.get(app_settings.USER_ID_CLAIM, None)
+
+        return (None if device_id is None else self._get_device_version_key(device_id),
+                None if sso_id is None else self._get_profile_version_key(sso_id))
+
+    @staticmethod
+    def _get_versions(shared_cache, version_keys):
+        versions = shared_cache.get_many([key for key in version_keys if key is not None])
+
+        return tuple(versions.get(key, None) for key in version_keys)
+
+    @staticmethod
+    def _increment_version(version_key):
+        # seeded with current time, an evicted counter never comes back to a previous value
+        return incr_shared_counter(version_key, int(time.time() * 1000))[0]
+
+    def get(self, raw_token):
+        digest = get_token_digest(raw_token)
+        entry = self.local.get(digest)
+        shared_cache = get_shared_cache()
+
+        if entry is None:
+            entry = shared_cache.get(self._get_entry_key(digest))
+
+            if entry is None:
+                CACHE_REQUESTS.inc('tokens', 'miss')
+
+                return None
+
+            self.local.set(digest, entry)
+            CACHE_REQUESTS.inc('tokens', 'shared_hit')
+
+        else:
+            CACHE_REQUESTS.inc('tokens', 'local_hit')
+
+        device_id, fingerprint, payload, versions = entry
+
+        if self._get_versions(shared_cache, self._get_version_keys(device_id, payload)) != versions:
+            logger.debug('cached jwt invalidated')
+            self.local.delete(digest)
+            CACHE_REQUESTS.inc('tokens', 'invalidated')
+
+            return None
+
+        return device_id, fingerprint, payload
+
+    def get_versions(self, device_id, claims):
+        """
+        Returns token device and profile versions, to be read before the token is verified
+        :param device_id:
+        :param claims: (unverified) token claims
+        :return:
+        """
+        return self._get_versions(get_shared_cache(), self._get_version_keys(device_id, claims))
+
+    def set(self, raw_token, device_id, fingerprint, payload, versions):
+        """
+        Caches verified token, skipped if device or profile changed since versions were read
+        :param raw_token:
+        :param device_id:
+        :param fingerprint:
+        :param payload:
+        :param versions: get_versions() result read before verification
+        :return:
+        """
+        digest = get_token_digest(raw_token)
+        shared_cache = get_shared_cache()
+
+        if self._get_versions(shared_cache, self._get_version_keys(device_id, payload)) != versions:
+            logger.debug('jwt verified against outdated state, not cached')
+
+            return
+
+        entry = (device_id, fingerprint, payload, versions)
+
+        self.local.set(digest, entry)
+        shared_cache.set(self._get_entry_key(digest), entry, app_settings.TOKENS_CACHE_TIMEOUT)
+
+    def invalidate_device(self, device_id):
+        logger.debug('invalidating device "%s" cached tokens', device_id)
+
+        return self._increment_version(self._get_device_version_key(device_id))
+
+    def invalidate_profile(self, sso_id):
+        logger.debug('invalidating profile "%s" cached tokens', sso_id)
+
+        return self._increment_version(self._get_profile_version_key(sso_id))
+
+    def clear(self):
+        self.local.clear()
+
+
+def get_tokens_cache():
+    """
+    Returns configured decoded tokens cache instance, None if disabled
+    :return:
+    """
+    global _tokens_cache, _tokens_cache_class_path
+
+    if not app_settings.TOKENS_CACHE_ENABLED:
+        return None
+
+    warn_if_shared_cache_is_process_local('TOKENS_CACHE_ENABLED')
+
+    tokens_cache_class_path = app_settings.TOKENS_CACHE_CLASS
+
+    if _tokens_cache is None or _tokens_cache_class_path != tokens_cache_class_path:
+        _tokens_cache = import_string(tokens_cache_class_path)()
+        _tokens_cache_class_path = tokens_cache_class_path
+
+    return _tokens_cache
+
+
+def invalidate_device_tokens(device_id):
+    tokens_cache = get_tokens_cache()
+
+    if tokens_cache is not None:
+        return tokens_cache.invalidate_device(device_id)
+
+    return 0
+
+
+def invalidate_profile_tokens(sso_id):
+    tokens_cache = get_tokens_cache()
+
+    if tokens_cache is not None:
+        return tokens_cache.invalidate_profile(sso_id)
+
+    return 0
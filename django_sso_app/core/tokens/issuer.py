@@ -0,0 +1,96 @@
+import json
+import logging
+
+from django.db.models import QuerySet
+
+from jwt.utils import base64url_encode
+
+from .. import app_settings
+from ..cache import LocalLRUCache
+from .keys import get_jwt_signing_key, get_jwt_key_id, get_hmac_key_ring
+from .parsed import ALGORITHMS
+
+logger = logging.getLogger('django_sso_app')
+
+_token_issuer = None
+
+
+class TokenIssuer(object):
+    """
+    JWT issuer.
+
+    Caches prepared signing keys by secret and encoded headers by (algorithm, kid), so issuing a token
+    costs payload serialization and signing only.
+    """
+
+    def __init__(self):
+        self.keys = LocalLRUCache(maxsize=app_settings.TOKENS_ISSUER_KEYS_MAXSIZE, timeout=None)
+        self.headers = {}
+
+    def get_signing_key(self, secret):
+        """
+        Returns (prepared key, kid) for secret (instance private key if asymmetric)
+        :param secret:
+        :return:
+        """
+        if app_settings.JWT_ASYMMETRIC:
+            return get_jwt_signing_key().private_key, get_jwt_key_id()
+
+        algorithm = app_settings.JWT_ALGORITHM
+        signing_key = self.keys.get((algorithm, secret))
+
+        if signing_key is None:
+            signing_key = ALGORITHMS[algorithm].prepare_key(secret)
+            self.keys.set((algorithm, secret), signing_key)
+
+        return signing_key, get_hmac_key_ring().get_kid(secret)
+
+    def get_header_segment(self, algorithm, kid):
+        header_segment = self.headers.get((algorithm, kid), None)
+
+        if header_segment is None:
+            header = {'typ': 'JWT', 'alg': algorithm}
+            if kid is not None:
+                header['kid'] = kid
+
+            header_segment = base64url_encode(json.dumps(header, separators=(',', ':')).encode('utf-8'))
+            self.headers[(algorithm, kid)] = header_segment
+
+        return header_segment
+
+    def issue_token(self, payload, secret):
+        algorithm = app_settings.JWT_ALGORITHM
+        key, kid = self.get_signing_key(secret)
+
+        signing_input = b'.'.join([
+            self.get_header_segment(algorithm, kid),
+            base64url_encode(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+        ])
+        signature = ALGORITHMS[algorithm].sign(signing_input, key)
+
+        return b'.'.join([signing_input, base64url_encode(signature)]).decode('utf-8')
+
+    def issue_tokens(self, devices):
+        """
+        Issues tokens for devices, returns (device, token) list
+        :param devices: devices iterable or queryset
+        :return:
+        """
+        if isinstance(devices, QuerySet):
+            devices = devices.select_related('profile__user').prefetch_related('profile__groups')
+
+        return [(device, self.issue_token(device.get_jwt_payload(), device.apigw_jwt_secret))
+                for device in devices]
+
+
+def get_token_issuer():
+    global _token_issuer
+
+    if _token_issuer is None:
+        _token_issuer = TokenIssuer()
+
+    return _token_issuer
+
+
+def issue_tokens(devices):
+    return get_token_issuer().issue_tokens(devices)
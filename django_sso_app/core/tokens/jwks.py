@@ -0,0 +1,126 @@
+import json
+import time
+import logging
+import threading
+
+import jwt
+
+from ..backend_client import get_backend_client
+from ..cache import get_shared_cache
+from .. import app_settings
+from .parsed import ALGORITHMS
+
+logger = logging.getLogger('django_sso_app')
+
+CACHE_KEY = 'dssoa:tokens:jwks'
+# minimum seconds between two fetches triggered by unknown kids
+MIN_REFRESH_INTERVAL = 30
+
+_jwks_client = None
+
+
+class JWKSClient(object):
+    """
+    Backend JSON Web Key Set client.
+
+    Holds public keys, parsed once, by kid; the raw key set is shared between processes through django cache.
+    Keys are refreshed on TTL expiry and on unknown kid (rate limited).
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.keys = {}
+        self.expires_at = 0
+        self.last_fetch_at = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def parse_jwks(jwks):
+        keys = {}
+
+        for jwk in jwks.get('keys', []):
+            algorithm = jwk.get('alg', app_settings.JWT_ALGORITHM)
+
+            try:
+                keys[jwk.get('kid', None)] = ALGORITHMS[algorithm].from_jwk(json.dumps(jwk))
+            except Exception:
+                logger.exception('Can not parse jwk "%s"', jwk.get('kid', None))
+
+        return keys
+
+    @staticmethod
+    def get_tls_verify():
+        # signing keys trust root, always verified
+        return app_settings.TOKENS_JWKS_CA_BUNDLE or app_settings.BACKEND_CA_BUNDLE or True
+
+    def fetch_jwks(self):
+        logger.info('fetching jwks from "%s"', self.url)
+
+        response = get_backend_client().get('fetch_jwks', self.url, verify=self.get_tls_verify())
+        response.raise_for_status()
+
+        return response.json()
+
+    def refresh(self, force=False):
+        """
+        Loads key set from shared cache or (if forced or missing) from backend
+        :param force:
+        :return:
+        """
+        with self.lock:
+            jwks = None if force else get_shared_cache().get(CACHE_KEY)
+
+            if jwks is None:
+                if force and self.last_fetch_at is not None and \
+                        time.monotonic() - self.last_fetch_at < MIN_REFRESH_INTERVAL:
+                    return self.keys
+
+                self.last_fetch_at = time.monotonic()
+
+                jwks = self.fetch_jwks()
+                get_shared_cache().set(CACHE_KEY, jwks, app_settings.TOKENS_JWKS_CACHE_TIMEOUT)
+
+            self.keys = self.parse_jwks(jwks)
+            self.expires_at = time.monotonic() + app_settings.TOKENS_JWKS_CACHE_TIMEOUT
+
+            return self.keys
+
+    def get_signing_key(self, kid=None):
+        """
+        Returns parsed public key by kid (key set single key if kid is None)
+        :param kid:
+        :return:
+        """
+        keys = self.keys
+
+        if time.monotonic() > self.expires_at:
+            keys = self.refresh()
+
+        if kid is None and len(keys) == 1:
+            return next(iter(keys.values()))
+
+        key = keys.get(kid, None)
+
+        if key is None:
+            logger.info('unknown kid "%s", refreshing jwks', kid)
+            key = self.refresh(force=True).get(kid, None)
+
+            if key is None:
+                raise jwt.InvalidSignatureError('Unable to find signing key "{}"'.format(kid))
+
+        return key
+
+
+def get_jwks_client():
+    global _jwks_client
+
+    url = app_settings.TOKENS_JWKS_URL
+
+    if _jwks_client is None or _jwks_client.url != url:
+        _jwks_client = JWKSClient(url)
+
+    return _jwks_client
+
+
+def get_jwks_signing_key(kid=None):
+    return get_jwks_client().get_signing_key(kid)
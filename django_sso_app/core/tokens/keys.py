@@ -0,0 +1,187 @@
+import json
+import time
+import hashlib
+import logging
+import threading
+
+from .. import app_settings
+from .parsed import ALGORITHMS
+
+logger = logging.getLogger('django_sso_app')
+
+_signing_keys = {}
+_signing_keys_lock = threading.Lock()
+
+_hmac_key_ring = None
+
+
+class AsymmetricSigningKey(object):
+    """
+    Asymmetric signing key, parsed once from PEM.
+    """
+
+    def __init__(self, algorithm, pem):
+        algorithm_object = ALGORITHMS[algorithm]
+
+        self.algorithm = algorithm
+        # env vars usually carry escaped new lines
+        self.private_key = algorithm_object.prepare_key(pem.replace('\\n', '\n'))
+        self.public_key = self.private_key.public_key()
+
+        public_jwk = algorithm_object.to_jwk(self.public_key)
+        if isinstance(public_jwk, str):
+            public_jwk = json.loads(public_jwk)
+
+        self.public_jwk = public_jwk
+        self.thumbprint = hashlib.sha256(json.dumps(public_jwk, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+    def get_jwk(self, kid):
+        jwk = dict(self.public_jwk)
+        jwk.update({
+            'kid': kid,
+            'alg': self.algorithm,
+            'use': 'sig'
+        })
+
+        return jwk
+
+
+def get_jwt_signing_key():
+    """
+    Returns configured asymmetric signing key
+    :return:
+    """
+    pem = app_settings.TOKENS_JWT_PRIVATE_KEY
+
+    if pem is None:
+        raise KeyError('DJANGO_SSO_APP_TOKENS_JWT_PRIVATE_KEY not set')
+
+    algorithm = app_settings.JWT_ALGORITHM
+    signing_key = _signing_keys.get((algorithm, pem), None)
+
+    if signing_key is None:
+        with _signing_keys_lock:
+            signing_key = AsymmetricSigningKey(algorithm, pem)
+            _signing_keys[(algorithm, pem)] = signing_key
+
+    return signing_key
+
+
+def get_jwt_private_key():
+    return get_jwt_signing_key().private_key
+
+
+def get_jwt_public_key():
+    return get_jwt_signing_key().public_key
+
+
+def get_jwt_key_id():
+    """
+    Returns signing key id, defaults to public key thumbprint
+    :return:
+    """
+    return app_settings.TOKENS_JWT_KEY_ID or get_jwt_signing_key().thumbprint
+
+
+def get_jwks():
+    """
+    Returns published JSON Web Key Set
+    :return:
+    """
+    keys = []
+
+    if app_settings.JWT_ASYMMETRIC and app_settings.TOKENS_JWT_PRIVATE_KEY is not None:
+        keys.append(get_jwt_signing_key().get_jwk(get_jwt_key_id()))
+
+    return {
+        'keys': keys
+    }
+
+
+class HmacKeyRing(object):
+    """
+    Symmetric JWT keys by kid, prepared once.
+
+    Keys are either dicts ({"kid": .., "secret": .., "expires_at": unix timestamp}) or "kid:expires_at:secret"
+    strings (env friendly, empty expires_at never expires); a key without kid verifies tokens without "kid" header.
+    """
+
+    def __init__(self, keys, active_kid=None, default_secret=None, algorithm='HS256'):
+        self.source = (keys, active_kid, default_secret, algorithm)
+        self.algorithm = algorithm
+        self.keys = {}
+        self.kids = {}
+        secrets = {}
+
+        if not len(keys):
+            keys = [{'kid': None, 'secret': default_secret}]
+
+        # asymmetric algorithms keep secrets for devices only, no symmetric key is verified
+        algorithm_object = ALGORITHMS[algorithm] if algorithm.startswith('HS') else None
+
+        for key in keys:
+            if isinstance(key, str):
+                kid, expires_at, secret = key.split(':', 2)
+                key = {'kid': kid or None, 'secret': secret, 'expires_at': expires_at or None}
+
+            kid = key.get('kid', None)
+            secret = key['secret']
+            expires_at = key.get('expires_at', None)
+
+            self.keys[kid] = (algorithm_object.prepare_key(secret) if algorithm_object is not None else None,
+                              float(expires_at) if expires_at is not None else None)
+            self.kids[secret] = kid
+            secrets[kid] = secret
+
+        first_key = keys[0]
+        if isinstance(first_key, str):
+            self.active_kid = active_kid or first_key.split(':', 1)[0] or None
+        else:
+            self.active_kid = active_kid or first_key.get('kid', None)
+
+        if self.active_kid not in secrets:
+            raise KeyError('Active jwt key "{}" not found'.format(self.active_kid))
+
+        self.active_secret = secrets[self.active_kid]
+
+    def get_key(self, kid):
+        """
+        Returns prepared key by kid, None if unknown or expired
+        :param kid:
+        :return:
+        """
+        key = self.keys.get(kid, None)
+
+        if key is None or key[0] is None:
+            return None
+
+        prepared_key, expires_at = key
+
+        if expires_at is not None and time.time() > expires_at:
+            logger.info('jwt key "%s" expired', kid)
+            return None
+
+        return prepared_key
+
+    def get_kid(self, secret):
+        return self.kids.get(secret, None)
+
+
+def get_hmac_key_ring():
+    """
+    Returns symmetric key ring, rebuilt on settings change
+    :return:
+    """
+    global _hmac_key_ring
+
+    source = (app_settings.TOKENS_JWT_KEYS, app_settings.TOKENS_JWT_ACTIVE_KEY_ID, app_settings.TOKENS_JWT_SECRET,
+              app_settings.JWT_ALGORITHM)
+
+    if _hmac_key_ring is None or _hmac_key_ring.source != source:
+        _hmac_key_ring = HmacKeyRing(*source)
+
+    return _hmac_key_ring
+
+
+def get_active_jwt_secret():
+    return get_hmac_key_ring().active_secret
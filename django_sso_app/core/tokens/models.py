@@ -0,0 +1,86 @@
+import logging
+
+from django.contrib.auth import get_user_model
+from django.utils.functional import cached_property
+
+from .. import app_settings
+
+logger = logging.getLogger('django_sso_app')
+
+
+class TokenUser(object):
+    """
+    Stateless user built from verified JWT claims.
+
+    Claims backed attributes (sso_id, sso_rev, is_active and groups, as of token issue) are served without
+    queries, any other attribute loads User and Profile with a single query. JWT bearers are never django staff
+    (staff users get no JWT on login).
+    """
+
+    is_authenticated = True
+    is_anonymous = False
+    is_staff = False
+    is_superuser = False
+
+    def __init__(self, token):
+        self.token = token
+
+    def __str__(self):
+        return 'TokenUser {}'.format(self.sso_id)
+
+    def __repr__(self):
+        return '<TokenUser: {}>'.format(self.sso_id)
+
+    def __eq__(self, other):
+        if isinstance(other, TokenUser):
+            return self.sso_id == other.sso_id
+
+        return self.user == other
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.sso_id)
+
+    @cached_property
+    def sso_id(self):
+        return self.token[app_settings.USER_ID_CLAIM]
+
+    @cached_property
+    def sso_rev(self):
+        return self.token.get('sso_rev', 0)
+
+    @cached_property
+    def token_groups(self):
+        groups = self.token.get('groups', None)
+
+        return frozenset(groups) if groups is not None else None
+
+    @property
+    def is_active(self):
+        is_active = self.token.get('is_active', None)
+
+        if is_active is None:
+            # token issued without identity claims
+            return self.user.is_active
+
+        return is_active
+
+    @property
+    def is_loaded(self):
+        return 'user' in self.__dict__
+
+    @cached_property
+    def user(self):
+        logger.debug('loading token user "%s"', self.sso_id)
+
+        return get_user_model().objects.select_related('sso_app_profile') \
+                                       .get(**{app_settings.DJANGO_SSO_APP_USER_ID_FIELD: self.sso_id})
+
+    def __getattr__(self, name):
+        # called only for attributes not found on TokenUser
+        if name.startswith('__') or name in ('token', 'user'):
+            raise AttributeError(name)
+
+        return getattr(self.user, name)
@@ -0,0 +1,135 @@
+import json
+import time
+import logging
+import binascii
+
+import jwt
+
+from jwt.algorithms import get_default_algorithms
+from jwt.utils import base64url_decode
+
+from django.utils.encoding import force_bytes
+
+from .. import app_settings
+
+logger = logging.getLogger('django_sso_app')
+
+ALGORITHMS = get_default_algorithms()
+
+
+def check_expiration(claims):
+    """
+    Raises ExpiredSignatureError if claims "exp" is past (tokens without "exp" never expire)
+    :param claims:
+    :return:
+    """
+    exp = claims.get('exp', None)
+
+    if exp is None:
+        return
+
+    try:
+        exp = int(exp)
+    except (TypeError, ValueError):
+        raise jwt.DecodeError('Expiration Time claim (exp) must be an integer.')
+
+    if exp <= time.time() - app_settings.TOKENS_JWT_LEEWAY:
+        raise jwt.ExpiredSignatureError('Signature has expired')
+
+
+class ParsedToken(object):
+    """
+    JWT parsed once (base64 and JSON decoding) and verified at most once.
+
+    Carries raw bytes, header, unverified claims, verified claims and the resolved Device (backend shapes).
+    """
+
+    def __init__(self, raw_token):
+        self.raw = force_bytes(raw_token)
+
+        try:
+            self.signing_input, crypto_segment = self.raw.rsplit(b'.', 1)
+            header_segment, claims_segment = self.signing_input.split(b'.', 1)
+
+            self.header = json.loads(base64url_decode(header_segment))
+            self.unverified_claims = json.loads(base64url_decode(claims_segment))
+            self.signature = base64url_decode(crypto_segment)
+
+        except (ValueError, TypeError, binascii.Error) as e:
+            raise jwt.DecodeError('Invalid token: {}'.format(e))
+
+        if not isinstance(self.header, dict) or not isinstance(self.unverified_claims, dict):
+            raise jwt.DecodeError('Invalid token header or payload')
+
+        self.verified_claims = None
+        self.device = None
+
+    def __str__(self):
+        return self.raw_token
+
+    @property
+    def raw_token(self):
+        return self.raw.decode('utf-8')
+
+    @property
+    def algorithm(self):
+        return self.header.get('alg', None)
+
+    @property
+    def kid(self):
+        return self.header.get('kid', None)
+
+    @property
+    def device_id(self):
+        return self.unverified_claims.get('id', None)
+
+    @property
+    def fingerprint(self):
+        return self.unverified_claims.get('fp', None)
+
+    @property
+    def is_verified(self):
+        return self.verified_claims is not None
+
+    def verify(self, key, issuer=None, algorithms=None, prepared=False, verify_exp=True):
+        """
+        Verifies token signature and issuer, returns verified claims
+        :param key: secret string or prepared key object
+        :param issuer:
+        :param algorithms:
+        :param prepared: key already prepared for token algorithm
+        :param verify_exp:
+        :return:
+        """
+        if self.verified_claims is not None:
+            if verify_exp:
+                check_expiration(self.verified_claims)
+
+            return self.verified_claims
+
+        algorithms = algorithms or [app_settings.JWT_ALGORITHM]
+        algorithm = self.algorithm
+
+        if algorithm not in algorithms:
+            raise jwt.InvalidAlgorithmError('The specified alg value is not allowed')
+
+        try:
+            algorithm_object = ALGORITHMS[algorithm]
+        except KeyError:
+            raise jwt.InvalidAlgorithmError('Algorithm not supported')
+
+        if not prepared and isinstance(key, (str, bytes)):
+            key = algorithm_object.prepare_key(key)
+
+        if not algorithm_object.verify(self.signing_input, key, self.signature):
+            raise jwt.InvalidSignatureError('Signature verification failed')
+
+        if issuer is not None and self.unverified_claims.get('iss', None) != issuer:
+            raise jwt.InvalidIssuerError('Invalid issuer')
+
+        if verify_exp:
+            check_expiration(self.unverified_claims)
+
+        self.verified_claims = self.unverified_claims
+
+        return self.verified_claims
@@ -0,0 +1,187 @@
+import time
+import logging
+import threading
+
+from .. import app_settings
+from ..cache import get_shared_cache, incr_shared_counter, warn_if_shared_cache_is_process_local
+
+logger = logging.getLogger('django_sso_app')
+
+CACHE_KEY_PREFIX = 'dssoa:tokens:revoked'
+VERSION_CACHE_KEY = '{}:version'.format(CACHE_KEY_PREFIX)
+# version counter first value, newer entries only exist
+VERSION_SEED_CACHE_KEY = '{}:version:seed'.format(CACHE_KEY_PREFIX)
+# shared cache entries fetched per request when syncing
+SYNC_CHUNK_SIZE = 1000
+
+_revocation_list = None
+
+
+class RevocationList(object):
+    """
+    Versioned revocation list.
+
+    Revocations (deleted devices and profile rev updates) are appended to a log in the shared cache,
+    each entry keyed by an atomically incremented version. Processes hold a local copy, checked in O(1),
+    and fetch newer entries only when the shared version changes (checked at most every
+    DJANGO_SSO_APP_TOKENS_REVOCATION_SYNC_INTERVAL seconds).
+    Requires a cache shared between processes (DJANGO_SSO_APP_CACHE_ALIAS), revocations only reach the
+    recording process otherwise. An evicted version counter is re-seeded with current time, above any
+    previous version.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.synced_at = None
+        self.devices = {}
+        self.profiles = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _get_entry_key(version):
+        return '{}:{}'.format(CACHE_KEY_PREFIX, version)
+
+    def _apply(self, entry):
+        kind, key, value, revoked_at = entry
+
+        if kind == 'device':
+            self.devices[key] = revoked_at
+        elif kind == 'profile':
+            min_rev, _revoked_at = self.profiles.get(key, (0, None))
+            self.profiles[key] = (max(min_rev, value), revoked_at)
+
+    def _prune(self):
+        oldest = time.time() - app_settings.TOKENS_REVOCATION_TIMEOUT
+
+        self.devices = dict((key, revoked_at) for key, revoked_at in self.devices.items()
+                            if revoked_at > oldest)
+        self.profiles = dict((key, value) for key, value in self.profiles.items()
+                             if value[1] > oldest)
+
+    def _append(self, entry):
+        shared_cache = get_shared_cache()
+        seed = int(time.time() * 1000)
+
+        version, created = incr_shared_counter(VERSION_CACHE_KEY, seed)
+
+        if created:
+            shared_cache.set(VERSION_SEED_CACHE_KEY, seed, None)
+
+        shared_cache.set(self._get_entry_key(version), entry, app_settings.TOKENS_REVOCATION_TIMEOUT)
+
+        with self.lock:
+            self._apply(entry)
+
+        return version
+
+    def sync(self, force=False):
+        """
+        Fetches revocations newer than local version
+        :param force: skip sync interval
+        :return:
+        """
+        now = time.monotonic()
+
+        if not force and self.synced_at is not None and \
+                now - self.synced_at < app_settings.TOKENS_REVOCATION_SYNC_INTERVAL:
+            return self.version
+
+        shared_cache = get_shared_cache()
+        versions = shared_cache.get_many([VERSION_CACHE_KEY, VERSION_SEED_CACHE_KEY])
+        shared_version = versions.get(VERSION_CACHE_KEY, 0)
+        first_shared_version = versions.get(VERSION_SEED_CACHE_KEY, 0) + 1
+
+        with self.lock:
+            self.synced_at = now
+
+            if shared_version == self.version:
+                return self.version
+
+            oldest_version = max(first_shared_version, shared_version - app_settings.TOKENS_REVOCATION_LOG_SIZE + 1)
+
+            if shared_version < self.version:
+                # shared cache flushed
+                first_version = oldest_version
+            else:
+                first_version = max(self.version + 1, oldest_version)
+
+            for chunk_start in range(first_version, shared_version + 1, SYNC_CHUNK_SIZE):
+                chunk_end = min(chunk_start + SYNC_CHUNK_SIZE, shared_version + 1)
+                entries = shared_cache.get_many([self._get_entry_key(version)
+                                                 for version in range(chunk_start, chunk_end)])
+
+                for entry in entries.values():
+                    self._apply(entry)
+
+            logger.debug('revocation list synced from version %s to %s', self.version, shared_version)
+
+            self.version = shared_version
+            self._prune()
+
+        return self.version
+
+    def revoke_device(self, device_id, fingerprint):
+        return self._append(('device', (device_id, fingerprint), None, time.time()))
+
+    def revoke_profile(self, sso_id, sso_rev):
+        """
+        Revokes profile tokens with "sso_rev" lower than given one
+        :param sso_id:
+        :param sso_rev:
+        :return:
+        """
+        return self._append(('profile', str(sso_id), sso_rev, time.time()))
+
+    def is_revoked(self, payload):
+        self.sync()
+
+        if (payload.get('id', None), payload.get('fp', None)) in self.devices:
+            return True
+
+        profile_revocation = self.profiles.get(payload.get(app_settings.USER_ID_CLAIM, None), None)
+
+        if profile_revocation is not None:
+            return payload.get('sso_rev', 0) < profile_revocation[0]
+
+        return False
+
+
+def get_revocation_list():
+    """
+    Returns process revocation list, None if disabled
+    :return:
+    """
+    global _revocation_list
+
+    if not app_settings.TOKENS_REVOCATION_ENABLED:
+        return None
+
+    warn_if_shared_cache_is_process_local('TOKENS_REVOCATION_ENABLED')
+
+    if _revocation_list is None:
+        _revocation_list = RevocationList()
+
+    return _revocation_list
+
+
+def revoke_device_tokens(device_id, fingerprint):
+    revocation_list = get_revocation_list()
+
+    if revocation_list is not None:
+        revocation_list.revoke_device(device_id, fingerprint)
+
+
+def revoke_profile_tokens(sso_id, sso_rev):
+    revocation_list = get_revocation_list()
+
+    if revocation_list is not None:
+        revocation_list.revoke_profile(sso_id, sso_rev)
+
+
+def is_token_revoked(payload):
+    revocation_list = get_revocation_list()
+
+    if revocation_list is None:
+        return False
+
+    return revocation_list.is_revoked(payload)
@@ -1,8 +1,34 @@
+import json
+import time
+
+from unittest import mock
+
+import jwt
+import responses
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from django.test import RequestFactory
 from django.urls import reverse
 
 from rest_framework import status
 
+from django_sso_app.core.apps.devices.models import Device
+from django_sso_app.core.apps.devices.utils import add_profile_device
+from django_sso_app.core.exceptions import AuthenticationFailed, RequestHasValidJwtWithNoDeviceAssociated
+from django_sso_app.core.permissions import is_authenticated, is_django_staff, is_request_user_staff, \
+    StaffPermission
 from django_sso_app.core.tests.factories import UserTestCase
+from django_sso_app.core.tokens.authentication import JWTAuthentication
+from django_sso_app.core.tokens.models import TokenUser
+from django_sso_app.core.tokens.cache import get_tokens_cache
+from django_sso_app.core.cache import get_shared_cache
+from django_sso_app.core.tokens.issuer import issue_tokens
+from django_sso_app.core.tokens.jwks import CACHE_KEY as JWKS_CACHE_KEY, get_jwks_client
+from django_sso_app.core.tokens.parsed import ParsedToken
+from django_sso_app.core.tokens.revocation import RevocationList, VERSION_CACHE_KEY as REVOCATION_VERSION_CACHE_KEY
+from django_sso_app.core.tokens.utils import jwt_decode, jwt_decode_handler, jwt_encode
 
 
 class TestTokens(UserTestCase):
@@ -54,3 +80,384 @@ class TestTokens(UserTestCase):
 
             self.assertEqual(response.status_code, status.HTTP_200_OK)
             self.assertEqual(response.data.get('sso_id'), str(user.sso_app_profile.sso_id))
+
+    def test_verified_jwt_is_cached_until_device_deletion(self):
+        with self.settings(DJANGO_SSO_APP_TOKENS_CACHE_ENABLED=True):
+            user = self._get_new_user()
+            device = self._get_user_device(user)
+            raw_token = self._get_jwt(device, None)
+            other_raw_token = jwt_encode(dict(device.get_jwt_payload(), iat=0), device.apigw_jwt_secret)
+
+            _device, decoded_jwt = jwt_decode(raw_token)
+            jwt_decode(other_raw_token)
+
+            with self.assertNumQueries(0):
+                _cached_device, cached_decoded_jwt = jwt_decode(raw_token)
+
+            self.assertEqual(cached_decoded_jwt, decoded_jwt)
+            self.assertIsNotNone(get_tokens_cache().get(other_raw_token))
+
+            device.delete()
+
+            # every device token is invalidated
+            self.assertIsNone(get_tokens_cache().get(other_raw_token))
+
+            with self.assertRaises(RequestHasValidJwtWithNoDeviceAssociated):
+                jwt_decode(raw_token)
+
+    def test_cached_jwt_is_invalidated_on_profile_rev_update(self):
+        with self.settings(DJANGO_SSO_APP_TOKENS_CACHE_ENABLED=True):
+            user = self._get_new_user()
+            device = self._get_user_device(user)
+            raw_token = self._get_jwt(device, None)
+
+            jwt_decode(raw_token)
+            self.assertIsNotNone(get_tokens_cache().get(raw_token))
+
+            user.sso_app_profile.update_rev(True)
+
+            self.assertIsNone(get_tokens_cache().get(raw_token))
+
+    def test_jwt_verified_during_invalidation_is_not_cached(self):
+        from django_sso_app.core.tokens import utils as tokens_utils
+        from django_sso_app.core.tokens.cache import invalidate_device_tokens
+
+        get_device_keys = tokens_utils._get_device_keys
+
+        def get_device_keys_while_deleting(device_id, *args):
+            # device deleted between versions read and lookup
+            invalidate_device_tokens(device_id)
+
+            return get_device_keys(device_id, *args)
+
+        with self.settings(DJANGO_SSO_APP_TOKENS_CACHE_ENABLED=True):
+            user = self._get_new_user()
+            device = self._get_user_device(user)
+            raw_token = self._get_jwt(device, None)
+
+            with mock.patch.object(tokens_utils, '_get_device_keys', get_device_keys_while_deleting):
+                jwt_decode(raw_token)
+
+            self.assertIsNone(get_tokens_cache().get(raw_token))
+
+            jwt_decode(raw_token)
+
+            self.assertIsNotNone(get_tokens_cache().get(raw_token))
+
+    def test_tokens_cache_is_disabled_by_default(self):
+        self.assertIsNone(get_tokens_cache())
+
+    def test_parsed_token_is_verified_once(self):
+        user = self._get_new_user()
+        device = self._get_user_device(user)
+        parsed_token = ParsedToken(self._get_jwt(device, None))
+
+        self.assertEqual(parsed_token.fingerprint, device.fingerprint)
+        self.assertFalse(parsed_token.is_verified)
+
+        with self.assertRaises(jwt.InvalidSignatureError):
+            ParsedToken(self._get_jwt(device, 'invalid_secret')).verify(device.apigw_jwt_secret)
+
+        decoded_device, decoded_jwt = jwt_decode(parsed_token)
+
+        self.assertTrue(parsed_token.is_verified)
+        self.assertEqual(decoded_device.id, device.id)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(jwt_decode(parsed_token)[1], decoded_jwt)
+
+    @responses.activate
+    def test_app_shape_verifies_asymmetric_jwt_with_backend_jwks(self):
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        private_key_pem = private_key.private_bytes(serialization.Encoding.PEM,
+                                                    serialization.PrivateFormat.PKCS8,
+                                                    serialization.NoEncryption()).decode('utf-8')
+
+        with self.settings(DJANGO_SSO_APP_JWT_ALGORITHM='RS256',
+                           DJANGO_SSO_APP_TOKENS_JWT_PRIVATE_KEY=private_key_pem,
+                           DJANGO_SSO_APP_TOKENS_JWT_KEY_ID='test-key'):
+            response = self._get_client().get(reverse('django_sso_app_token:jwks'))
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual([jwk['kid'] for jwk in response.data['keys']], ['test-key'])
+
+            user = self._get_new_user()
+            device = self._get_user_device(user)
+            raw_token = jwt_encode(device.get_jwt_payload(), device.apigw_jwt_secret)
+            jwks = response.data
+
+        self.assertEqual(jwt.get_unverified_header(raw_token)['kid'], 'test-key')
+
+        with self.settings(DJANGO_SSO_APP_SHAPE='app_apigateway',
+                           DJANGO_SSO_APP_SERVICE_URL='http://example.com',
+                           DJANGO_SSO_APP_BACKEND_DOMAIN='accounts.example.com',
+                           DJANGO_SSO_APP_JWT_ALGORITHM='RS256',
+                           DJANGO_SSO_APP_TOKENS_CACHE_ENABLED=False):
+            get_shared_cache().delete(JWKS_CACHE_KEY)
+            responses.add(responses.GET, get_jwks_client().url, json=jwks)
+
+            _device, decoded_jwt = jwt_decode(raw_token)
+            self.assertEqual(decoded_jwt['sso_id'], str(user.sso_id))
+
+            # public keys are fetched once, verifying backend certificate
+            jwt_decode(raw_token)
+            self.assertEqual(len(responses.calls), 1)
+            self.assertTrue(responses.calls[0].request.req_kwargs['verify'])
+
+            other_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+            with self.assertRaises(jwt.InvalidSignatureError):
+                jwt_decode(jwt.encode(device.get_jwt_payload(), other_key, 'RS256', headers={'kid': 'test-key'}))
+
+            with self.assertRaises(jwt.InvalidSignatureError):
+                jwt_decode(jwt.encode(device.get_jwt_payload(), other_key, 'RS256', headers={'kid': 'other-key'}))
+
+    def test_app_shape_verifies_jwt_with_key_ring(self):
+        keys = ['new::new_secret', 'old:{}:old_secret'.format(int(time.time()) + 3600)]
+
+        with self.settings(DJANGO_SSO_APP_TOKENS_JWT_KEYS=keys):
+            user = self._get_new_user()
+            device = self._get_user_device(user)
+            old_device = add_profile_device(user.sso_app_profile, self._get_random_string(), 'old_secret')
+
+            self.assertEqual(device.apigw_jwt_secret, 'new_secret')
+
+            raw_token = jwt_encode(device.get_jwt_payload(), device.apigw_jwt_secret)
+            old_raw_token = jwt_encode(old_device.get_jwt_payload(), old_device.apigw_jwt_secret)
+
+            self.assertEqual(jwt.get_unverified_header(raw_token)['kid'], 'new')
+            self.assertEqual(jwt.get_unverified_header(old_raw_token)['kid'], 'old')
+
+        app_shape_settings = dict(DJANGO_SSO_APP_SHAPE='app',
+                                  DJANGO_SSO_APP_SERVICE_URL='http://example.com',
+                                  DJANGO_SSO_APP_TOKENS_CACHE_ENABLED=False)
+
+        with self.settings(DJANGO_SSO_APP_TOKENS_JWT_KEYS=keys, **app_shape_settings):
+            self.assertEqual(jwt_decode(raw_token)[1]['fp'], device.fingerprint)
+            self.assertEqual(jwt_decode(old_raw_token)[1]['fp'], old_device.fingerprint)
+
+        expired_keys = ['new::new_secret', 'old:{}:old_secret'.format(int(time.time()) - 1)]
+
+        with self.settings(DJANGO_SSO_APP_TOKENS_JWT_KEYS=expired_keys, **app_shape_settings):
+            self.assertEqual(jwt_decode(raw_token)[1]['fp'], device.fingerprint)
+
+            with self.assertRaises(jwt.InvalidSignatureError):
+                jwt_decode(old_raw_token)
+
+        with self.settings(DJANGO_SSO_APP_TOKENS_JWT_KEYS=keys, DJANGO_SSO_APP_JWT_ALGORITHM='HS512'):
+            hs512_raw_token = jwt_encode(device.get_jwt_payload(), device.apigw_jwt_secret)
+
+            self.assertEqual(jwt.get_unverified_header(hs512_raw_token)['alg'], 'HS512')
+
+            with self.settings(**app_shape_settings):
+                self.assertEqual(jwt_decode(hs512_raw_token)[1]['fp'], device.fingerprint)
+
+                with self.assertRaises(jwt.InvalidAlgorithmError):
+                    jwt_decode(raw_token)
+
+    def test_stateless_token_user_is_loaded_lazily(self):
+        user = self._get_new_user()
+        device = self._get_user_device(user)
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION='Bearer {}'.format(self._get_jwt(device, None)))
+
+        with self.settings(DJANGO_SSO_APP_TOKENS_STATELESS_USER=True):
+            authenticated_user, _auth = JWTAuthentication().authenticate(request)
+
+            with self.assertNumQueries(0):
+                self.assertIsInstance(authenticated_user, TokenUser)
+                self.assertEqual(authenticated_user.sso_id, str(user.sso_id))
+                self.assertTrue(is_authenticated(authenticated_user))
+                self.assertFalse(is_django_staff(authenticated_user))
+
+            with self.assertNumQueries(1):
+                self.assertEqual(authenticated_user.email, user.email)
+                self.assertEqual(authenticated_user.sso_app_profile.sso_id, user.sso_app_profile.sso_id)
+
+            self.assertEqual(authenticated_user, user)
+
+    def test_stateless_token_user_identity_comes_from_claims(self):
+        from django_sso_app.core.apps.groups.models import Group
+        from django_sso_app.core.permissions import is_staff
+
+        user = self._get_new_user()
+        user.sso_app_profile.groups.add(Group.objects.get_or_create(name='staff')[0])
+        device = self._get_user_device(user)
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION='Bearer {}'.format(self._get_jwt(device, None)))
+
+        with self.settings(DJANGO_SSO_APP_TOKENS_STATELESS_USER=True):
+            authenticated_user, _auth = JWTAuthentication().authenticate(request)
+
+            with self.assertNumQueries(0):
+                self.assertTrue(authenticated_user.is_active)
+                self.assertTrue(is_staff(authenticated_user))
+
+            request.user = authenticated_user
+
+            with self.assertNumQueries(0):
+                self.assertTrue(is_request_user_staff(request))
+                self.assertTrue(StaffPermission().has_permission(request, None))
+
+            user.is_active = False
+            user.save()
+            device = self._get_user_device(user)
+            request = RequestFactory().get('/', HTTP_AUTHORIZATION='Bearer {}'.format(self._get_jwt(device, None)))
+
+            with self.assertRaises(AuthenticationFailed):
+                JWTAuthentication().authenticate(request)
+
+    def test_expired_jwt_is_refreshed_from_device(self):
+        user = self._get_new_user()
+        device = self._get_user_device(user)
+
+        with self.settings(DJANGO_SSO_APP_TOKENS_ACCESS_TOKEN_LIFETIME=60):
+            payload = device.get_jwt_payload()
+            self.assertEqual(payload['exp'] - payload['iat'], 60)
+
+            payload['exp'] = payload['iat'] - 1
+            expired_jwt = jwt_encode(payload, device.apigw_jwt_secret)
+
+            with self.assertRaises(jwt.ExpiredSignatureError):
+                jwt_decode(expired_jwt)
+
+            with self.assertRaises(jwt.ExpiredSignatureError):
+                jwt_decode_handler(expired_jwt, device.apigw_jwt_secret, None)
+
+            client = self._get_client()
+            response = client.post(reverse('django_sso_app_token:refresh'), {'token': expired_jwt},
+                                   content_type='application/json')
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+            refreshed_device, refreshed_payload = jwt_decode(response.data['token'])
+
+            self.assertEqual(refreshed_device.id, device.id)
+            self.assertGreater(refreshed_payload['exp'], time.time())
+
+            device.delete()
+
+            response = client.post(reverse('django_sso_app_token:refresh'), {'token': expired_jwt},
+                                   content_type='application/json')
+
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_revocation_list_is_shared_by_version(self):
+        user = self._get_new_user()
+        device = self._get_user_device(user)
+        other_device = self._get_user_device(user)
+        payload = device.get_jwt_payload()
+
+        # another process revocation list copy
+        revocation_list = RevocationList()
+        version = revocation_list.sync(force=True)
+
+        self.assertFalse(revocation_list.is_revoked(payload))
+
+        device.delete()
+
+        self.assertFalse(revocation_list.is_revoked(payload), 'revocation list synced before interval')
+        self.assertGreater(revocation_list.sync(force=True), version)
+        self.assertTrue(revocation_list.is_revoked(payload))
+        self.assertFalse(revocation_list.is_revoked(other_device.get_jwt_payload()))
+
+        old_payload = other_device.get_jwt_payload()
+        user.sso_app_profile.update_rev(True)
+
+        revocation_list.sync(force=True)
+
+        self.assertTrue(revocation_list.is_revoked(old_payload))
+
+        with self.settings(DJANGO_SSO_APP_SHAPE='app', DJANGO_SSO_APP_SERVICE_URL='http://example.com'):
+            with self.assertRaises(RequestHasValidJwtWithNoDeviceAssociated):
+                jwt_decode(jwt_encode(old_payload, 'secret'))
+
+    def test_revocation_list_survives_version_eviction(self):
+        user = self._get_new_user()
+        device = self._get_user_device(user)
+        other_device = self._get_user_device(user)
+
+        revocation_list = RevocationList()
+        device.delete()
+        version = revocation_list.sync(force=True)
+
+        get_shared_cache().delete(REVOCATION_VERSION_CACHE_KEY)
+
+        payload = other_device.get_jwt_payload()
+        other_device.delete()
+
+        self.assertGreater(revocation_list.sync(force=True), version)
+        self.assertTrue(revocation_list.is_revoked(payload))
+
+    def test_staff_user_can_introspect_tokens_batch(self):
+        new_staff_user = self._get_new_staff_user()
+        user = self._get_new_user()
+        device = self._get_user_device(user)
+        other_device = self._get_user_device(user)
+        deleted_device = self._get_user_device(user)
+
+        raw_tokens = [
+            self._get_jwt(device, None),
+            self._get_jwt(other_device, None),
+            self._get_jwt(deleted_device, None),
+            self._get_jwt(device, 'invalid_secret'),
+            'not.a.jwt',
+            jwt_encode(dict((claim, value) for claim, value in device.get_jwt_payload().items() if claim != 'sso_id'),
+                       device.apigw_jwt_secret)
+        ]
+        deleted_device.delete()
+
+        client = self._get_client()
+        response = client.post(reverse('django_sso_app_token:introspect'),
+                               data=json.dumps({'tokens': raw_tokens}),
+                               **self._get_new_api_token_headers(new_staff_user))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('max-age', response['Cache-Control'])
+
+        tokens = response.data['tokens']
+
+        self.assertEqual([token['valid'] for token in tokens], [True, True, False, False, False, False])
+        self.assertEqual(tokens[0]['sso_id'], str(user.sso_id))
+        self.assertEqual(tokens[1]['device_id'], other_device.id)
+        self.assertEqual(tokens[0]['groups'], list(user.sso_app_profile.groups.values_list('name', flat=True)))
+
+        response = client.post(reverse('django_sso_app_token:introspect'),
+                               data=json.dumps({'tokens': raw_tokens}),
+                               **self._get_new_api_token_headers(user))
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_non_object_token_requests_are_rejected(self):
+        staff_token_headers = self._get_new_api_token_headers(self._get_new_staff_user())
+        client = self._get_client()
+
+        for data in ([], 'token', 1):
+            response = client.post(reverse('django_sso_app_token:introspect'), data=json.dumps(data),
+                                   **staff_token_headers)
+
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+            response = client.post(reverse('django_sso_app_token:refresh'), data=json.dumps(data),
+                                   content_type='application/json')
+
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_token_issuer_matches_pyjwt_encoding(self):
+        user = self._get_new_user()
+        devices = [self._get_user_device(user) for _i in range(3)]
+
+        raw_token = jwt_encode(devices[0].get_jwt_payload(), devices[0].apigw_jwt_secret)
+
+        self.assertEqual(jwt.get_unverified_header(raw_token),
+                         jwt.get_unverified_header(self._get_jwt(devices[0], None)))
+        self.assertEqual(jwt.decode(raw_token, devices[0].apigw_jwt_secret, algorithms=['HS256'],
+                                    options={'verify_iss': False}),
+                         devices[0].get_jwt_payload())
+
+        # devices with profiles and users, profiles groups
+        with self.assertNumQueries(2):
+            issued_tokens = issue_tokens(Device.objects.filter(id__in=[device.id for device in devices]))
+
+        self.assertEqual(len(issued_tokens), 3)
+
+        for device, token in issued_tokens:
+            self.assertEqual(jwt_decode(token)[0].id, device.id)
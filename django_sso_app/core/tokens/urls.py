@@ -0,0 +1,13 @@
+from django.conf.urls import url
+from rest_framework.urlpatterns import format_suffix_patterns
+
+from .views import JWKSApiView, TokenRefreshApiView, TokenIntrospectionApiView
+
+
+_urlpatterns = [
+    url(r'^jwks/$', JWKSApiView.as_view(), name='jwks'),
+    url(r'^refresh/$', TokenRefreshApiView.as_view(), name='refresh'),
+    url(r'^introspect/$', TokenIntrospectionApiView.as_view(), name='introspect'),
+]
+
+urlpatterns = (format_suffix_patterns(_urlpatterns), 'django_sso_app_token')
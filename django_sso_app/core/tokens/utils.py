@@ -1,10 +1,20 @@
 import logging
 import jwt
 
+from django.utils.encoding import force_bytes
+
 from rest_framework import HTTP_HEADER_ENCODING
 
+from ..context import get_request_context
 from ..exceptions import RequestHasValidJwtWithNoDeviceAssociated
+from ..logs import log_event, EVENT_REQUEST_JWT
 from .. import app_settings
+from .cache import get_tokens_cache
+from .jwks import get_jwks_signing_key
+from .issuer import get_token_issuer
+from .keys import get_jwt_public_key, get_hmac_key_ring
+from .parsed import ParsedToken, check_expiration
+from .revocation import is_token_revoked
 
 _TOKEN_PREFIXES = tuple(map(lambda x: '{} '.format(x), app_settings.AUTH_HEADER_TYPES))
 logger = logging.getLogger('django_sso_app')
@@ -21,7 +31,7 @@ def get_request_jwt_header(request, encoded=True):
         # Work around django test client oddness
         jwt_header = jwt_header.encode(HTTP_HEADER_ENCODING)
 
-    logger.debug('header JWT "{}"'.format(jwt_header))
+    log_event(logging.DEBUG, EVENT_REQUEST_JWT, 'header JWT "%(jwt)s"', source='header', jwt=jwt_header)
     return jwt_header
 
 
@@ -36,7 +46,7 @@ def get_request_jwt_cookie(request, encoded=True):
         # Work around django test client oddness
         jwt_cookie = jwt_cookie.encode(HTTP_HEADER_ENCODING)
 
-    logger.debug('cookie JWT "{}"'.format(jwt_cookie))
+    log_event(logging.DEBUG, EVENT_REQUEST_JWT, 'cookie JWT "%(jwt)s"', source='cookie', jwt=jwt_cookie)
     return jwt_cookie
 
 
@@ -57,7 +67,7 @@ def get_request_jwt(request, encoded=False):
             logger.debug('request jwt found')
             request_jwt = request_jwt.replace(_found, '')
         else:
-            logger.debug('"{}" absent on "{}"'.format(_TOKEN_PREFIXES, request_jwt_header))
+            logger.debug('"%s" absent on "%s"', _TOKEN_PREFIXES, request_jwt_header)
             return
 
     if request_jwt is not None and encoded and isinstance(request_jwt, str):
@@ -67,15 +77,40 @@ def get_request_jwt(request, encoded=False):
     return request_jwt
 
 
+def get_request_parsed_token(request, raw_token=None):
+    """
+    Returns request ParsedToken, parsed once per request and stored on request object
+    :param request:
+    :param raw_token: token to parse (defaults to request jwt)
+    :return:
+    """
+    context = get_request_context(request)
+    parsed_token = context.parsed_token
+
+    if raw_token is None:
+        if parsed_token is not None:
+            return parsed_token
+
+        raw_token = get_request_jwt(request)
+
+        if raw_token is None:
+            return None
+
+    elif parsed_token is not None and parsed_token.raw == force_bytes(raw_token):
+        return parsed_token
+
+    parsed_token = ParsedToken(raw_token)
+    context.parsed_token = parsed_token
+
+    return parsed_token
+
+
 def get_request_jwt_fingerprint(request):
-    received_jwt = get_request_jwt(request)
-    if received_jwt is None:
+    parsed_token = get_request_parsed_token(request)
+    if parsed_token is None:
         raise KeyError('No token specified')
 
-    unverified_payload = jwt.decode(received_jwt, None,
-                                    options={"verify_signature": False},
-                                    algorithms=[app_settings.JWT_ALGORITHM])
-    return unverified_payload.get('fp')
+    return parsed_token.fingerprint
 
 
 def jwt_decode_handler(token, secret_key, issuer, verify=True):
@@ -93,7 +128,7 @@ def jwt_decode_handler(token, secret_key, issuer, verify=True):
         'verify_signature': verify
     }
 
-    return jwt.decode(
+    payload = jwt.decode(
         token,
         secret_key,
         options=options,
@@ -103,45 +138,277 @@ def jwt_decode_handler(token, secret_key, issuer, verify=True):
         algorithms=[app_settings.JWT_ALGORITHM]
     )
 
+    # same expiration check as jwt_decode
+    check_expiration(payload)
 
-def jwt_encode_handler(payload, secret_key):
+    return payload
+
+
+def jwt_encode_handler(payload, secret_key, headers=None):
     return jwt.encode(
         payload,
         secret_key,
-        app_settings.JWT_ALGORITHM
+        app_settings.JWT_ALGORITHM,
+        headers=headers
     )
 
 
 def jwt_encode(payload, secret):
-    return jwt_encode_handler(payload, secret)
+    return get_token_issuer().issue_token(payload, secret)
 
 
-def jwt_decode(raw_token, verify=True):
-    if app_settings.BACKEND_ENABLED:
-        from ..apps.devices.models import Device
+def _get_lazy_device(device_id, fingerprint):
+    from django.utils.functional import SimpleLazyObject
+    from ..apps.devices.models import Device
 
-        logger.debug('decode backend jwt')
-        unverified_payload = jwt.decode(raw_token, None,
-                                        options={"verify_signature": False},
-                                        algorithms=[app_settings.JWT_ALGORITHM])
+    return SimpleLazyObject(lambda: Device.objects.get(id=device_id, fingerprint=fingerprint))
 
-        try:
-            device_id = unverified_payload['id']
-            fingerprint = unverified_payload['fp']
-            device = Device.objects.get(id=device_id,
-                                        fingerprint=fingerprint)
 
-        except Device.DoesNotExist:
-            logger.warning('no device with "{}:{}" found in db, raising'.format(device_id, fingerprint))
+def _get_device_keys(device_id, fingerprint, devices=None):
+    """
+    Returns (device, secret, key) from preloaded devices, device keys store or db
+    :param device_id:
+    :param fingerprint:
+    :param devices:
+    :return:
+    """
+    from ..apps.devices.models import Device
+    from ..apps.devices.keys import get_device_key_store
+
+    if devices is not None:
+        device = devices.get((device_id, fingerprint), None)
+
+        if device is None:
+            logger.info('no device with "%s:%s" preloaded, raising', device_id, fingerprint)
 
             raise RequestHasValidJwtWithNoDeviceAssociated(device_id)
 
-        return device, jwt_decode_handler(raw_token, device.apigw_jwt_secret, device.apigw_jwt_key, verify)
+        return device, device.apigw_jwt_secret, device.apigw_jwt_key
+
+    device_key_store = get_device_key_store()
+    device_keys = device_key_store.get(device_id, fingerprint) if device_key_store is not None else None
+
+    if device_keys is not None:
+        logger.debug('device "%s" keys found in store', device_id)
+
+        device_secret, device_key = device_keys
+
+        return _get_lazy_device(device_id, fingerprint), device_secret, device_key
+
+    try:
+        device = Device.objects.get(id=device_id,
+                                    fingerprint=fingerprint)
+
+    except Device.DoesNotExist:
+        logger.warning('no device with "%s:%s" found in db, raising', device_id, fingerprint)
+
+        raise RequestHasValidJwtWithNoDeviceAssociated(device_id)
+
+    if device_key_store is not None:
+        device_key_store.set(device)
+
+    return device, device.apigw_jwt_secret, device.apigw_jwt_key
+
+
+def jwt_decode(raw_token, verify=True, devices=None):
+    """
+    Decodes (and verifies) raw token or ParsedToken, returns (device, payload) tuple
+    :param raw_token:
+    :param verify:
+    :param devices: preloaded {(id, fingerprint): device} dict (backend shapes), replaces device lookup
+    :return:
+    """
+    device, payload = _jwt_decode(raw_token, verify, devices)
+
+    if verify and is_token_revoked(payload):
+        logger.info('revoked jwt for device "%s"', payload.get('id', None))
+
+        raise RequestHasValidJwtWithNoDeviceAssociated(payload.get('id', None))
+
+    return device, payload
+
+
+def _jwt_decode(raw_token, verify=True, devices=None):
+    if isinstance(raw_token, ParsedToken):
+        parsed_token = raw_token
+
+        if parsed_token.is_verified:
+            check_expiration(parsed_token.verified_claims)
+
+            return parsed_token.device, parsed_token.verified_claims
+    else:
+        parsed_token = None
+
+    tokens_cache = get_tokens_cache()
+
+    if tokens_cache is not None:
+        cached_token = tokens_cache.get(raw_token.raw if parsed_token is not None else raw_token)
+
+        if cached_token is not None:
+            device_id, fingerprint, payload = cached_token
+            logger.debug('cached jwt')
+
+            if verify:
+                check_expiration(payload)
+
+            device = _get_lazy_device(device_id, fingerprint) if device_id is not None else None
+
+            if parsed_token is not None:
+                parsed_token.device = device
+                parsed_token.verified_claims = payload
+
+            return device, payload
+
+    if parsed_token is None:
+        parsed_token = ParsedToken(raw_token)
+
+    if app_settings.BACKEND_ENABLED:
+        logger.debug('decode backend jwt')
+
+        device_id = parsed_token.unverified_claims['id']
+        fingerprint = parsed_token.unverified_claims['fp']
+        # read before device lookup
+        versions = tokens_cache.get_versions(device_id, parsed_token.unverified_claims) \
+            if tokens_cache is not None else None
+
+        if verify and app_settings.JWT_ASYMMETRIC and 'exp' in parsed_token.unverified_claims:
+            # expiring token, verified with public key only, device is checked on refresh
+            payload = parsed_token.verify(get_jwt_public_key())
+            device = parsed_token.device = _get_lazy_device(device_id, fingerprint)
+
+            if tokens_cache is not None:
+                tokens_cache.set(parsed_token.raw, device_id, fingerprint, payload, versions)
+
+            return device, payload
+
+        device, device_secret, device_key = _get_device_keys(device_id, fingerprint, devices)
+
+        parsed_token.device = device
+
+        if not verify:
+            return device, parsed_token.unverified_claims
+
+        if app_settings.JWT_ASYMMETRIC:
+            payload = parsed_token.verify(get_jwt_public_key(), device_key)
+        else:
+            payload = parsed_token.verify(device_secret, device_key)
+
+        if tokens_cache is not None:
+            tokens_cache.set(parsed_token.raw, device_id, fingerprint, payload, versions)
+
+        return device, payload
 
     else:
         logger.debug('decode app jwt')
 
-        if app_settings.APIGATEWAY_ENABLED:
-            return None, jwt_decode_handler(raw_token, app_settings.TOKENS_JWT_SECRET, None, False)
+        if not verify or (app_settings.APIGATEWAY_ENABLED and not app_settings.JWT_ASYMMETRIC):
+            return None, parsed_token.unverified_claims
+
+        versions = tokens_cache.get_versions(None, parsed_token.unverified_claims) \
+            if tokens_cache is not None else None
+
+        if app_settings.JWT_ASYMMETRIC:
+            # verifying locally with backend published public keys
+            payload = parsed_token.verify(get_jwks_signing_key(parsed_token.kid))
         else:
-            return None, jwt_decode_handler(raw_token, app_settings.TOKENS_JWT_SECRET, None, verify)
+            # O(1) kid lookup, retired keys keep verifying until they expire
+            key = get_hmac_key_ring().get_key(parsed_token.kid)
+
+            if key is None:
+                raise jwt.InvalidSignatureError('Unknown or expired key "{}"'.format(parsed_token.kid))
+
+            payload = parsed_token.verify(key, prepared=True)
+
+        if tokens_cache is not None:
+            tokens_cache.set(parsed_token.raw, None, parsed_token.fingerprint, payload, versions)
+
+        return None, payload
+
+
+def jwt_refresh(raw_token):
+    """
+    Re-issues (possibly expired) token from its db device, returns (device, token) tuple
+    :param raw_token:
+    :return:
+    """
+    from ..apps.devices.models import Device
+
+    parsed_token = raw_token if isinstance(raw_token, ParsedToken) else ParsedToken(raw_token)
+
+    device_id = parsed_token.unverified_claims['id']
+    fingerprint = parsed_token.unverified_claims['fp']
+
+    try:
+        device = Device.objects.select_related('profile').get(id=device_id, fingerprint=fingerprint, is_active=True)
+
+    except Device.DoesNotExist:
+        logger.info('can not refresh jwt, no device with "%s:%s" found in db', device_id, fingerprint)
+
+        raise RequestHasValidJwtWithNoDeviceAssociated(device_id)
+
+    if app_settings.JWT_ASYMMETRIC:
+        parsed_token.verify(get_jwt_public_key(), device.apigw_jwt_key, verify_exp=False)
+    else:
+        parsed_token.verify(device.apigw_jwt_secret, device.apigw_jwt_key, verify_exp=False)
+
+    return device, jwt_encode(device.get_jwt_payload(), device.apigw_jwt_secret)
+
+
+def introspect_tokens(raw_tokens):
+    """
+    Verifies tokens batch loading all devices with one query, returns a list of token infos
+    :param raw_tokens:
+    :return:
+    """
+    from ..apps.devices.models import Device
+
+    parsed_tokens = []
+    for raw_token in raw_tokens:
+        try:
+            parsed_tokens.append(ParsedToken(raw_token))
+        except jwt.DecodeError as e:
+            parsed_tokens.append(e)
+
+    devices_ids = set(parsed_token.device_id for parsed_token in parsed_tokens
+                      if isinstance(parsed_token, ParsedToken) and parsed_token.device_id is not None)
+
+    devices = {}
+    for device in Device.objects.filter(id__in=devices_ids) \
+                                .select_related('profile') \
+                                .prefetch_related('profile__groups'):
+        devices[(device.id, device.fingerprint)] = device
+
+    infos = []
+    for parsed_token in parsed_tokens:
+        if not isinstance(parsed_token, ParsedToken):
+            infos.append({'valid': False, 'error': '{}'.format(parsed_token)})
+            continue
+
+        try:
+            _device, payload = jwt_decode(parsed_token, verify=True, devices=devices)
+
+        except RequestHasValidJwtWithNoDeviceAssociated:
+            infos.append({'valid': False, 'error': 'No device associated'})
+
+        except (KeyError, jwt.InvalidTokenError) as e:
+            infos.append({'valid': False, 'error': '{}'.format(e)})
+
+        else:
+            sso_id = payload.get(app_settings.USER_ID_CLAIM, None)
+
+            if sso_id is None:
+                infos.append({'valid': False, 'error': 'Token contained no recognizable user identification'})
+                continue
+
+            device = devices.get((payload.get('id', None), payload.get('fp', None)), None)
+
+            infos.append({
+                'valid': True,
+                'sso_id': sso_id,
+                'sso_rev': payload.get('sso_rev', 0),
+                'groups': [group.name for group in device.profile.groups.all()] if device is not None else None,
+                'device_id': payload.get('id', None),
+                'exp': payload.get('exp', None)
+            })
+
+    return infos
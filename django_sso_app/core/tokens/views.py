@@ -0,0 +1,108 @@
+import time
+import logging
+
+import jwt
+
+from django.utils.cache import patch_cache_control
+
+from rest_framework import permissions
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from ..exceptions import RequestHasValidJwtWithNoDeviceAssociated
+from ..permissions import StaffPermission
+from ..utils import set_cookie
+from .. import app_settings
+from .keys import get_jwks
+from .utils import get_request_jwt, jwt_refresh, introspect_tokens
+
+logger = logging.getLogger('django_sso_app')
+
+
+class JWKSApiView(APIView):
+    """
+    Public JSON Web Key Set used to verify asymmetric JWTs.
+    """
+
+    authentication_classes = ()
+    permission_classes = (permissions.AllowAny, )
+
+    def get(self, request, *args, **kwargs):
+        response = Response(get_jwks())
+        patch_cache_control(response, public=True, max_age=app_settings.TOKENS_JWKS_CACHE_TIMEOUT)
+
+        return response
+
+
+class TokenRefreshApiView(APIView):
+    """
+    Re-issues (expired) request JWT ("token" body param, header or cookie) if its device still exists.
+    """
+
+    authentication_classes = ()
+    permission_classes = (permissions.AllowAny, )
+
+    def post(self, request, *args, **kwargs):
+        if not isinstance(request.data, dict):
+            return Response({'detail': 'Malformed request'}, status=status.HTTP_400_BAD_REQUEST)
+
+        raw_token = request.data.get('token', None) or get_request_jwt(request)
+
+        if raw_token is None:
+            return Response({'detail': 'No token specified'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            _device, token = jwt_refresh(raw_token)
+
+        except (KeyError, jwt.DecodeError):
+            logger.info('Malformed refresh JWT')
+
+            return Response({'detail': 'Malformed token'}, status=status.HTTP_400_BAD_REQUEST)
+
+        except (jwt.InvalidTokenError, RequestHasValidJwtWithNoDeviceAssociated):
+            logger.info('Invalid refresh JWT')
+
+            return Response({'detail': 'Invalid token'}, status=status.HTTP_401_UNAUTHORIZED)
+
+        response = Response({'token': token})
+        set_cookie(response, app_settings.JWT_COOKIE_NAME, token)
+
+        return response
+
+
+class TokenIntrospectionApiView(APIView):
+    """
+    Verifies a batch of JWTs ("tokens" body param), returns validity, sso_id, sso_rev, groups and device id.
+    """
+
+    permission_classes = (StaffPermission, )
+
+    def post(self, request, *args, **kwargs):
+        if not isinstance(request.data, dict):
+            return Response({'detail': 'Malformed request'}, status=status.HTTP_400_BAD_REQUEST)
+
+        raw_tokens = request.data.get('tokens', None)
+
+        if not isinstance(raw_tokens, list) or not len(raw_tokens):
+            return Response({'detail': 'No tokens specified'}, status=status.HTTP_400_BAD_REQUEST)
+
+        max_tokens = app_settings.TOKENS_INTROSPECTION_MAX_TOKENS
+
+        if len(raw_tokens) > max_tokens:
+            return Response({'detail': 'Too many tokens (max {})'.format(max_tokens)},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        tokens = introspect_tokens(raw_tokens)
+
+        # results can be cached until the first valid token expires
+        max_age = app_settings.TOKENS_INTROSPECTION_MAX_AGE
+        now = int(time.time())
+        for token in tokens:
+            if token['valid'] and token['exp'] is not None:
+                max_age = max(0, min(max_age, token['exp'] - now))
+
+        response = Response({'tokens': tokens})
+        patch_cache_control(response, private=True, max_age=max_age)
+
+        return response
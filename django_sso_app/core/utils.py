@@ -1,4 +1,5 @@
 import os
+import hashlib
 import logging
 import datetime
 import binascii
@@ -9,11 +10,14 @@ from django.core.management.utils import get_random_secret_key
 from django.utils.http import urlencode
 from django.http import HttpResponseRedirect
 from django.conf import settings
+from django.utils.encoding import force_bytes
 
-from .tokens.utils import logger
 from .exceptions import (ProfileIncompleteException, DectivatedUserException, UnsubscribedUserException,
                          DjangoStaffUsersCanNotLoginException, ServiceSubscriptionRequiredException,
                          AnonymousUserException)
+from .cache import get_shared_cache
+from .context import get_request_context, REQUEST_KEYS
+from .metrics import CACHE_REQUESTS
 from .permissions import is_authenticated, is_django_staff
 from . import app_settings
 
@@ -70,7 +74,7 @@ def invalidate_cookie(response, key):
 
 def set_session_key(request, key, value):
     """
-    Sets django sessions request key
+    Sets django sessions request key (request context slot for SSO keys)
     :param request:
     :param key:
     :param value:
@@ -79,12 +83,17 @@ def set_session_key(request, key, value):
 
     #request.session[key] = value
 
-    setattr(request, key, value)
+    slot = REQUEST_KEYS.get(key, None)
+
+    if slot is None:
+        setattr(request, key, value)
+    else:
+        setattr(get_request_context(request), slot, value)
 
 
 def get_session_key(request, key, default=None):
     """
-    Gets django sessions request key
+    Gets django sessions request key (request context slot for SSO keys)
     :param request:
     :param key:
     :param default:
@@ -93,7 +102,14 @@ def get_session_key(request, key, default=None):
 
     #return request.session.get(key, default)
 
-    return getattr(request, key, default)
+    slot = REQUEST_KEYS.get(key, None)
+
+    if slot is None:
+        return getattr(request, key, default)
+
+    value = getattr(get_request_context(request), slot)
+
+    return default if value is None else value
 
 
 def redirect_to_profile_complete(user):
@@ -103,9 +119,7 @@ def redirect_to_profile_complete(user):
         _qs = urlencode({'next': app_settings.SERVICE_URL})
         url = '{}{}?{}'.format(app_settings.BACKEND_URL, app_settings.PROFILE_COMPLETE_URL, _qs)
 
-    logger.info('User {} must complete profile,'
-                ' redirecting to {} ...'
-                .format(user, url))
+    logger.info('User %s must complete profile, redirecting to %s ...', user, url)
 
     response = HttpResponseRedirect(redirect_to=url)
 
@@ -122,21 +136,55 @@ def redirect_to_service_subscription(user, service_url=None):
         _qs = urlencode({'next': service_url})
         url = '{}{}?{}'.format(app_settings.BACKEND_URL, app_settings.LOGIN_URL, _qs)
 
-    logger.info('User {} must agree to the Terms of Service,'
-                ' redirecting to {} ...'
-                .format(user, url))
+    logger.info('User %s must agree to the Terms of Service, redirecting to %s ...', user, url)
 
     response = HttpResponseRedirect(redirect_to=url)
 
     raise ServiceSubscriptionRequiredException(response)
 
 
-def check_user_can_login(user, skip_profile_completion_checks=False, skip_service_subscription_checks=False):
+def get_login_eligibility(profile):
+    """
+    Returns profile login eligibility snapshot (unsubscribed, incomplete, must_subscribe),
+    cached by (sso_id, sso_rev, SERVICE_URL)
+    :param profile:
+    :return:
+    """
+    sso_rev = profile.sso_rev
+    cache_key = None
+
+    if isinstance(sso_rev, int):  # not an F() expression
+        cache_key = 'dssoa:login:{}:{}:{}'.format(profile.sso_id, sso_rev,
+                                                  hashlib.sha1(force_bytes(app_settings.SERVICE_URL)).hexdigest())
+        eligibility = get_shared_cache().get(cache_key)
+
+        if eligibility is not None:
+            CACHE_REQUESTS.inc('login_eligibility', 'hit')
+
+            return eligibility
+
+        CACHE_REQUESTS.inc('login_eligibility', 'miss')
+
+    eligibility = {
+        'unsubscribed': profile.is_unsubscribed,
+        'incomplete': profile.is_incomplete,
+        'must_subscribe': profile.must_subscribe
+    }
+
+    if cache_key is not None:
+        get_shared_cache().set(cache_key, eligibility, app_settings.LOGIN_ELIGIBILITY_CACHE_TIMEOUT)
+
+    return eligibility
+
+
+def check_user_can_login(user, skip_profile_completion_checks=False, skip_service_subscription_checks=False,
+                         cached=False):
     """
     Check user login ability
     :param user:
     :param skip_profile_completion_checks:
     :param skip_service_subscription_checks:
+    :param cached: use cached profile login eligibility snapshot
     :return:
     """
     if is_authenticated(user):
@@ -144,6 +192,17 @@ def check_user_can_login(user, skip_profile_completion_checks=False, skip_servic
             raise DjangoStaffUsersCanNotLoginException()
         elif not user.is_active:
             raise DectivatedUserException()
+        elif cached:
+            eligibility = get_login_eligibility(user.sso_app_profile)
+
+            if eligibility['unsubscribed']:
+                raise UnsubscribedUserException()
+            else:
+                if not skip_profile_completion_checks and eligibility['incomplete']:
+                    redirect_to_profile_complete(user)
+
+                if not skip_service_subscription_checks and eligibility['must_subscribe']:
+                    redirect_to_service_subscription(user)
         else:
             if user.sso_app_profile.is_unsubscribed:
                 raise UnsubscribedUserException()
@@ -16,9 +16,10 @@ from allauth.account.adapter import get_adapter
 from allauth.socialaccount import views as allauth_socialaccount_views
 
 from .apps.devices.utils import renew_response_jwt
-from .permissions import is_django_staff, is_authenticated, is_staff
+from .permissions import is_django_staff, is_authenticated, is_request_user_staff
 from .tokens.utils import get_request_jwt
-from .utils import set_cookie, invalidate_cookie, set_session_key, get_session_key, get_random_fingerprint
+from .context import get_request_context
+from .utils import set_cookie, invalidate_cookie, get_random_fingerprint
 from .mixins import WebpackBuiltTemplateViewMixin
 from . import app_settings
 
@@ -48,7 +49,7 @@ class DjangoSsoAppBaseViewMixin:
                     logger.info('From browser as same user "{}"'.format(user))
                     renew_response_jwt(received_jwt, user, self.request, response)
 
-                elif not is_same_user and is_staff(requesting_user):
+                elif not is_same_user and is_request_user_staff(self.request):
                     # returns user jwt to staff user  #Q!
                     logger.info('From browser as staff user "{}"'.format(requesting_user))
                     renew_response_jwt(received_jwt, user, self.request, response)
@@ -75,7 +76,7 @@ class DjangoSsoAppViewMixin(DjangoSsoAppBaseViewMixin):
     def get_response_with_cookie(request, response):
         if is_authenticated(request.user):
             if not is_django_staff(request.user):
-                token = get_session_key(request, '__dssoa__jwt_token')
+                token = get_request_context(request).jwt_token
                 set_cookie(response, app_settings.JWT_COOKIE_NAME, token)
 
         return response
@@ -105,7 +106,7 @@ class LoginView(allauth_account_views.LoginView, DjangoSsoAppViewMixin, WebpackB
         logger.info('Logging in')
 
         try:
-            set_session_key(request, '__dssoa__device__fingerprint', self.get_request_fingerprint(request))
+            get_request_context(request).device_fingerprint = self.get_request_fingerprint(request)
             response = super(LoginView, self).post(request, *args, **kwargs)
             location = response.get('location', None)
             if location == reverse('account_email_verification_sent'):
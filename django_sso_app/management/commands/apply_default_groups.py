@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from django_sso_app.core.apps.groups.utils import apply_default_groups_in_bulk
+
+
+class Command(BaseCommand):
+    help = 'Applies default user and profile groups to all users (set based, updated profiles rev is increased)'
+
+    def handle(self, *args, **options):
+        added_user_memberships, added_profile_memberships, removed_profile_memberships = \
+            apply_default_groups_in_bulk()
+
+        self.stdout.write(self.style.SUCCESS('Added {} user groups memberships'.format(added_user_memberships)))
+        self.stdout.write(self.style.SUCCESS('Added {} profile groups memberships'.format(added_profile_memberships)))
+        self.stdout.write(self.style.SUCCESS('Removed {} profile groups memberships'
+                                             .format(removed_profile_memberships)))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from django_sso_app.core.apps.users.utils import sync_remote_users
+
+
+class Command(BaseCommand):
+    help = 'Updates local users with outdated sso_rev from remote backend revisions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--create', action='store_true', help='Replicate remote users missing locally')
+        parser.add_argument('--restart', action='store_true', help='Ignore interrupted sync cursor')
+
+    def handle(self, *args, **options):
+        stats = sync_remote_users(create=options['create'], resume=not options['restart'])
+
+        self.stdout.write(self.style.SUCCESS('Users synced: {pages} pages, {checked} checked, {created} created, '
+                                             '{updated} updated, {failed} failed'.format(**stats)))
@@ -58,6 +58,9 @@ setup(
     ],
     include_package_data=True,
     install_requires=requirements,
+    extras_require={
+        'async': ['httpx'],
+    },
     license="MIT",
     zip_safe=False,
     keywords='django-sso-app',